@@ -1,6 +1,8 @@
 from __future__ import annotations
 
+import datetime
 import logging
+import math
 from pathlib import Path
 from time import sleep
 
@@ -23,12 +25,16 @@ from utils import chatgpt
 from utils.app_settings import AppSettings
 from utils.chatgpt import try_parse_response
 from utils.command import handle_command
+from utils.history_compaction import HistoryCompactor
 from utils.human_interaction import (
     tell_human,
     ask_human,
     present_bot_response_command,
     typewriter_effect,
 )
+from utils.conversation_writer import ConversationWriter
+from utils.conversation_catalog import CATALOG_SORT_KEYS, get_conversation_catalog
+from utils.conversation_forks import fork_conversation
 from utils.conversations import (
     available_conversations,
     load_conversation,
@@ -37,12 +43,103 @@ from utils.conversations import (
 
 import gettext
 
-from utils.query import generate_gpt_query, count_tokens
+from utils.query import generate_gpt_query
+from utils.telemetry import log_prompt_telemetry
+from utils.tokenizer import count_tokens
 from utils.storage import load_key_storage_backend, load_file_storage_backend
 
 _ = gettext.gettext
 
 
+def choose_conversation(app_settings: AppSettings, logger: logging.Logger) -> str:
+    """Lets the human page through the saved conversations and choose one
+    Returns:
+        the id of the chosen conversation
+    """
+    catalog = get_conversation_catalog(app_settings, logger=logger)
+    page_size = app_settings.conversation_page_size
+    sort_by = app_settings.conversation_sort
+    n_pages = math.ceil(len(catalog) / page_size)
+    page = 0
+    while True:
+        offset = page * page_size
+        infos = available_conversations(
+            app_settings=app_settings,
+            logger=logger,
+            sort_by=sort_by,
+            # the newest, largest, ... first but names alphabetically
+            descending=sort_by != "name",
+            offset=offset,
+            limit=page_size,
+        )
+        tell_human(
+            _(
+                "You have the following conversations started ({first}-{last} of {total}, sorted by {sort_by}):"
+            ).format(
+                first=offset + 1,
+                last=offset + len(infos),
+                total=len(catalog),
+                sort_by=sort_by,
+            ),
+            app_settings=app_settings,
+        )
+        for info in infos:
+            tell_human(
+                _(
+                    "- {conv} ({n_messages} messages, {n_tokens} tokens, {size_kb:.1f} KB, {modified:%Y-%m-%d %H:%M})"
+                ).format(
+                    conv=info.conversation_id,
+                    n_messages=info.n_messages,
+                    n_tokens=info.total_tokens,
+                    size_kb=info.size_bytes / 1024,
+                    modified=datetime.datetime.fromtimestamp(info.modified_ts),
+                ),
+                app_settings=app_settings,
+            )
+
+        answer = ask_human(
+            _(
+                "Which conversation do you want to continue? "
+                "(`n`: next page, `p`: previous page, `sort <modified|name|messages|tokens|size>`, "
+                "`fork <conversation>`: continue a copy)"
+            ),
+            app_settings=app_settings,
+        )
+        if answer == "n":
+            page = min(page + 1, n_pages - 1)
+        elif answer == "p":
+            page = max(page - 1, 0)
+        elif answer.startswith("sort "):
+            key = answer[len("sort ") :].strip()
+            if key in CATALOG_SORT_KEYS:
+                sort_by = key
+                page = 0
+            else:
+                tell_human(_("Cannot sort by `{key}`.").format(key=key), app_settings=app_settings)
+        elif answer.startswith("fork "):
+            parent_id = answer[len("fork ") :].strip()
+            if parent_id in catalog:
+                fork_id = fork_conversation(parent_id, app_settings=app_settings, logger=logger)
+                tell_human(
+                    _("Continuing with the fork `{fork}` of `{conv}`.").format(
+                        fork=fork_id, conv=parent_id
+                    ),
+                    app_settings=app_settings,
+                )
+                return fork_id
+            tell_human(
+                _("There is no conversation `{conv}`.").format(conv=parent_id),
+                app_settings=app_settings,
+            )
+        elif answer in catalog:
+            return answer
+        # always lower case to make it more accessible
+        elif answer.lower() in catalog:
+            return answer.lower()
+        else:
+            tell_human(_("Invalid option. Please try again."), app_settings=app_settings)
+
+
 def initiate_conversation(
     app_settings: AppSettings, logger: logging.Logger
 ) -> ChatContext:
@@ -51,14 +148,14 @@ def initiate_conversation(
     if app_settings.model not in [model["id"] for model in available_models]:
         raise SettingsException(f"Model {app_settings.model} is not available. ")
 
-    available_conversation_ids = available_conversations(app_settings=app_settings)
+    catalog = get_conversation_catalog(app_settings, logger=logger)
 
     tell_human(_("Welcome to your personal assistant!\n"), app_settings=app_settings)
     conversation: ChatContext | None = None
     typewrite_style = CliFormat(
         delay=0.01,
     )
-    if available_conversation_ids:
+    if len(catalog):
         try:
             load = ask_human(
                 _("Do you want to continue an existing conversation?"),
@@ -88,25 +185,10 @@ def initiate_conversation(
             load = _("no")
 
         if load in (_("yes"), _("y"), _("")):
-            tell_human(
-                _("You have the following conversations started:"),
-                app_settings=app_settings,
-            )
-
-            # show available conversations
-            for conv in available_conversation_ids:
-                tell_human(f"- {conv}", app_settings=app_settings)
-
             try:
-                conversation_id = ask_human(
-                    _("Which conversation do you want to continue? "),
-                    options=available_conversation_ids,
-                    app_settings=app_settings,
-                    repeat_until_valid=True,
+                conversation_id = choose_conversation(
+                    app_settings=app_settings, logger=logger
                 )
-
-                # always lower case to make it more accessible
-                conversation_id = conversation_id.lower()
             except Exception as e:
                 tell_human(
                     _(
@@ -193,6 +275,10 @@ def run_loop(conversation: ChatContext, logger: logging.Logger):
     )
 
     app_settings = conversation.settings
+    compactor = HistoryCompactor(ctx=conversation, logger=logger)
+    writer = ConversationWriter(
+        ctx=conversation, logger=logger, background=app_settings.save_in_background
+    )
 
     tell_human(
         _("Hello {name}! Conversation {conv} started.").format(
@@ -223,15 +309,12 @@ def run_loop(conversation: ChatContext, logger: logging.Logger):
             user_turn = isinstance(conversation.message_history[-1], GptResponse)
 
         if not user_turn:
-            message_for_bot = generate_gpt_query(ctx=conversation, logger=logger)
+            query = generate_gpt_query(ctx=conversation, logger=logger)
+            logger.debug(f"Query tokens per section: {query.section_tokens}")
             tell_human(
                 _(
                     "Transmitting query with {n_tokens} tokens".format(
-                        n_tokens=count_tokens(
-                            message_for_bot,
-                            model=conversation.settings.model,
-                            logger=logger,
-                        )
+                        n_tokens=query.n_tokens
                     )
                 ),
                 app_settings=app_settings,
@@ -241,23 +324,25 @@ def run_loop(conversation: ChatContext, logger: logging.Logger):
                 spinner = Halo(text=_("Thinking..."), spinner="dots")
                 spinner.start()
             response: str | None = None
+            response_tokens: int | None = None
             try:
                 response = chatgpt.send_message(
-                    user_message=message_for_bot,
+                    user_message=query.prompt,
                     logger=logger,
                     system_role=conversation.ai_role,
                     model=conversation.settings.model,
                 )
                 spinner.stop()
 
+                response_tokens = count_tokens(
+                    response,
+                    model=conversation.settings.model,
+                    logger=logger,
+                )
                 tell_human(
                     _(
                         "Received a response with {n_tokens} tokens".format(
-                            n_tokens=count_tokens(
-                                response,
-                                model=conversation.settings.model,
-                                logger=logger,
-                            )
+                            n_tokens=response_tokens
                         )
                     ),
                     app_settings=app_settings,
@@ -273,6 +358,15 @@ def run_loop(conversation: ChatContext, logger: logging.Logger):
             finally:
                 spinner.stop()
 
+            log_prompt_telemetry(
+                ctx=conversation,
+                query=query,
+                response_tokens=response_tokens,
+                logger=logger,
+            )
+            # summarize what dropped out of the history while the human takes their turn
+            compactor.schedule(evicted_until=query.history_start_index)
+
             if not response:
                 res = ask_human(
                     _("Try again? (y/n) [y]"),
@@ -293,7 +387,7 @@ def run_loop(conversation: ChatContext, logger: logging.Logger):
                 )
                 conversation.message_history.append(parsed)
                 logger.debug(f"Saving conversation {conversation.conversation_id}")
-                save_conversation(ctx=conversation)
+                writer.save()
         else:  # User turn
             bot_response = conversation.message_history[-1]
             present_bot_response_command(
@@ -379,7 +473,7 @@ def run_loop(conversation: ChatContext, logger: logging.Logger):
                 )
             )
             logger.debug("Saving conversation...")
-            save_conversation(ctx=conversation)
+            writer.save()
 
 
 
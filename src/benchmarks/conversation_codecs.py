@@ -0,0 +1,89 @@
+"""Compares the storage codecs of the message history (size, save and load latency).
+
+Run from the `src` directory:
+    python -m benchmarks.conversation_codecs
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+
+from exceptions.settings_exception import SettingsException
+from utils.conversation_codec import (
+    COMPRESSIONS,
+    SERIALIZERS,
+    RecordCodec,
+    decode_record,
+    split_records,
+)
+from utils.conversation_journal import SNAPSHOT_FILE_NAME
+from utils.history_store import HISTORY_FILE_NAME, parse_message
+
+
+def _load_messages(path: Path) -> list[dict]:
+    """Loads the messages of all conversations below `path` (as dicts)"""
+    messages = []
+    for folder in sorted(path.iterdir()):
+        if (folder / HISTORY_FILE_NAME).is_file():
+            with open(folder / HISTORY_FILE_NAME, "rb") as f:
+                data = f.read()
+            ends, _ = split_records(data)
+            messages += [
+                decode_record(data[start:end]) for start, end in zip([0, *ends], ends)
+            ]
+        elif (folder / SNAPSHOT_FILE_NAME).is_file():
+            with open(folder / SNAPSHOT_FILE_NAME, "r") as f:
+                messages += json.load(f).get("message_history", [])
+
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--path", type=Path, default=Path("..") / "data" / "conversations"
+    )
+    args = parser.parse_args()
+
+    logger = logging.getLogger("benchmark")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    messages = _load_messages(args.path)
+    if not messages:
+        print(f"No conversations found in `{args.path}`")
+        return
+
+    print(f"{len(messages)} messages")
+    print(f"{'codec':<16} {'size [KB]':>10} {'ratio':>7} {'save [ms]':>10} {'load [ms]':>10}")
+    plain_size = None
+    for serializer in SERIALIZERS.values():
+        for compression in COMPRESSIONS.values():
+            try:
+                codec = RecordCodec(serializer(), compression())
+            except SettingsException as e:
+                print(f"{serializer.name()}+{compression.name():<10} skipped: {e}")
+                continue
+
+            start = time.perf_counter()
+            records = [codec.encode(message) for message in messages]
+            save_duration = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for record in records:
+                parse_message(record)
+            load_duration = time.perf_counter() - start
+
+            size = sum(len(record) for record in records)
+            plain_size = plain_size or size
+            print(
+                f"{codec.name:<16} {size / 1024:>10.1f} {size / plain_size:>7.2f} "
+                f"{1000 * save_duration:>10.1f} {1000 * load_duration:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Reports the tokens the history encodings need for the stored conversations.
+
+Run from the `src` directory:
+    python -m benchmarks.history_encoding
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+from pathlib import Path
+
+from datatypes.gpt_response import GptResponse
+from datatypes.user_message import UserMessage
+from exceptions.conversation_exception import ConversationNotReadableException
+from utils.blob_store import open_blob_store
+from utils.conversation_codec import JsonSerializer, NoCompression, RecordCodec
+from utils.conversation_journal import SNAPSHOT_FILE_NAME, ConversationJournal
+from utils.history_encoder import HISTORY_ENCODERS
+from utils.history_store import LazyMessageHistory, parse_message
+from utils.tokenizer import count_tokens
+
+
+def _load_histories(
+    path: Path, logger: logging.Logger
+) -> dict[str, list[GptResponse | UserMessage]]:
+    """Loads the message histories of all conversations below `path` (by conversation id),
+    the way the app loads them (migrated legacy conversations included)"""
+    # only used to migrate conversations saved in the former formats
+    codec = RecordCodec(JsonSerializer(), NoCompression())
+    histories = {}
+    for folder in sorted(path.iterdir()):
+        if not (folder / SNAPSHOT_FILE_NAME).is_file():
+            continue
+        try:
+            _, journal = ConversationJournal.load(
+                folder, codec=codec, fsync_every=0, compact_every=0, logger=logger
+            )
+        except ConversationNotReadableException as e:
+            print(f"Skipping `{folder.name}`: {e}")
+            continue
+        try:
+            blob_store = open_blob_store(folder)
+            history = list(LazyMessageHistory(journal.segment, parse=parse_message))
+            for message in history:
+                if isinstance(message, UserMessage):
+                    # large responses are read from the blob store
+                    message.bind_blob_store(blob_store)
+            histories[folder.name] = history
+        finally:
+            journal.close()
+
+    return histories
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    parser.add_argument(
+        "--path", type=Path, default=Path("..") / "data" / "conversations"
+    )
+    args = parser.parse_args()
+
+    logger = logging.getLogger("benchmark")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    histories = _load_histories(args.path, logger=logger)
+    if not histories:
+        print(f"No conversations found in `{args.path}`")
+        return
+
+    names = [*HISTORY_ENCODERS]
+    totals = {name: 0 for name in names}
+    print(f"{'conversation':<38} {'messages':>9} " + " ".join(f"{n:>9}" for n in names))
+    for conversation_id, history in histories.items():
+        row = {}
+        for name in names:
+            encoder = HISTORY_ENCODERS[name]()
+            entries = [
+                encoder.encode_message(index, message, history)
+                for index, message in enumerate(history)
+            ]
+            row[name] = count_tokens(
+                encoder.history_to_str(entries), model=args.model, logger=logger
+            )
+            totals[name] += row[name]
+        print(
+            f"{conversation_id:<38} {len(history):>9} "
+            + " ".join(f"{row[n]:>9}" for n in names)
+        )
+
+    print(f"{'total':<38} {'':>9} " + " ".join(f"{totals[n]:>9}" for n in names))
+    baseline = totals[names[0]]
+    for name in names[1:]:
+        if baseline:
+            print(f"{name}: {100 * (1 - totals[name] / baseline):.1f}% fewer tokens than {names[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Benchmarks the selection of the conversation history window.
+
+Run from the `src` directory:
+    python -m benchmarks.history_window
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import random
+import time
+
+from utils.query import (
+    conversation_history_to_str,
+    count_tokens,
+    select_history_window,
+)
+
+_WORDS = (
+    "the assistant searched the web for recent news and stored the result in the "
+    "storage under a key so that it can read it later when the human asks again"
+).split()
+
+
+def _make_entries(n_messages: int, seed: int = 42) -> list[tuple[int, str, str]]:
+    """Creates synthetic history entries (newest first) of varying length"""
+    rnd = random.Random(seed)
+    entries = []
+    for pos in range(n_messages, 0, -1):
+        user = "assistant" if pos % 2 else "User"
+        msg = " ".join(rnd.choices(_WORDS, k=rnd.randint(5, 120)))
+        entries.append((pos, user, msg))
+
+    return entries
+
+
+def _legacy_window(
+    entries: list[tuple[int, str, str]],
+    max_tokens: int,
+    model: str,
+    logger: logging.Logger,
+) -> list[tuple[int, str, str]]:
+    """The window selection as it was done before: re-join and re-tokenize every step"""
+    conversations = []
+    for entry in entries:
+        conversations.append(entry)
+        n_tokens = count_tokens(
+            text=conversation_history_to_str(conversations), model=model, logger=logger
+        )
+        if n_tokens > max_tokens:
+            conversations = conversations[:-1]
+            break
+
+    return [*reversed(conversations)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10, 100, 1000, 10_000]
+    )
+    parser.add_argument(
+        "--budgets", type=int, nargs="+", default=[1500, 16_000, 10_000_000]
+    )
+    parser.add_argument(
+        "--legacy-max-size",
+        type=int,
+        default=1000,
+        help="skip the (quadratic) legacy selection above this history size",
+    )
+    args = parser.parse_args()
+
+    logger = logging.getLogger("benchmark")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    print(f"{'messages':>9} {'budget':>9} {'selected':>9} {'legacy [s]':>11} {'window [s]':>11}")
+    for size in args.sizes:
+        entries = _make_entries(size)
+        for budget in args.budgets:
+            start = time.perf_counter()
+            window, _ = select_history_window(
+                entries, max_tokens=budget, model=args.model, logger=logger
+            )
+            duration = time.perf_counter() - start
+
+            legacy_duration = "-"
+            if size <= args.legacy_max_size:
+                start = time.perf_counter()
+                legacy = _legacy_window(
+                    entries, max_tokens=budget, model=args.model, logger=logger
+                )
+                legacy_duration = f"{time.perf_counter() - start:.4f}"
+                assert legacy == window, "window differs from the legacy selection"
+
+            print(
+                f"{size:>9} {budget:>9} {len(window):>9} {legacy_duration:>11} {duration:>11.4f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Compares the memory of the message history as list of pydantic models and as MessageStore.
+
+Run from the `src` directory:
+    python -m benchmarks.message_store_memory
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from typing import Callable
+
+from datatypes.gpt_response import GptResponse
+from datatypes.user_message import UserMessage
+from utils.message_store import MessageStore
+
+_WORDS = (
+    "the assistant searched the web for recent news and stored the result in the "
+    "storage under a key so that it can read it later when the human asks again"
+).split()
+_COMMANDS = ["search_web", "read_website", "storage_write", "storage_read", "answer"]
+
+
+def _make_messages(n_messages: int, seed: int = 42):
+    """Creates synthetic messages (alternating GptResponse and UserMessage) one by one"""
+    rnd = random.Random(seed)
+    for i in range(n_messages):
+        if i % 2 == 0:
+            yield GptResponse(
+                plan=" ".join(rnd.choices(_WORDS, k=rnd.randint(5, 40))),
+                steps=[" ".join(rnd.choices(_WORDS, k=5)) for _ in range(3)],
+                command=rnd.choice(_COMMANDS),
+                arguments={"search_query": " ".join(rnd.choices(_WORDS, k=4))},
+            )
+        else:
+            yield UserMessage(
+                user_response=" ".join(rnd.choices(_WORDS, k=rnd.randint(5, 120))),
+                user="User",
+            )
+
+
+def _measure(build: Callable[[], object]) -> tuple[object, int]:
+    """Returns what `build` returns and the bytes it keeps allocated"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n-messages", type=int, default=10_000)
+    args = parser.parse_args()
+
+    models, models_size = _measure(lambda: list(_make_messages(args.n_messages)))
+    store, store_size = _measure(lambda: MessageStore(_make_messages(args.n_messages)))
+    per_10k = 10_000 / args.n_messages
+
+    print(f"{args.n_messages} messages")
+    print(f"{'history':<14} {'memory [KB]':>12} {'per 10k [KB]':>13}")
+    for name, size in (("pydantic list", models_size), ("MessageStore", store_size)):
+        print(f"{name:<14} {size / 1024:>12.1f} {size * per_10k / 1024:>13.1f}")
+    saved = models_size - store_size
+    print(
+        f"saved {saved * per_10k / 1024:.1f} KB per 10k messages "
+        f"({100 * saved / models_size:.0f}%)"
+    )
+
+    for name, history in (("pydantic list", models), ("MessageStore", store)):
+        start = time.perf_counter()
+        if isinstance(history, MessageStore):
+            found = list(history.command_indices("storage_write"))
+        else:
+            found = [
+                index
+                for index in range(len(history) - 1, -1, -1)
+                if isinstance(history[index], GptResponse)
+                and history[index].command == "storage_write"
+            ]
+        duration = time.perf_counter() - start
+        print(f"filter by command ({name}): {1000 * duration:.2f} ms, {len(found)} found")
+
+
+if __name__ == "__main__":
+    main()
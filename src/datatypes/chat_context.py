@@ -4,13 +4,22 @@ import logging
 import uuid
 from typing import Iterable
 
-from pydantic import Field, BaseModel
+from pydantic import Field, BaseModel, validator
 
 from datatypes.gpt_response import GptResponse
+from datatypes.history_summary import HistorySummary
 from datatypes.user_message import UserMessage
 from repository.i_file_storage_backend import IFileStorageBackend
 from repository.i_key_storage_backend import IKeyStorageBackend
 from utils.app_settings import AppSettings
+from utils.blob_store import BlobStore
+from utils.command_index import CommandIndex
+from utils.conversation_journal import ConversationJournal
+from utils.history_index import HistoryIndex
+from utils.key_index import StorageKeyIndex
+from utils.value_index import StorageValueIndex
+from utils.message_store import MessageStore
+from utils.token_cache import TokenCountCache
 
 
 class ChatContext(BaseModel):
@@ -26,7 +35,13 @@ class ChatContext(BaseModel):
     )
 
     message_history: list[GptResponse | UserMessage] = Field(
-        help_text="The history of messages", default_factory=list
+        help_text="The history of messages (read lazily for loaded conversations)",
+        default_factory=list,
+    )
+
+    history_summary: HistorySummary = Field(
+        help_text="Rolling summary of the messages that dropped out of the prompt",
+        default_factory=HistorySummary,
     )
 
     key_storage_backend: IKeyStorageBackend = Field(
@@ -36,6 +51,46 @@ class ChatContext(BaseModel):
         help_text="The storage backend to use for files"
     )
 
+    token_cache: TokenCountCache = Field(
+        help_text="Cached token counts of the history entries",
+        default_factory=TokenCountCache,
+    )
+
+    history_index: HistoryIndex = Field(
+        help_text="Relevance index over the message history",
+        default_factory=HistoryIndex,
+    )
+
+    key_index: StorageKeyIndex = Field(
+        help_text="Index of the keys in the key storage",
+        default_factory=StorageKeyIndex,
+    )
+
+    value_index: StorageValueIndex | None = Field(
+        help_text="Semantic index of the values in the key storage (set when first recalled)",
+        default=None,
+    )
+
+    command_index: CommandIndex = Field(
+        help_text="Index of the commands in the message history",
+        default_factory=CommandIndex,
+    )
+
+    journal: ConversationJournal | None = Field(
+        help_text="The journal the conversation is persisted with (set on the first save)",
+        default=None,
+    )
+
+    blob_store: BlobStore | None = Field(
+        help_text="The store of large message payloads (set on the first save)",
+        default=None,
+    )
+
+    last_query: str | None = Field(
+        help_text="The last query sent to the model (only kept to report its prefix stability)",
+        default=None,
+    )
+
     settings: AppSettings = Field(help_text="The Application Settings")
     default_logger: logging.Logger = Field(help_text="The default logger")
     ai_role: str = Field(help_text="The current ai task")
@@ -49,6 +104,13 @@ class ChatContext(BaseModel):
 
     class Config:
         arbitrary_types_allowed = True
+        # the history is serialized as the list of its messages
+        json_encoders = {MessageStore: list}
+
+    @validator("message_history", always=True)
+    def _compact_message_history(cls, messages):
+        # kept compact in memory (see MessageStore)
+        return MessageStore(messages)
 
     def filter_chat_gpt_commands(
         self, command_name: str | None = None, skip_first: bool = True
@@ -59,19 +121,30 @@ class ChatContext(BaseModel):
         :param skip_first: if
         :return: tuple(message_index, GptResponse)
         """
-        message_index = len(self.message_history) - 1
+        self.command_index.sync(self.message_history)
         skipped = not skip_first
 
-        for message in reversed(self.message_history):
-            if isinstance(message, GptResponse):
-                matches = True
-                if command_name and message.command != command_name:
-                    matches = False
-
-                if matches:
-                    if not skipped:
-                        skipped = True
-                    else:
-                        yield message_index, message
-
-            message_index -= 1
+        for message_index in reversed(self.command_index.indices(command_name)):
+            if not skipped:
+                skipped = True
+            else:
+                yield message_index, self.message_history[message_index]
+
+    def find_previous_search(
+        self, command_name: str, query: str, language: str | None
+    ) -> tuple[int, float] | None:
+        """finds the latest search of a search command for the same query and language,
+        skipping the newest message of the command (the one being executed)
+        :param command_name: the search command
+        :param query: the query searched for
+        :param language: the language searched in (None: the default language)
+        :return: tuple(message_index, created_ts) or None if there was no such search
+        """
+        self.command_index.sync(self.message_history)
+        indices = self.command_index.indices(command_name)
+        if not indices:
+            return None
+
+        return self.command_index.latest_search(
+            command_name, query=query, language=language, before=indices[-1]
+        )
@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import dataclasses
+
+
+@dataclasses.dataclass
+class ConversationChanges:
+    """What changed in a conversation since the last save (captured to be written later)"""
+
+    first_index: int  # index of the first message in `messages`
+    messages: list[dict]  # the new messages (or all messages if `rewrite`)
+    meta: dict  # the fields of the conversation besides the message history
+    n_messages: int  # length of the message history
+    rewrite: bool = False  # messages were removed, the history has to be written anew
+    token_counts: bytes | None = None  # the token count cache (if it changed)
+    history_version: int | None = None  # version of the (lazy) message history when captured
+
+    def merge(self, later: ConversationChanges) -> ConversationChanges:
+        """Combines these changes with the ones captured after them"""
+        if later.rewrite:
+            merged = dataclasses.replace(later)
+        else:
+            merged = dataclasses.replace(
+                self,
+                messages=self.messages + later.messages,
+                meta=later.meta,
+                n_messages=later.n_messages,
+                history_version=later.history_version,
+            )
+        merged.token_counts = later.token_counts or self.token_counts
+        return merged
@@ -0,0 +1,12 @@
+import dataclasses
+
+
+@dataclasses.dataclass
+class ConversationInfo:
+    """What the conversation catalog knows about a conversation"""
+
+    conversation_id: str
+    n_messages: int  # number of messages in the history
+    modified_ts: float  # when the conversation was saved the last time
+    total_tokens: int  # tokens of all messages of the history
+    size_bytes: int  # size of the conversation folder on disk
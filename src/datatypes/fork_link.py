@@ -0,0 +1,9 @@
+import dataclasses
+
+
+@dataclasses.dataclass
+class ForkLink:
+    """What a forked conversation shares with the conversation it was forked from"""
+
+    parent_id: str
+    n_messages: int  # length of the history prefix read from the parent (0: detached)
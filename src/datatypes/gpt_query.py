@@ -0,0 +1,18 @@
+from __future__ import annotations
+
+import dataclasses
+
+
+@dataclasses.dataclass
+class GptQuery:
+    """A query (prompt) for the model, its number of tokens and how many tokens each of its
+    sections takes (the sections are counted separately, so their sum is only an estimate of
+    `n_tokens`)"""
+
+    prompt: str
+    n_tokens: int  # of the whole prompt, counted at once
+    section_tokens: dict[str, int]
+    n_history_entries: int = 0
+    history_budget: int | None = None
+    history_start_index: int | None = None  # first message of the recent history window
+    shared_prefix_tokens: int | None = None
@@ -0,0 +1,16 @@
+from __future__ import annotations
+
+from pydantic import BaseModel, Field
+
+
+class HistorySummary(BaseModel):
+    text: str = Field(help_text="Summary of the earlier messages", default="")
+    n_summarized: int = Field(
+        help_text="The summary covers the messages with an index below this", default=0
+    )
+    updated_ts: float | None = Field(
+        help_text="When the summary was updated the last time", default=None
+    )
+
+    def is_empty(self) -> bool:
+        return self.n_summarized == 0
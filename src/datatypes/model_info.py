@@ -0,0 +1,9 @@
+import dataclasses
+
+
+@dataclasses.dataclass(frozen=True)
+class ModelInfo:
+    """What a model can process"""
+
+    context_window: int  # max. number of tokens of the prompt(s) and the reply together
+    reply_reserve: int  # number of tokens to keep free for the reply
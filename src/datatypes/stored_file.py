@@ -0,0 +1,11 @@
+import dataclasses
+
+
+@dataclasses.dataclass
+class StoredFile:
+    """What the file manifest knows about a file of the file storage"""
+
+    name: str  # path below the storage folder
+    size: int  # bytes
+    modified_ns: int  # modification time (ns since epoch)
+    sha256: str  # hash of the content
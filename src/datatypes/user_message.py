@@ -1,11 +1,48 @@
 from __future__ import annotations
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
+
+from exceptions.conversation_exception import BlobNotFoundException
+from utils.blob_store import BlobStore
 
 
 class UserMessage(BaseModel):
-    user_response: str = Field(help_text="The users response message")
+    user_response: str = Field(
+        help_text="The users response message (a preview if it is in the blob store)"
+    )
     additional_info: str | None = Field(
         help_text="Additional information", default=None
     )
     user: str = Field(help_text="The user who sent the message")
+    blob_ref: str | None = Field(
+        help_text="Reference of the complete response in the blob store (for large responses)",
+        default=None,
+    )
+
+    _blob_store: BlobStore | None = PrivateAttr(default=None)
+
+    def bind_blob_store(self, blob_store: BlobStore):
+        """Sets the blob store to read the complete response from"""
+        self._blob_store = blob_store
+
+    def move_to_blob_store(self, blob_store: BlobStore):
+        """Moves the response to the blob store and keeps only a preview in the message"""
+        if self.blob_ref is not None:
+            return
+
+        self.blob_ref = blob_store.put(self.user_response)
+        self.user_response = blob_store.preview_of(self.user_response)
+        self._blob_store = blob_store
+
+    def full_response(self) -> str:
+        """The complete response (read from the blob store if it was moved there)
+        Raises:
+            BlobNotFoundException: if the response cannot be read from the blob store
+        """
+        if self.blob_ref is None:
+            return self.user_response
+        if self._blob_store is None:
+            raise BlobNotFoundException(
+                f"No blob store to read blob `{self.blob_ref}` from"
+            )
+        return self._blob_store.get(self.blob_ref)
@@ -11,3 +11,7 @@ class ConversationCannotBeSavedException(ConversationException):
 
 class ConversationNotReadableException(ConversationException):
     """Raised when the conversation is not readable."""
+
+
+class BlobNotFoundException(ConversationException):
+    """Raised when the payload of a message is not in the blob store."""
@@ -5,6 +5,8 @@ from .i_command import ICommand
 from .storage_read_command import StorageReadCommand
 from .storage_write_command import StorageWriteCommand
 from .storage_delete_command import StorageDeleteCommand
+from .storage_search_command import StorageSearchCommand
+from .storage_recall_command import StorageRecallCommand
 from .answer_command import AnswerCommand
 from .read_file_command import ReadFileCommand
 from .write_file_command import WriteFileCommand
@@ -23,6 +25,8 @@ GPT_COMMANDS: dict[str, typing.Type[ICommand]] = {
     StorageReadCommand.name(): StorageReadCommand,
     StorageWriteCommand.name(): StorageWriteCommand,
     StorageDeleteCommand.name(): StorageDeleteCommand,
+    StorageSearchCommand.name(): StorageSearchCommand,
+    StorageRecallCommand.name(): StorageRecallCommand,
     AnswerCommand.name(): AnswerCommand,
     ReadFileCommand.name(): ReadFileCommand,
     WriteFileCommand.name(): WriteFileCommand,
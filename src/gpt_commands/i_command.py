@@ -8,6 +8,9 @@ from exceptions.commands_execption import (
     ArgumentTypeException,
 )
 
+# argument types a string is converted to (the bot often quotes numbers)
+_COERCIBLE_TYPES = (int, float)
+
 
 class ICommand(abc.ABC):
     _collected_args: dict[str, Any]
@@ -47,16 +50,26 @@ class ICommand(abc.ABC):
             if argument.name in kwargs:
                 arg = kwargs[argument.name]
                 if not isinstance(arg, argument.type):
-                    raise ArgumentTypeException(
-                        argument=argument.name,
-                        expected_type=str(argument.type),
-                        found_type=str(type(arg)),
-                    )
+                    arg = self._coerce(argument, arg)
 
                 collected_args[argument.name] = argument.type(arg)
 
         self._collected_args = collected_args
 
+    @staticmethod
+    def _coerce(argument: CommandArgument, arg: Any) -> Any:
+        """Converts a number the bot sent as a string (e.g. `"2"`) to the type of the argument"""
+        if isinstance(arg, str) and argument.type in _COERCIBLE_TYPES:
+            try:
+                return argument.type(arg.strip())
+            except ValueError:
+                pass
+        raise ArgumentTypeException(
+            argument=argument.name,
+            expected_type=str(argument.type),
+            found_type=str(type(arg)),
+        )
+
     def __call__(self):
         """Call the actual command."""
         return self.execute(chat_context=self._chat_context, **self._collected_args)
@@ -3,6 +3,9 @@ from datatypes.command_argument import CommandArgument
 from exceptions.commands_execption import CommandExecutionError
 from gpt_commands.i_command import ICommand
 
+# files listed per page
+PAGE_SIZE = 100
+
 
 class ListFilesCommand(ICommand):
     @classmethod
@@ -15,13 +18,39 @@ class ListFilesCommand(ICommand):
 
     @classmethod
     def arguments(cls) -> list[CommandArgument]:
-        return []
+        return [
+            CommandArgument(
+                name="pattern",
+                type=str,
+                required=False,
+                help="only list files matching this glob pattern (e.g. `*.md`, `notes/*`). Default: all files.",
+            ),
+            CommandArgument(
+                name="page",
+                type=int,
+                required=False,
+                help=f"the page to list ({PAGE_SIZE} files per page). Default: 1.",
+            ),
+        ]
 
     def execute(self, chat_context: ChatContext, **args) -> str:
+        pattern = args.pop("pattern", None) or None
+        page = max(1, args.pop("page", 1) or 1)
         try:
-            files = list(chat_context.file_storage_backend.list())
+            # the part before the first wildcard narrows the listing down quickly
+            prefix = pattern.split("*")[0].split("?")[0].split("[")[0] if pattern else ""
+            files, n_files = chat_context.file_storage_backend.list_matching(
+                prefix=prefix,
+                pattern=pattern,
+                offset=(page - 1) * PAGE_SIZE,
+                limit=PAGE_SIZE,
+            )
+            n_pages = (n_files + PAGE_SIZE - 1) // PAGE_SIZE
             if files:
-                return "Files found: " + ", ".join(files)
+                paging = f" (page {page} of {n_pages}, {n_files} files)" if n_pages > 1 else ""
+                return f"Files found{paging}: " + ", ".join(files)
+            elif n_files:
+                return f"No files on page {page}, there are only {n_pages} page(s)."
             else:
                 return "No files found."
 
@@ -43,7 +43,7 @@ class ReadConversationHistory(ICommand):
         if isinstance(message, UserMessage):
             return (
                 r
-                + f"User message from user `{message.user}`: \n{message.user_response}\n "
+                + f"User message from user `{message.user}`: \n{message.full_response()}\n "
                 f"with additional info: {message.additional_info}"
             )
         elif isinstance(message, GptResponse):
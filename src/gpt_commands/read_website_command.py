@@ -5,6 +5,7 @@ from datatypes.command_argument import CommandArgument
 from exceptions.commands_execption import CommandExecutionError
 from gpt_commands.i_command import ICommand
 
+from utils.models import nominal_history_tokens
 from utils.multimedia import try_extract_text
 
 PAGE_CACHE: dict[str, str] = {}
@@ -67,7 +68,14 @@ class ReadWebsiteCommand(ICommand):
                 PAGE_CACHE[url] = extract
 
                 # make it shorter if it is too long
-                max_len = int(chat_context.settings.max_token_len_history // 1.5 * 4)
+                max_len = int(
+                    nominal_history_tokens(
+                        settings=chat_context.settings,
+                        logger=chat_context.default_logger,
+                    )
+                    // 1.5
+                    * 4
+                )
                 n_pages = 1
                 if len(extract) > max_len:
                     n_pages = len(extract) // max_len + 1
@@ -48,26 +48,18 @@ class SearchWebCommand(ICommand):
 
         # check if the search has been conducted recently and
         # @TODO make that configurable (by time or by amount of messages passed since the query or both)
-        for index, message in chat_context.filter_chat_gpt_commands(
-            command_name=self.name()
-        ):
-            if message.arguments["search_query"].lower().strip() == q.lower().strip():
-                old_lang = (
-                    message.arguments["language"]
-                    if "language" in message.arguments
-                    else default_lang
+        previous_search = chat_context.find_previous_search(
+            self.name(), query=q, language=lang
+        )
+        if previous_search is not None:
+            index, created_ts = previous_search
+            if created_ts > (datetime.datetime.now().timestamp() - 60 * 60):
+                return (
+                    f"Your searched this already for query `{q}` and lang `{lang}` "
+                    f"in message with the index number #{index} recently. "
+                    f"The results are likely be found in the response message at index #{index+1}. "
+                    f"Please use the information in our conversation history before searching again."
                 )
-                old_lang = old_lang.strip().lower()
-                if old_lang == lang:
-                    if message.created_ts > (
-                        datetime.datetime.now().timestamp() - 60 * 60
-                    ):
-                        return (
-                            f"Your searched this already for query `{q}` and lang `{lang}` "
-                            f"in message with the index number #{index} recently. "
-                            f"The results are likely be found in the response message at index #{index+1}. "
-                            f"Please use the information in our conversation history before searching again."
-                        )
 
         try:
             res = []
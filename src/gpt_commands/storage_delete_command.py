@@ -26,6 +26,9 @@ class StorageDeleteCommand(ICommand):
             return f"Key {key} not found."
         else:
             chat_context.key_storage_backend.delete(key)
+            chat_context.key_index.remove(key)
+            if chat_context.value_index is not None:
+                chat_context.value_index.remove(key)
             return f"{key} deleted."
 
     @classmethod
@@ -20,6 +20,7 @@ class StorageReadCommand(ICommand):
 
     def execute(self, chat_context: ChatContext, **args) -> str:
         key = args.pop("key")
+        chat_context.key_index.touch(key)
         return chat_context.key_storage_backend.read(key) or "N/A"
 
     @classmethod
@@ -0,0 +1,63 @@
+from datatypes.chat_context import ChatContext
+from datatypes.command_argument import CommandArgument
+from gpt_commands.i_command import ICommand
+from utils.value_index import StorageValueIndex
+
+# characters of each found value shown in the result
+_PREVIEW_CHARS = 200
+
+
+class StorageRecallCommand(ICommand):
+    @classmethod
+    def name(cls) -> str:
+        return "storage_recall"
+
+    @classmethod
+    def description(cls) -> str:
+        return (
+            "Finds stored values by their content (when you don't know the key). "
+            "Returns the best matching keys with the beginning of their values."
+        )
+
+    @classmethod
+    def arguments(cls) -> list[CommandArgument]:
+        return [
+            CommandArgument(
+                name="query",
+                type=str,
+                required=True,
+                help="what the value is about (words that likely appear in it)",
+            ),
+            CommandArgument(
+                name="limit",
+                type=int,
+                required=False,
+                help="how many values to return at most. Default: 5.",
+            ),
+        ]
+
+    def execute(self, chat_context: ChatContext, **args) -> str:
+        query = args.pop("query")
+        limit = max(1, args.pop("limit", 5) or 5)
+
+        if chat_context.value_index is None:
+            chat_context.value_index = StorageValueIndex(
+                dimensions=chat_context.settings.storage_recall_dimensions
+            )
+        chat_context.value_index.sync(chat_context.key_storage_backend)
+
+        matches = chat_context.value_index.search(query, limit=limit)
+        if not matches:
+            return f"No stored values found for `{query}`."
+
+        result = "Stored values matching the query (best first):\n"
+        for key, score in matches:
+            value = chat_context.key_storage_backend.read(key) or ""
+            if len(value) > _PREVIEW_CHARS:
+                value = value[:_PREVIEW_CHARS] + "..."
+            result += f"- `{key}` (similarity {score:.2f}): {value}\n"
+        return result
+
+    @classmethod
+    def needs_confirmation(cls) -> bool:
+        return False
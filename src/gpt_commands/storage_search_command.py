@@ -0,0 +1,66 @@
+from datatypes.chat_context import ChatContext
+from datatypes.command_argument import CommandArgument
+from gpt_commands.i_command import ICommand
+
+SEARCH_MODES = ("fuzzy", "prefix", "recent")
+
+
+class StorageSearchCommand(ICommand):
+    @classmethod
+    def name(cls) -> str:
+        return "storage_search"
+
+    @classmethod
+    def description(cls) -> str:
+        return (
+            "Searches the keys of the storage (only some of them are listed in the prompt). "
+            "Use storage_read to read the value of a found key."
+        )
+
+    @classmethod
+    def arguments(cls) -> list[CommandArgument]:
+        return [
+            CommandArgument(
+                name="query",
+                type=str,
+                required=True,
+                help="what to search for (a part of the key, typos are fine)",
+            ),
+            CommandArgument(
+                name="mode",
+                type=str,
+                required=False,
+                help="`fuzzy` (similar keys), `prefix` (keys starting with the query) or "
+                "`recent` (most recently used keys, ignores the query). Default: fuzzy.",
+            ),
+            CommandArgument(
+                name="limit",
+                type=int,
+                required=False,
+                help="how many keys to return at most. Default: 10.",
+            ),
+        ]
+
+    def execute(self, chat_context: ChatContext, **args) -> str:
+        query = args.pop("query")
+        mode = args.pop("mode", "fuzzy") or "fuzzy"
+        limit = max(1, args.pop("limit", 10) or 10)
+        if mode not in SEARCH_MODES:
+            return f"Unknown mode `{mode}`. Use one of {', '.join(SEARCH_MODES)}."
+
+        index = chat_context.key_index
+        index.sync(chat_context.key_storage_backend)
+        if mode == "prefix":
+            keys = index.prefix(query, limit=limit)
+        elif mode == "recent":
+            keys = index.recent(limit)
+        else:
+            keys = [key for key, _ in index.fuzzy(query, limit=limit)]
+
+        if not keys:
+            return f"No storage keys found for `{query}` ({len(index)} keys in total)."
+        return f"Found storage keys ({len(index)} keys in total): {keys}"
+
+    @classmethod
+    def needs_confirmation(cls) -> bool:
+        return False
@@ -32,6 +32,9 @@ class StorageWriteCommand(ICommand):
         key = args.pop("key")
         value = args.pop("value")
         chat_context.key_storage_backend.put(key, value)
+        chat_context.key_index.add(key)
+        if chat_context.value_index is not None:
+            chat_context.value_index.put(key, value)
         value_to_show = value[:20] + "..." + value[-20:] if len(value) > 40 else value
         return "Added {key} with value {value} to storage.".format(key=key, value=value_to_show)
 
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Iterable
+
+from exceptions.repository_exceptions import (
+    RepositoryNotReadableException,
+    RepositoryNotWritableException,
+)
+from repository.i_key_storage_backend import IKeyStorageBackend
+from utils.files import write_atomic
+
+# marks a pending deletion
+_DELETED = object()
+
+
+class CachedFileKeyStorageBackend(IKeyStorageBackend):
+    """Key value storage in a JSON file (same format as `FileKeyKeyStorageKeyBackend`) that is
+    read once and served from memory. Changes are written behind: they are collected and the file
+    is replaced atomically `flush_delay` seconds after the first unwritten change (and on exit).
+
+    Changes of the file by someone else are detected by its modification time (and size) and
+    read again, the pending changes are applied on top.
+    """
+
+    def __init__(self, path: Path, flush_delay: float = 1.0):
+        """
+        Args:
+            path: the JSON file
+            flush_delay: seconds to collect changes before writing them (0: write every change)
+        Raises:
+            RepositoryNotWritableException: if the file cannot be created
+            RepositoryNotReadableException: if the file cannot be read
+        """
+        self._path = path
+        self._flush_delay = flush_delay
+        self._lock = threading.RLock()
+        self._pending: dict[str, str | object] = {}
+        self._timer: threading.Timer | None = None
+        self._flush_error: Exception | None = None
+        if not path.exists():
+            if not path.parent.is_dir():
+                raise RepositoryNotWritableException(
+                    f"Couldn't initialise storage at {path!s} "
+                    f"because {path.parent!s} is not a directory"
+                )
+            try:
+                write_atomic(path, b"{}")
+            except Exception as e:
+                raise RepositoryNotWritableException(
+                    f"Couldn't initialise storage at {path!s} due to {str(e)}"
+                )
+        self._data: dict[str, str] = {}
+        self._stat: tuple[int, int] | None = None
+        self._reload()
+        if flush_delay > 0:
+            atexit.register(self.flush)
+
+    def _file_stat(self) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(self._path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _reload(self):
+        """Reads the file (again) and applies the pending changes on top"""
+        stat = self._file_stat()
+        if stat is None:
+            raise RepositoryNotReadableException(f"{self._path} is not a file")
+        try:
+            with open(self._path, "r") as file:
+                data = json.load(file)
+        except Exception as e:
+            raise RepositoryNotReadableException(
+                f"Couldn't parse `{self._path!s}` due to `{str(e)}`"
+            )
+
+        for key, value in self._pending.items():
+            if value is _DELETED:
+                data.pop(key, None)
+            else:
+                data[key] = value
+        self._data = data
+        self._stat = stat
+
+    def _current(self) -> dict[str, str]:
+        """The data, read again if the file was changed by someone else"""
+        if self._file_stat() != self._stat:
+            self._reload()
+        return self._data
+
+    def list(self) -> Iterable[str]:
+        with self._lock:
+            return list(self._current().keys())
+
+    def items(self) -> Iterable[tuple[str, str]]:
+        with self._lock:
+            return list(self._current().items())
+
+    def read(self, key: str) -> str | None:
+        with self._lock:
+            return self._current().get(key)
+
+    def put(self, key: str, value: str):
+        self._change(key, value)
+
+    def delete(self, key: str):
+        self._change(key, _DELETED)
+
+    def _change(self, key: str, value: str | object):
+        with self._lock:
+            self._raise_flush_error()
+            data = self._current()
+            if value is _DELETED:
+                if key not in data:
+                    return
+                del data[key]
+            else:
+                data[key] = value
+            self._pending[key] = value
+
+            if self._flush_delay <= 0:
+                self.flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self._flush_delay, self._flush_in_background)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception as e:
+            # reported with the next change (or flush)
+            self._flush_error = e
+
+    def _raise_flush_error(self):
+        if self._flush_error is not None:
+            error, self._flush_error = self._flush_error, None
+            raise RepositoryNotWritableException(
+                f"Couldn't write to `{self._path!s}` due to `{error}`"
+            )
+
+    def flush(self):
+        """Writes the pending changes now
+        Raises:
+            RepositoryNotWritableException: if the file cannot be written
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending:
+                self._raise_flush_error()
+                return
+
+            try:
+                # don't overwrite what someone else wrote meanwhile
+                data = self._current()
+                write_atomic(self._path, json.dumps(data).encode("utf-8"))
+            except RepositoryNotReadableException:
+                raise
+            except Exception as e:
+                raise RepositoryNotWritableException(
+                    f"Couldn't write to `{self._path!s}` due to `{str(e)}`"
+                )
+            self._pending = {}
+            self._flush_error = None
+            self._stat = self._file_stat()
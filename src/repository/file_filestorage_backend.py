@@ -1,12 +1,14 @@
 from __future__ import annotations
 
-import abc
+import bisect
+import hashlib
 import os
-from glob import glob
 from pathlib import Path
 from typing import Iterable
 
+from datatypes.stored_file import StoredFile
 from exceptions.repository_exceptions import RepositoryAccessNotAllowedException
+from repository.file_manifest import FileManifest
 from repository.i_file_storage_backend import IFileStorageBackend
 
 
@@ -18,19 +20,56 @@ class FileFileStorageBackend(IFileStorageBackend):
             if base_path.parent.is_dir():
                 os.makedirs(base_path)
         self._base_path = base_path
+        # listing reads the manifest instead of walking the folder
+        self._manifest = FileManifest.open(base_path)
 
     def list(self) -> Iterable[str]:
-        for f in glob(f"{self._base_path.absolute()}/**", recursive=True):
-            f = str(f)
-            if os.path.isfile(f):
-                # truncate the part below the base dir
-                base_path_len = len(str(self._base_path.absolute()))
-                yield f[base_path_len + 1 :]
+        return iter(self._manifest.names())
+
+    def list_prefix(self, prefix: str) -> Iterable[str]:
+        return self._manifest.select(prefix)[0]
+
+    def list_matching(
+        self,
+        prefix: str = "",
+        pattern: str | None = None,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> tuple[list[str], int]:
+        return self._manifest.select(prefix, pattern, offset=offset, limit=limit)
+
+    def list_range(self, start: str | None = None, stop: str | None = None) -> Iterable[str]:
+        names = self._manifest.names()
+        first = bisect.bisect_left(names, start) if start is not None else 0
+        last = bisect.bisect_left(names, stop) if stop is not None else len(names)
+        return names[first:last]
 
     def put(self, key: str, value: str):
         self.check_access_policy(key)
-        with open(self._base_path / key, "w") as file:
-            file.write(value)
+        content = value.encode("utf-8")
+        # (brings the manifest up to date first, so the own write is not taken for someone else's)
+        known = self._manifest.get(key)
+        if (
+            known is not None
+            and known.size == len(content)
+            and known.sha256 == hashlib.sha256(content).hexdigest()
+            and self._is_unchanged(known)
+        ):
+            # same content, nothing to write
+            return
+
+        (self._base_path / key).parent.mkdir(parents=True, exist_ok=True)
+        with open(self._base_path / key, "wb") as file:
+            file.write(content)
+        self._manifest.record(key, content)
+
+    def _is_unchanged(self, known: StoredFile) -> bool:
+        """whether a file is still as the manifest knows it"""
+        try:
+            stat = os.stat(self._base_path / known.name)
+        except OSError:
+            return False
+        return stat.st_size == known.size and stat.st_mtime_ns == known.modified_ns
 
     def read(self, key: str) -> str | None:
         self.check_access_policy(key)
@@ -42,7 +81,9 @@ class FileFileStorageBackend(IFileStorageBackend):
 
     def delete(self, key: str):
         self.check_access_policy(key)
+        self._manifest.refresh()
         os.remove(self._base_path / key)
+        self._manifest.forget(key)
 
     def check_access_policy(self, key: str):
         """Checks if the key is allowed to be accessed
@@ -34,6 +34,9 @@ class FileKeyKeyStorageKeyBackend(IKeyStorageBackend):
         data = self._read()
         return data.keys()
 
+    def items(self) -> Iterable[tuple[str, str]]:
+        return self._read().items()
+
     def put(self, key: str, value: str):
         data = self._read()
         data[key] = value
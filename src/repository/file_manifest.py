@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import atexit
+import bisect
+import hashlib
+import itertools
+import json
+import os
+import threading
+from fnmatch import fnmatchcase
+from pathlib import Path
+
+from datatypes.stored_file import StoredFile
+from repository.sqlite_database import prefix_upper_bound
+from utils.files import write_atomic
+
+# the manifest is written next to the storage folder (changing a file inside would
+# change the modification time of the folder, which tells when the manifest is outdated)
+MANIFEST_SUFFIX = ".manifest.json"
+
+# one manifest per folder (and process), shared by all backends of the folder
+_MANIFESTS: dict[Path, FileManifest] = {}
+_MANIFESTS_LOCK = threading.Lock()
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileManifest:
+    """Name, size, modification time and content hash of every file below a folder, so listing
+    the files does not walk the folder. The backend reports its own writes and deletions
+    (`record`, `forget`). Changes by others are noticed by the modification times of the
+    folders (a folder changes when files are added to or removed from it), then the folder is
+    walked again; the hashes of unchanged files are kept.
+    The manifest is written after a walk and on exit (it is a cache: an outdated one only
+    costs a walk).
+    """
+
+    def __init__(self, base_path: Path):
+        self._base_path = base_path
+        self._path = base_path.with_name(base_path.name + MANIFEST_SUFFIX)
+        self._lock = threading.RLock()
+        self._files: dict[str, StoredFile] = {}
+        self._directories: dict[str, int] = {}  # folder (relative, "" is the base) -> mtime
+        self._sorted: list[str] | None = None
+        self._dirty = False
+        self._load()
+        atexit.register(self.flush)
+
+    @classmethod
+    def open(cls, base_path: Path) -> FileManifest:
+        """Returns the (shared) manifest of a folder"""
+        key = base_path.resolve()
+        with _MANIFESTS_LOCK:
+            if key not in _MANIFESTS:
+                _MANIFESTS[key] = cls(base_path)
+            return _MANIFESTS[key]
+
+    def _load(self):
+        try:
+            with open(self._path, "r") as file:
+                data = json.load(file)
+            self._files = {
+                name: StoredFile(name, *values) for name, values in data["files"].items()
+            }
+            self._directories = data["directories"]
+        except Exception:
+            # missing or broken, the next listing walks the folder
+            self._files = {}
+            self._directories = {}
+
+    def _mtime_of(self, directory: str) -> int | None:
+        try:
+            return os.stat(os.path.join(self._base_path, directory)).st_mtime_ns
+        except OSError:
+            return None
+
+    def _is_current(self) -> bool:
+        return bool(self._directories) and all(
+            self._mtime_of(directory) == mtime for directory, mtime in self._directories.items()
+        )
+
+    def rebuild(self):
+        """Walks the folder and brings the manifest up to date"""
+        with self._lock:
+            files: dict[str, StoredFile] = {}
+            directories: dict[str, int] = {}
+            pending = [""]
+            while pending:
+                directory = pending.pop()
+                # before reading it: a change while walking shows up next time
+                mtime = self._mtime_of(directory)
+                if mtime is None:
+                    continue
+                directories[directory] = mtime
+                with os.scandir(os.path.join(self._base_path, directory)) as entries:
+                    for entry in entries:
+                        name = f"{directory}/{entry.name}" if directory else entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(name)
+                        elif entry.is_file():
+                            stat = entry.stat()
+                            known = self._files.get(name)
+                            if (
+                                known is not None
+                                and known.size == stat.st_size
+                                and known.modified_ns == stat.st_mtime_ns
+                            ):
+                                files[name] = known
+                            else:
+                                files[name] = StoredFile(
+                                    name, stat.st_size, stat.st_mtime_ns, _hash_file(entry.path)
+                                )
+            self._files = files
+            self._directories = directories
+            self._sorted = None
+            self._dirty = True
+            self.flush()
+
+    def refresh(self):
+        """Walks the folder again if someone else changed it"""
+        with self._lock:
+            if not self._is_current():
+                self.rebuild()
+
+    def record(self, name: str, content: bytes):
+        """Notes a file the backend (over)wrote (`refresh` before writing it)"""
+        with self._lock:
+            stat = os.stat(self._base_path / name)
+            if name not in self._files:
+                self._sorted = None
+            self._files[name] = StoredFile(
+                name, stat.st_size, stat.st_mtime_ns, hashlib.sha256(content).hexdigest()
+            )
+            self._note_directories(name)
+
+    def forget(self, name: str):
+        """Notes a file the backend deleted (`refresh` before deleting it)"""
+        with self._lock:
+            if self._files.pop(name, None) is not None:
+                self._sorted = None
+            self._note_directories(name)
+
+    def _note_directories(self, name: str):
+        """Takes the new modification times of the folders of a file (and notes new folders)"""
+        parts = name.split("/")[:-1]
+        for depth in range(len(parts) + 1):
+            directory = "/".join(parts[:depth])
+            mtime = self._mtime_of(directory)
+            if mtime is not None:
+                self._directories[directory] = mtime
+        self._dirty = True
+
+    def get(self, name: str) -> StoredFile | None:
+        with self._lock:
+            self.refresh()
+            return self._files.get(name)
+
+    def names(self) -> list[str]:
+        """All file names, sorted"""
+        with self._lock:
+            self.refresh()
+            if self._sorted is None:
+                self._sorted = sorted(self._files)
+            return self._sorted
+
+    def select(
+        self,
+        prefix: str = "",
+        pattern: str | None = None,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> tuple[list[str], int]:
+        """A page of the (sorted) file names starting with `prefix` and matching the glob
+        `pattern` (`*` matches `/` as well)
+        Returns:
+            the page and the number of all matching files
+        """
+        with self._lock:
+            names = self.names()
+            start = bisect.bisect_left(names, prefix)
+            end = bisect.bisect_left(names, prefix_upper_bound(prefix), lo=start)
+            if pattern is None:
+                # no need to look at the names
+                first = start + offset
+                last = end if limit is None else min(end, first + limit)
+                return names[first:last], end - start
+
+            matching = [
+                name for name in itertools.islice(names, start, end) if fnmatchcase(name, pattern)
+            ]
+            stop = offset + limit if limit is not None else None
+            return matching[offset:stop], len(matching)
+
+    def flush(self):
+        """Writes the manifest (if it changed)"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {
+                "directories": self._directories,
+                "files": {
+                    name: [file.size, file.modified_ns, file.sha256]
+                    for name, file in self._files.items()
+                },
+            }
+            try:
+                write_atomic(self._path, json.dumps(data).encode("utf-8"))
+            except OSError:
+                # a cache, rebuilt when missing
+                return
+            self._dirty = False
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import abc
+import contextlib
+from fnmatch import fnmatchcase
 from typing import Iterable
 
 
@@ -43,3 +45,55 @@ class IFileStorageBackend(abc.ABC):
         Raises:
             RepositoryAccessNotAllowedException: if the key is not allowed to be accessed
         """
+
+    def batch(self) -> contextlib.AbstractContextManager[None]:
+        """Writes everything done inside together, in a single transaction if the backend has
+        transactions (the others write right away)"""
+        return contextlib.nullcontext()
+
+    def list_prefix(self, prefix: str) -> Iterable[str]:
+        """
+        lists the files whose name starts with `prefix` (e.g., a folder), sorted
+        Args:
+            prefix: the beginning of the file names
+        """
+        return sorted(key for key in self.list() if key.startswith(prefix))
+
+    def list_matching(
+        self,
+        prefix: str = "",
+        pattern: str | None = None,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> tuple[list[str], int]:
+        """
+        lists a page of the files whose name starts with `prefix` and matches a glob pattern,
+        sorted by name
+        Args:
+            prefix: the beginning of the file names
+            pattern: a glob pattern like `*.md` (`*` matches `/` as well, None: all files)
+            offset: skip that many files (paging)
+            limit: return at most that many files (paging, None: all)
+        Returns:
+            the page and the number of all matching files
+        """
+        matching = [
+            key
+            for key in self.list_prefix(prefix)
+            if pattern is None or fnmatchcase(key, pattern)
+        ]
+        stop = offset + limit if limit is not None else None
+        return matching[offset:stop], len(matching)
+
+    def list_range(self, start: str | None = None, stop: str | None = None) -> Iterable[str]:
+        """
+        lists the files from `start` (inclusive) to `stop` (exclusive), sorted by name
+        Args:
+            start: the first file name (None: from the first file)
+            stop: the file name to stop at (None: up to the last file)
+        """
+        return sorted(
+            key
+            for key in self.list()
+            if (start is None or key >= start) and (stop is None or key < stop)
+        )
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import abc
+import contextlib
 from typing import Iterable
 
 
@@ -22,3 +23,27 @@ class IKeyStorageBackend(abc.ABC):
     @abc.abstractmethod
     def delete(self, key: str):
         ...
+
+    def batch(self) -> contextlib.AbstractContextManager[None]:
+        """Writes everything done inside together, in a single transaction if the backend has
+        transactions (the others write right away)"""
+        return contextlib.nullcontext()
+
+    def items(self) -> Iterable[tuple[str, str]]:
+        """All keys with their values"""
+        for key in list(self.list()):
+            value = self.read(key)
+            if value is not None:
+                yield key, value
+
+    def list_prefix(self, prefix: str) -> Iterable[str]:
+        """The keys starting with `prefix` (sorted)"""
+        return sorted(key for key in self.list() if key.startswith(prefix))
+
+    def list_range(self, start: str | None = None, stop: str | None = None) -> Iterable[str]:
+        """The keys from `start` (inclusive) to `stop` (exclusive), sorted (None: unbounded)"""
+        return sorted(
+            key
+            for key in self.list()
+            if (start is None or key >= start) and (stop is None or key < stop)
+        )
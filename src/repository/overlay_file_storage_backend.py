@@ -0,0 +1,10 @@
+from __future__ import annotations
+
+from repository.i_file_storage_backend import IFileStorageBackend
+from repository.overlay_storage import OverlayStorage
+
+
+class OverlayFileStorageBackend(OverlayStorage, IFileStorageBackend):
+    """File storage of a forked (or forked from) conversation (see `OverlayStorage`)"""
+
+    _TOMBSTONES_KEY = ".deleted_files"
@@ -0,0 +1,10 @@
+from __future__ import annotations
+
+from repository.i_key_storage_backend import IKeyStorageBackend
+from repository.overlay_storage import OverlayStorage
+
+
+class OverlayKeyStorageBackend(OverlayStorage, IKeyStorageBackend):
+    """Key value storage of a forked (or forked from) conversation (see `OverlayStorage`)"""
+
+    _TOMBSTONES_KEY = "\0deleted_keys"
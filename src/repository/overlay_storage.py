@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import contextlib
+import json
+from typing import Iterable, Iterator, Sequence
+
+
+class OverlayStorage:
+    """Copy-on-write storage of a forked conversation: reads fall through to the storage of the
+    parent conversation unless the key was written or deleted (remembered as tombstone) in the own
+    storage. All writes go to the own storage.
+
+    Forks see the storage as it was when they were forked: before a key is written or deleted,
+    its current value is copied to the own storage of every fork that did not change it itself.
+
+    A write and the copies for the forks are done in one `batch` of the storages involved.
+
+    Works with any key value backend (`list`, `put`, `read`, `delete` and `batch`).
+    """
+
+    # key in the own storage that holds the deleted keys (not listed)
+    _TOMBSTONES_KEY: str
+
+    def __init__(self, own, parent=None, forks: Sequence = ()):
+        """
+        Args:
+            own: the storage of the conversation itself
+            parent: the (overlay) storage of the parent conversation (None if it is no fork)
+            forks: the own storages of the conversations forked from this one
+        """
+        self._own = own
+        self._parent = parent
+        self._forks = list(forks)
+        self._tombstones = self._read_tombstones(own)
+
+    def _read_tombstones(self, backend) -> set[str]:
+        data = backend.read(self._TOMBSTONES_KEY)
+        return set(json.loads(data)) if data else set()
+
+    def _write_tombstones(self, backend, tombstones: set[str]):
+        if tombstones:
+            backend.put(self._TOMBSTONES_KEY, json.dumps(sorted(tombstones)))
+        elif backend.read(self._TOMBSTONES_KEY) is not None:
+            backend.delete(self._TOMBSTONES_KEY)
+
+    def list(self) -> Iterable[str]:
+        keys = [key for key in self._own.list() if key != self._TOMBSTONES_KEY]
+        if self._parent is not None:
+            own_keys = set(keys)
+            keys += [
+                key
+                for key in self._parent.list()
+                if key not in own_keys and key not in self._tombstones
+            ]
+        return keys
+
+    def read(self, key: str) -> str | None:
+        if key in self._tombstones:
+            return None
+        value = self._own.read(key)
+        if value is None and self._parent is not None:
+            value = self._parent.read(key)
+        return value
+
+    def put(self, key: str, value: str):
+        with self.batch():
+            self._preserve_for_forks(key)
+            self._own.put(key, value)
+            if key in self._tombstones:
+                self._tombstones.discard(key)
+                self._write_tombstones(self._own, self._tombstones)
+
+    def delete(self, key: str):
+        if self.read(key) is None:
+            # as the own storage handles missing keys
+            self._own.delete(key)
+            return
+
+        with self.batch():
+            self._preserve_for_forks(key)
+            if self._own.read(key) is not None:
+                self._own.delete(key)
+            if self._parent is not None and self._parent.read(key) is not None:
+                self._tombstones.add(key)
+                self._write_tombstones(self._own, self._tombstones)
+
+    @contextlib.contextmanager
+    def batch(self) -> Iterator[None]:
+        """Writes everything done inside to the own storage and the forks in a batch each
+        (a single transaction when they share a database)"""
+        with contextlib.ExitStack() as stack:
+            for backend in (self._own, *self._forks):
+                stack.enter_context(backend.batch())
+            yield
+
+    def _preserve_for_forks(self, key: str):
+        """Copies the current value of a key to the forks that still see it through this storage"""
+        if not self._forks:
+            return
+
+        value = self.read(key)
+        for fork in self._forks:
+            if fork.read(key) is not None:
+                continue
+            tombstones = self._read_tombstones(fork)
+            if key in tombstones:
+                continue
+            if value is None:
+                # the key must not show up in the fork
+                self._write_tombstones(fork, tombstones | {key})
+            else:
+                fork.put(key, value)
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import contextlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterator
+
+from exceptions.repository_exceptions import RepositoryNotWritableException
+
+# one connection per database file (and process), shared by the backends of all conversations
+_DATABASES: dict[Path, SqliteDatabase] = {}
+_DATABASES_LOCK = threading.Lock()
+
+
+def prefix_upper_bound(prefix: str) -> str:
+    """The smallest string above all strings starting with `prefix` (for index range scans)"""
+    return prefix + "\U0010ffff"
+
+
+class SqliteDatabase:
+    """A SQLite database in WAL mode (readers never block the writer, several processes can
+    share it). Writes are committed right away unless they happen inside `batch()`, which
+    collects them into a single transaction.
+    """
+
+    def __init__(self, path: Path, schema: str):
+        """
+        Args:
+            path: the database file
+            schema: statements that create the tables (if they do not exist)
+        Raises:
+            RepositoryNotWritableException: if the database cannot be opened
+        """
+        self._path = path
+        self._lock = threading.RLock()
+        self._batch_depth = 0
+        try:
+            # transactions are controlled explicitly (see `transaction`)
+            self._connection = sqlite3.connect(
+                path, isolation_level=None, check_same_thread=False, timeout=30.0
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(schema)
+        except sqlite3.Error as e:
+            raise RepositoryNotWritableException(
+                f"Couldn't open database `{path!s}` due to `{e}`"
+            )
+
+    @classmethod
+    def open(cls, path: Path, schema: str) -> SqliteDatabase:
+        """Returns the (shared) database of a file"""
+        key = path.resolve()
+        with _DATABASES_LOCK:
+            if key not in _DATABASES:
+                _DATABASES[key] = cls(path, schema)
+            return _DATABASES[key]
+
+    def query(self, sql: str, parameters: tuple = ()) -> list[tuple]:
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """A write transaction (joins the surrounding batch)
+        Raises:
+            RepositoryNotWritableException: if the changes cannot be written
+        """
+        with self._lock:
+            if self._batch_depth:
+                yield self._connection
+                return
+
+            try:
+                # take the write lock right away, so concurrent writers wait instead of failing
+                self._connection.execute("BEGIN IMMEDIATE")
+                try:
+                    yield self._connection
+                except BaseException:
+                    self._connection.execute("ROLLBACK")
+                    raise
+                self._connection.execute("COMMIT")
+            except sqlite3.Error as e:
+                raise RepositoryNotWritableException(
+                    f"Couldn't write to `{self._path!s}` due to `{e}`"
+                )
+
+    @contextlib.contextmanager
+    def batch(self) -> Iterator[None]:
+        """Collects all writes inside into a single transaction (much faster for many writes)"""
+        with self._lock:
+            if self._batch_depth:
+                self._batch_depth += 1
+                try:
+                    yield
+                finally:
+                    self._batch_depth -= 1
+                return
+
+            with self.transaction():
+                self._batch_depth = 1
+                try:
+                    yield
+                finally:
+                    self._batch_depth = 0
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import contextlib
+import time
+from pathlib import Path
+from typing import Iterable
+
+from exceptions.repository_exceptions import RepositoryAccessNotAllowedException
+from repository.i_file_storage_backend import IFileStorageBackend
+from repository.sqlite_database import SqliteDatabase, prefix_upper_bound
+
+DATABASE_FILE_NAME = "file_storage.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    conversation_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    content TEXT NOT NULL,
+    modified_ts REAL NOT NULL,
+    PRIMARY KEY (conversation_id, name)
+) WITHOUT ROWID;
+"""
+
+
+class SqliteFileStorageBackend(IFileStorageBackend):
+    """Files of a conversation in the SQLite database shared by all conversations
+    (`file_storage.sqlite3` in the data directory), see `SqliteDatabase`"""
+
+    def __init__(self, data_path: Path, conversation_id: str):
+        """
+        Args:
+            data_path: the folder of the database
+            conversation_id: the id of the conversation
+        Raises:
+            RepositoryNotWritableException: if the database cannot be opened
+        """
+        data_path.mkdir(parents=True, exist_ok=True)
+        self._db = SqliteDatabase.open(data_path / DATABASE_FILE_NAME, schema=_SCHEMA)
+        self._conversation_id = conversation_id
+
+    def list(self) -> Iterable[str]:
+        return self.list_range()
+
+    def list_prefix(self, prefix: str) -> Iterable[str]:
+        return self.list_range(prefix, prefix_upper_bound(prefix))
+
+    def list_range(self, start: str | None = None, stop: str | None = None) -> Iterable[str]:
+        sql = "SELECT name FROM files WHERE conversation_id = ?"
+        parameters = [self._conversation_id]
+        if start is not None:
+            sql += " AND name >= ?"
+            parameters.append(start)
+        if stop is not None:
+            sql += " AND name < ?"
+            parameters.append(stop)
+        return [name for name, in self._db.query(sql + " ORDER BY name", tuple(parameters))]
+
+    def put(self, key: str, value: str):
+        self.check_access_policy(key)
+        with self._db.transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                (self._conversation_id, key, value, time.time()),
+            )
+
+    def read(self, key: str) -> str | None:
+        self.check_access_policy(key)
+        rows = self._db.query(
+            "SELECT content FROM files WHERE conversation_id = ? AND name = ?",
+            (self._conversation_id, key),
+        )
+        return rows[0][0] if rows else None
+
+    def delete(self, key: str):
+        self.check_access_policy(key)
+        with self._db.transaction() as connection:
+            connection.execute(
+                "DELETE FROM files WHERE conversation_id = ? AND name = ?",
+                (self._conversation_id, key),
+            )
+
+    def batch(self) -> contextlib.AbstractContextManager[None]:
+        """Writes everything done inside in a single transaction"""
+        return self._db.batch()
+
+    def check_access_policy(self, key: str):
+        """Checks if the key is allowed to be accessed (same rules as for the file backend)
+        Raises:
+            RepositoryAccessNotAllowedException: if the key is not allowed to be accessed (..)
+        """
+        if ".." in key:
+            raise RepositoryAccessNotAllowedException(f"Key `{key}` is not allowed.")
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import contextlib
+import time
+from pathlib import Path
+from typing import Iterable
+
+from repository.i_key_storage_backend import IKeyStorageBackend
+from repository.sqlite_database import SqliteDatabase, prefix_upper_bound
+
+DATABASE_FILE_NAME = "key_storage.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS keys (
+    conversation_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    modified_ts REAL NOT NULL,
+    PRIMARY KEY (conversation_id, key)
+) WITHOUT ROWID;
+"""
+
+
+class SqliteKeyStorageBackend(IKeyStorageBackend):
+    """Key value storage of a conversation in the SQLite database shared by all conversations
+    (`key_storage.sqlite3` in the data directory), see `SqliteDatabase`"""
+
+    def __init__(self, data_path: Path, conversation_id: str):
+        """
+        Args:
+            data_path: the folder of the database
+            conversation_id: the id of the conversation
+        Raises:
+            RepositoryNotWritableException: if the database cannot be opened
+        """
+        data_path.mkdir(parents=True, exist_ok=True)
+        self._db = SqliteDatabase.open(data_path / DATABASE_FILE_NAME, schema=_SCHEMA)
+        self._conversation_id = conversation_id
+
+    def list(self) -> Iterable[str]:
+        return self.list_range()
+
+    def list_prefix(self, prefix: str) -> Iterable[str]:
+        return self.list_range(prefix, prefix_upper_bound(prefix))
+
+    def list_range(self, start: str | None = None, stop: str | None = None) -> Iterable[str]:
+        sql = "SELECT key FROM keys WHERE conversation_id = ?"
+        parameters = [self._conversation_id]
+        if start is not None:
+            sql += " AND key >= ?"
+            parameters.append(start)
+        if stop is not None:
+            sql += " AND key < ?"
+            parameters.append(stop)
+        return [key for key, in self._db.query(sql + " ORDER BY key", tuple(parameters))]
+
+    def items(self) -> Iterable[tuple[str, str]]:
+        return self._db.query(
+            "SELECT key, value FROM keys WHERE conversation_id = ?", (self._conversation_id,)
+        )
+
+    def put(self, key: str, value: str):
+        with self._db.transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO keys VALUES (?, ?, ?, ?)",
+                (self._conversation_id, key, value, time.time()),
+            )
+
+    def read(self, key: str) -> str | None:
+        rows = self._db.query(
+            "SELECT value FROM keys WHERE conversation_id = ? AND key = ?",
+            (self._conversation_id, key),
+        )
+        return rows[0][0] if rows else None
+
+    def delete(self, key: str):
+        with self._db.transaction() as connection:
+            connection.execute(
+                "DELETE FROM keys WHERE conversation_id = ? AND key = ?",
+                (self._conversation_id, key),
+            )
+
+    def batch(self) -> contextlib.AbstractContextManager[None]:
+        """Writes everything done inside in a single transaction"""
+        return self._db.batch()
@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 from pathlib import Path
 from typing import Literal
 
@@ -5,10 +7,15 @@ import yaml
 
 from exceptions.settings_exception import SettingsNotReadableException
 
+# the values the prompt settings may take (checked when the settings are loaded)
+PROMPT_LAYOUTS = ("default", "prefix_cache")
+TIMESTAMP_GRANULARITIES = ("second", "minute", "hour", "day")
+
 
 class AppSettings:
     yaml: dict
     config_file: Path
+    modified_ts: float | None
 
     @property
     def gpt_api_key(self) -> str:
@@ -45,24 +52,128 @@ class AppSettings:
         return Path("..") / "data" / "conversation_filesystem"
 
     @property
-    def key_storage_backend(self) -> Literal["file"]:
+    def key_storage_backend(self) -> Literal["file", "cached_file", "sqlite"]:
         return self.yaml["general"]["key_storage_backend"]
 
     @property
-    def file_storage_backend(self) -> Literal["file"]:
+    def key_storage_flush_delay(self) -> float:
+        return float(self.yaml["general"].get("key_storage_flush_delay", 1.0))
+
+    @property
+    def file_storage_backend(self) -> Literal["file", "sqlite"]:
         return self.yaml["general"]["file_storage_backend"]
 
+    @property
+    def journal_fsync_every(self) -> int:
+        return int(self.yaml["general"].get("journal_fsync_every", 4))
+
+    @property
+    def journal_compact_every(self) -> int:
+        return int(self.yaml["general"].get("journal_compact_every", 200))
+
+    @property
+    def save_in_background(self) -> bool:
+        return bool(self.yaml["general"].get("save_in_background", True))
+
+    @property
+    def history_memory_limit_kb(self) -> int:
+        return int(self.yaml["general"].get("history_memory_limit_kb", 16384))
+
+    @property
+    def blob_threshold_chars(self) -> int:
+        return int(self.yaml["general"].get("blob_threshold_chars", 4000))
+
+    @property
+    def conversation_serializer(self) -> Literal["json", "orjson", "msgpack"]:
+        return self.yaml["general"].get("conversation_serializer", "json")
+
+    @property
+    def conversation_compression(self) -> Literal["none", "zlib", "lzma"]:
+        return self.yaml["general"].get("conversation_compression", "none")
+
+    @property
+    def conversation_page_size(self) -> int:
+        return max(int(self.yaml["general"].get("conversation_page_size", 20)), 1)
+
+    @property
+    def conversation_sort(self) -> Literal["modified", "name", "messages", "tokens", "size"]:
+        return self.yaml["general"].get("conversation_sort", "modified")
+
     @property
     def model(self) -> str:
         return self.yaml["general"]["model"]
 
+    @property
+    def prompt_telemetry(self) -> bool:
+        return bool(self.yaml["general"].get("prompt_telemetry", True))
+
     @property
     def log_level(self) -> str:
         return self.yaml["general"]["log_level"]
 
     @property
-    def max_token_len_history(self) -> int:
-        return self.yaml["prompt"]["max_token_len_history"]
+    def max_token_len_history(self) -> int | None:
+        """the fixed token budget of the history (None if it is derived from the model)"""
+        value = self.yaml["prompt"].get("max_token_len_history", "auto")
+        if value is None or str(value).strip().lower() == "auto":
+            return None
+        return int(value)
+
+    @property
+    def model_context_window(self) -> int | None:
+        value = self.yaml["general"].get("model_context_window")
+        return int(value) if value else None
+
+    @property
+    def model_reply_reserve(self) -> int | None:
+        value = self.yaml["general"].get("model_reply_reserve")
+        return int(value) if value else None
+
+    @property
+    def relevant_history_share(self) -> float:
+        return float(self.yaml["prompt"].get("relevant_history_share", 0.0))
+
+    @property
+    def history_encoding(self) -> Literal["verbose", "compact"]:
+        return self.yaml["prompt"].get("history_encoding", "verbose")
+
+    @property
+    def storage_recall_dimensions(self) -> int:
+        """size of the vectors the `storage_recall` command compares the storage values by"""
+        return int(self.yaml["general"].get("storage_recall_dimensions", 1024))
+
+    @property
+    def max_storage_keys(self) -> int:
+        """how many storage keys are listed in the prompt (0: all)"""
+        return int(self.yaml["prompt"].get("max_storage_keys", 20))
+
+    @property
+    def history_summary(self) -> bool:
+        return bool(self.yaml["prompt"].get("history_summary", False))
+
+    @property
+    def history_summary_batch_size(self) -> int:
+        return int(self.yaml["prompt"].get("history_summary_batch_size", 20))
+
+    @property
+    def history_summary_max_tokens(self) -> int:
+        return int(self.yaml["prompt"].get("history_summary_max_tokens", 300))
+
+    @property
+    def history_summary_model(self) -> str:
+        return self.yaml["prompt"].get("history_summary_model") or self.model
+
+    @property
+    def prompt_layout(self) -> Literal["default", "prefix_cache"]:
+        return self.yaml["prompt"].get("layout", "default")
+
+    @property
+    def prompt_timestamp_granularity(self) -> Literal["second", "minute", "hour", "day"]:
+        return self.yaml["prompt"].get("timestamp_granularity", "second")
+
+    @property
+    def report_prefix_stability(self) -> bool:
+        return bool(self.yaml["prompt"].get("report_prefix_stability", False))
 
     @property
     def ai_default_role(self) -> str:
@@ -78,14 +189,59 @@ class AppSettings:
 
     def __init__(self, config_file: Path):
         self.config_file = config_file
+        self.modified_ts = None
         self.load_settings()
 
+    def reload_if_changed(self) -> bool:
+        """Reloads the settings if the settings file was modified since it was loaded
+        Returns:
+            True if the settings were reloaded
+        Raises:
+            SettingsNotReadableException: if the modified file can not be parsed or has invalid
+            values (the current settings are kept in that case)
+        """
+        try:
+            modified_ts = self.config_file.stat().st_mtime
+        except OSError:
+            return False
+
+        if modified_ts == self.modified_ts:
+            return False
+
+        self.load_settings()
+        return True
+
     def load_settings(self):
+        # remember the version of the file to detect changes (also if it turns out to be broken)
+        try:
+            self.modified_ts = self.config_file.stat().st_mtime
+        except OSError:
+            self.modified_ts = None
+
         # write the yaml as json to yaml_document var
         try:
             with open(self.config_file, "r") as file:
-                self.yaml = yaml.safe_load(file)
+                settings_yaml = yaml.safe_load(file)
         except Exception as e:
             raise SettingsNotReadableException(
                 f"Couldn't parse settings file `{file!s}` " f"due to `{str(e)}`"
             )
+        self._validate(settings_yaml)
+        self.yaml = settings_yaml
+
+    def _validate(self, settings_yaml: dict):
+        """Checks the settings that are looked up by their value (a typo would fail mid-turn)
+        Raises:
+            SettingsNotReadableException: if a value is not one of the allowed ones
+        """
+        prompt = (settings_yaml or {}).get("prompt") or {}
+        for name, allowed, default in (
+            ("layout", PROMPT_LAYOUTS, "default"),
+            ("timestamp_granularity", TIMESTAMP_GRANULARITIES, "second"),
+        ):
+            value = prompt.get(name, default)
+            if value not in allowed:
+                raise SettingsNotReadableException(
+                    f"Invalid value `{value}` for `prompt.{name}` in `{self.config_file!s}`, "
+                    f"use one of {', '.join(allowed)}"
+                )
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+from pathlib import Path
+
+from exceptions.conversation_exception import BlobNotFoundException
+from utils.files import write_atomic
+from utils.fork_links import read_fork_link
+
+BLOB_FOLDER_NAME = "blobs"
+
+# characters of a stored payload that stay in the message
+_PREVIEW_CHARS = 300
+
+
+class BlobStore:
+    """Content addressed store for large message payloads (`blobs/<ab>/<sha256>` in the
+    conversation folder). Identical payloads are stored once.
+    New blobs are kept in memory until they are flushed (by the writer of the conversation).
+    Forked conversations read the blobs of their parent as well.
+    """
+
+    def __init__(self, path: Path, parent: BlobStore | None = None):
+        """
+        Args:
+            path: the folder of the blobs
+            parent: the blob store of the conversation this one was forked from
+        """
+        self._path = path
+        self._parent = parent
+        self._pending: dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def ref_of(data: str) -> str:
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _file_of(self, ref: str) -> Path:
+        return self._path / ref[:2] / ref
+
+    def __contains__(self, ref: str) -> bool:
+        with self._lock:
+            if ref in self._pending or self._file_of(ref).is_file():
+                return True
+        return self._parent is not None and ref in self._parent
+
+    def put(self, data: str) -> str:
+        """Stores a payload (if it is not stored already)
+        Returns:
+            the reference of the payload
+        """
+        ref = self.ref_of(data)
+        if ref not in self:
+            with self._lock:
+                self._pending[ref] = data.encode("utf-8")
+        return ref
+
+    def get(self, ref: str) -> str:
+        """Reads a payload
+        Raises:
+            BlobNotFoundException: if there is no payload with that reference
+        """
+        with self._lock:
+            data = self._pending.get(ref)
+        if data is None:
+            try:
+                data = self._file_of(ref).read_bytes()
+            except OSError as e:
+                if self._parent is not None and ref in self._parent:
+                    return self._parent.get(ref)
+                raise BlobNotFoundException(f"Blob `{ref}` cannot be read due to `{e}`")
+        return data.decode("utf-8")
+
+    def flush(self):
+        """Writes the new blobs to disk"""
+        with self._lock:
+            pending = list(self._pending.items())
+        for ref, data in pending:
+            path = self._file_of(ref)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            write_atomic(path, data)
+            with self._lock:
+                self._pending.pop(ref, None)
+
+    @staticmethod
+    def preview_of(data: str) -> str:
+        """What stays in the message of a stored payload"""
+        return (
+            f"{data[:_PREVIEW_CHARS]}\n"
+            f"[... {len(data) - _PREVIEW_CHARS} more characters in the blob store]"
+        )
+
+
+def open_blob_store(conversation_path: Path) -> BlobStore:
+    """Opens the blob store of a conversation (of forks including the blobs of the parent)"""
+    link = read_fork_link(conversation_path)
+    return BlobStore(
+        conversation_path / BLOB_FOLDER_NAME,
+        parent=open_blob_store(conversation_path.parent / link.parent_id) if link else None,
+    )
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+from array import array
+from typing import Sequence
+
+from datatypes.gpt_response import GptResponse
+from datatypes.user_message import UserMessage
+from utils.history_store import LazyMessageHistory
+from utils.message_store import MessageStore
+
+DEFAULT_SEARCH_LANGUAGE = "en"
+
+# messages of a lazy history that are decoded at once when indexing it
+_SYNC_CHUNK_SIZE = 1000
+
+# search commands -> their arguments holding the query and the language
+SEARCH_ARGUMENTS: dict[str, tuple[str, str]] = {
+    "search_web": ("search_query", "language"),
+}
+
+
+def search_key(query: str, language: str | None) -> tuple[str, str]:
+    """The normalized (query, language) of a search, equal for searches that return the same"""
+    return query.lower().strip(), (language or DEFAULT_SEARCH_LANGUAGE).lower().strip()
+
+
+class CommandIndex:
+    """Index of the commands in the history of a conversation: the message indices per command
+    and the latest messages per search (see `search_key`) of the search commands.
+    The index is updated incrementally: only messages appended since the last `sync` are indexed.
+    """
+
+    _by_command: dict[str, array]  # command -> message indices (ascending)
+    _commands: array  # message indices of all commands (ascending)
+    _searches: dict[tuple[str, str, str], list[tuple[int, float]]]  # (command, *key) -> (index, created_ts)
+
+    def __init__(self):
+        self._by_command = {}
+        self._commands = array("I")
+        self._searches = {}
+        self._n_messages = 0
+
+    def __len__(self) -> int:
+        return self._n_messages
+
+    def add(self, message: GptResponse | UserMessage, index: int):
+        """Indexes the message at `index` (following the indexed ones)"""
+        if isinstance(message, GptResponse):
+            self._add_command(message.command, index)
+            if message.command in SEARCH_ARGUMENTS:
+                self._add_search(message.command, message.arguments, message.created_ts, index)
+        self._n_messages = index + 1
+
+    def _add_command(self, command: str, index: int):
+        self._by_command.setdefault(command, array("I")).append(index)
+        self._commands.append(index)
+
+    def _add_search(
+        self, command: str, arguments: dict | None, created_ts: float, index: int
+    ):
+        query_argument, language_argument = SEARCH_ARGUMENTS[command]
+        arguments = arguments or {}
+        query = arguments.get(query_argument)
+        if not isinstance(query, str):
+            return
+        key = (command, *search_key(query, arguments.get(language_argument)))
+        self._searches.setdefault(key, []).append((index, created_ts))
+
+    def sync(self, history: Sequence[GptResponse | UserMessage]):
+        """Indexes all messages of the history that are not indexed yet.
+        If the history got shorter (i.e., was replaced), the index is rebuilt.
+        """
+        if len(history) < self._n_messages:
+            self.__init__()
+
+        if isinstance(history, LazyMessageHistory):
+            # without parsing (and loading) the persisted messages
+            for start in range(self._n_messages, len(history), _SYNC_CHUNK_SIZE):
+                commands = history.commands_of(start, start + _SYNC_CHUNK_SIZE)
+                for index, entry in enumerate(commands, start=start):
+                    if entry is not None:
+                        command, arguments, created_ts = entry
+                        self._add_command(command, index)
+                        if command in SEARCH_ARGUMENTS:
+                            self._add_search(command, arguments, created_ts, index)
+                    self._n_messages = index + 1
+            return
+
+        for index in range(self._n_messages, len(history)):
+            if isinstance(history, MessageStore):
+                # only search commands need the whole message
+                command = history.command_of(index)
+                if command is not None and command not in SEARCH_ARGUMENTS:
+                    self._add_command(command, index)
+                    self._n_messages = index + 1
+                    continue
+            self.add(history[index], index)
+        self._n_messages = len(history)
+
+    def indices(self, command_name: str | None = None) -> Sequence[int]:
+        """The message indices of the commands (with that name), oldest first"""
+        if command_name is None:
+            return self._commands
+        return self._by_command.get(command_name, ())
+
+    def latest_search(
+        self, command_name: str, query: str, language: str | None, before: int
+    ) -> tuple[int, float] | None:
+        """Finds the latest search of a command for the same query and language
+        Args:
+            command_name: the search command
+            query: the query searched for
+            language: the language searched in (None: the default language)
+            before: only consider messages with an index below that
+        Returns:
+            (message index, created_ts) of the search or None if there was no such search
+        """
+        searches = self._searches.get((command_name, *search_key(query, language)), ())
+        for index, created_ts in reversed(searches):
+            if index < before:
+                return index, created_ts
+        return None
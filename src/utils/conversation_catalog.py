@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import dataclasses
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Literal, get_args
+
+from datatypes.conversation_info import ConversationInfo
+from utils.app_settings import AppSettings
+from utils.conversation_codec import decode_record, split_records
+from utils.conversation_journal import SNAPSHOT_FILE_NAME
+from utils.files import write_atomic
+from utils.fork_links import read_fork_link
+from utils.history_store import HISTORY_FILE_NAME, HISTORY_INDEX_FILE_NAME
+from utils.tokenizer import count_tokens_many
+
+CATALOG_FILE_NAME = "catalog.jsonl"
+
+CatalogSortKey = Literal["modified", "name", "messages", "tokens", "size"]
+CATALOG_SORT_KEYS: tuple[str, ...] = get_args(CatalogSortKey)
+
+_SORT_KEYS = {
+    "modified": lambda info: info.modified_ts,
+    "name": lambda info: info.conversation_id,
+    "messages": lambda info: info.n_messages,
+    "tokens": lambda info: info.total_tokens,
+    "size": lambda info: info.size_bytes,
+}
+
+# rewrite the catalog when it holds that many outdated records more than conversations
+_MAX_OUTDATED_RECORDS = 256
+
+_CATALOGS: dict[Path, ConversationCatalog] = {}
+
+
+def folder_size(path: Path) -> int:
+    """The size of the files in a folder and its subfolders (e.g., the blobs)"""
+    return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+
+
+class ConversationCatalog:
+    """An append-only JSON lines file (`catalog.jsonl` in the conversations folder) with one
+    record per saved conversation state, so listing conversations does not touch their folders.
+    The last record of a conversation wins. Outdated records are dropped once there are too many.
+    A missing catalog is rebuilt from the conversation folders. When listing, the catalog is
+    checked against the folders, so conversations added or deleted by hand show up or vanish.
+    """
+
+    def __init__(self, conversation_path: Path, model: str, logger: logging.Logger):
+        """
+        Args:
+            conversation_path: the folder of all conversations
+            model: the model to count the tokens of the histories for (when adding folders)
+            logger: the logger to log warnings to
+        """
+        self._path = conversation_path / CATALOG_FILE_NAME
+        self._conversation_path = conversation_path
+        self._model = model
+        self._logger = logger
+        self._infos: dict[str, ConversationInfo] = {}
+        self._n_records = 0
+        # folders that are no (readable) conversations, not read again when listing
+        self._unreadable: set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._infos)
+
+    def __contains__(self, conversation_id: str) -> bool:
+        return conversation_id in self._infos
+
+    def get(self, conversation_id: str) -> ConversationInfo | None:
+        return self._infos.get(conversation_id)
+
+    @classmethod
+    def load(
+        cls, conversation_path: Path, model: str, logger: logging.Logger
+    ) -> ConversationCatalog:
+        """Reads the catalog of a conversations folder (rebuilds it if it does not exist)
+        Args:
+            conversation_path: the folder of all conversations
+            model: the model to count the tokens of the histories for (when rebuilding)
+            logger: the logger to log warnings to
+        """
+        catalog = cls(conversation_path, model=model, logger=logger)
+        if not catalog._path.is_file():
+            catalog.rebuild(model=model)
+            return catalog
+
+        broken = False
+        with open(catalog._path, "r") as f:
+            for line in f:
+                try:
+                    info = ConversationInfo(**json.loads(line))
+                except (ValueError, TypeError) as e:
+                    logger.warning(f"Skipping a broken record of `{catalog._path!s}` ({e})")
+                    broken = True
+                    continue
+                catalog._infos[info.conversation_id] = info
+                catalog._n_records += 1
+
+        if broken:
+            catalog._rewrite()
+
+        return catalog
+
+    def update(self, info: ConversationInfo):
+        """Records the new state of a conversation"""
+        self._infos[info.conversation_id] = info
+        with open(self._path, "a") as f:
+            f.write(json.dumps(dataclasses.asdict(info)) + "\n")
+        self._n_records += 1
+
+        if self._n_records > len(self._infos) + _MAX_OUTDATED_RECORDS:
+            self._rewrite()
+
+    def list(
+        self,
+        sort_by: CatalogSortKey = "modified",
+        descending: bool = True,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> list[ConversationInfo]:
+        """Lists the conversations
+        Args:
+            sort_by: what to sort by
+            descending: sort descending (the newest, largest, ... first)
+            offset: skip that many conversations (paging)
+            limit: return at most that many conversations (paging)
+        Raises:
+            ValueError: if the sort key is unknown
+        """
+        if sort_by not in _SORT_KEYS:
+            raise ValueError(
+                f"Cannot sort by `{sort_by}` (available: {', '.join(_SORT_KEYS)})"
+            )
+
+        self._reconcile()
+        infos = sorted(self._infos.values(), key=_SORT_KEYS[sort_by], reverse=descending)
+        return infos[offset : None if limit is None else offset + limit]
+
+    def rebuild(self, model: str):
+        """Builds the catalog from the conversation folders
+        Args:
+            model: the model to count the tokens of the histories for
+        """
+        self._infos = {}
+        for conversation_id in self._conversation_folders():
+            info = self._read_info(conversation_id, model=model)
+            if info is not None:
+                self._infos[conversation_id] = info
+
+        self._rewrite()
+        self._logger.info(f"Rebuilt the catalog of {len(self._infos)} conversations")
+
+    def _conversation_folders(self) -> set[str]:
+        """The ids of the conversation folders (only the folder names are read)"""
+        if not self._conversation_path.is_dir():
+            return set()
+        with os.scandir(self._conversation_path) as entries:
+            return {entry.name for entry in entries if entry.is_dir()}
+
+    def _read_info(self, conversation_id: str, model: str) -> ConversationInfo | None:
+        """Reads the state of a conversation from its folder (None if it is none)"""
+        folder = self._conversation_path / conversation_id
+        if not (folder / SNAPSHOT_FILE_NAME).is_file():
+            return None
+        try:
+            messages = self._read_messages(folder)
+            return ConversationInfo(
+                conversation_id=conversation_id,
+                n_messages=len(messages),
+                modified_ts=max(f.stat().st_mtime for f in folder.iterdir() if f.is_file()),
+                total_tokens=sum(count_tokens_many(messages, model=model, logger=self._logger)),
+                size_bytes=folder_size(folder),
+            )
+        except Exception as e:
+            self._logger.warning(
+                f"Couldn't add conversation `{conversation_id}` to the catalog due to `{e}`"
+            )
+            return None
+
+    def _reconcile(self):
+        """Drops the conversations whose folders are gone and adds folders that are missing"""
+        folders = self._conversation_folders()
+        removed = [
+            conversation_id for conversation_id in self._infos if conversation_id not in folders
+        ]
+        for conversation_id in removed:
+            del self._infos[conversation_id]
+
+        added = []
+        for conversation_id in folders.difference(self._infos, self._unreadable):
+            info = self._read_info(conversation_id, model=self._model)
+            if info is None:
+                # not (yet) a conversation, saving it adds it
+                self._unreadable.add(conversation_id)
+                continue
+            self._infos[conversation_id] = info
+            added.append(conversation_id)
+
+        if removed or added:
+            self._logger.info(
+                f"Updated the catalog: {len(added)} conversations added, {len(removed)} removed"
+            )
+            self._rewrite()
+
+    @staticmethod
+    def _read_messages(folder: Path) -> list[str]:
+        """The messages of a conversation (as JSON) without parsing them"""
+        prefix = []
+        link = read_fork_link(folder)
+        if link is not None and link.n_messages:
+            prefix = ConversationCatalog._read_messages(folder.parent / link.parent_id)
+            prefix = prefix[: link.n_messages]
+
+        if (folder / HISTORY_INDEX_FILE_NAME).is_file():
+            with open(folder / HISTORY_FILE_NAME, "rb") as f:
+                data = f.read()
+            ends, _ = split_records(data)
+            return prefix + [
+                json.dumps(decode_record(data[start:end]))
+                for start, end in zip([0, *ends], ends)
+            ]
+
+        # conversations of the former format that were not loaded since
+        with open(folder / SNAPSHOT_FILE_NAME, "r") as f:
+            return [json.dumps(message) for message in json.load(f).get("message_history", [])]
+
+    def _rewrite(self):
+        write_atomic(
+            self._path,
+            "".join(
+                json.dumps(dataclasses.asdict(info)) + "\n" for info in self._infos.values()
+            ).encode("utf-8"),
+        )
+        self._n_records = len(self._infos)
+
+
+def get_conversation_catalog(
+    app_settings: AppSettings, logger: logging.Logger
+) -> ConversationCatalog:
+    """Returns the (cached) catalog of the conversations folder"""
+    conversation_path = app_settings.conversation_path
+    key = conversation_path.resolve()
+    if key not in _CATALOGS:
+        conversation_path.mkdir(parents=True, exist_ok=True)
+        _CATALOGS[key] = ConversationCatalog.load(
+            conversation_path, model=app_settings.model, logger=logger
+        )
+    return _CATALOGS[key]
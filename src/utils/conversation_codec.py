@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import abc
+import json
+import lzma
+import struct
+import typing
+import zlib
+
+from exceptions.settings_exception import SettingsException
+from utils.app_settings import AppSettings
+
+# binary records start with this byte, which never starts a JSON object
+_FRAME_MAGIC = 0xA7
+# magic, serializer id, compression id, payload length
+_FRAME_HEADER = struct.Struct("<BBBI")
+
+
+class ISerializer(abc.ABC):
+    """Turns the dict of a message into bytes and back"""
+
+    id: int  # stored in every record (never change it)
+
+    @classmethod
+    @abc.abstractmethod
+    def name(cls) -> str:
+        """The name of the serializer (as used in the settings)"""
+
+    @abc.abstractmethod
+    def dumps(self, obj: dict) -> bytes:
+        pass
+
+    @abc.abstractmethod
+    def loads(self, data: bytes) -> dict:
+        pass
+
+
+class JsonSerializer(ISerializer):
+    id = 0
+
+    @classmethod
+    def name(cls) -> str:
+        return "json"
+
+    def dumps(self, obj: dict) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+    def loads(self, data: bytes) -> dict:
+        return json.loads(data)
+
+
+class OrjsonSerializer(ISerializer):
+    """JSON via `orjson` (optional dependency, faster than the json module)"""
+
+    id = 1
+
+    def __init__(self):
+        try:
+            import orjson
+        except ImportError:
+            raise SettingsException(
+                "The conversation serializer `orjson` needs the `orjson` package (pip install orjson)"
+            )
+        self._orjson = orjson
+
+    @classmethod
+    def name(cls) -> str:
+        return "orjson"
+
+    def dumps(self, obj: dict) -> bytes:
+        return self._orjson.dumps(obj)
+
+    def loads(self, data: bytes) -> dict:
+        return self._orjson.loads(data)
+
+
+class MsgpackSerializer(ISerializer):
+    """MessagePack via `msgpack` (optional dependency, compact binary)"""
+
+    id = 2
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError:
+            raise SettingsException(
+                "The conversation serializer `msgpack` needs the `msgpack` package (pip install msgpack)"
+            )
+        self._msgpack = msgpack
+
+    @classmethod
+    def name(cls) -> str:
+        return "msgpack"
+
+    def dumps(self, obj: dict) -> bytes:
+        return self._msgpack.packb(obj)
+
+    def loads(self, data: bytes) -> dict:
+        return self._msgpack.unpackb(data)
+
+
+class ICompression(abc.ABC):
+    """Compresses the serialized messages"""
+
+    id: int  # stored in every record (never change it)
+
+    @classmethod
+    @abc.abstractmethod
+    def name(cls) -> str:
+        """The name of the compression (as used in the settings)"""
+
+    @abc.abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        pass
+
+    @abc.abstractmethod
+    def decompress(self, data: bytes) -> bytes:
+        pass
+
+
+class NoCompression(ICompression):
+    id = 0
+
+    @classmethod
+    def name(cls) -> str:
+        return "none"
+
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+
+class ZlibCompression(ICompression):
+    id = 1
+
+    @classmethod
+    def name(cls) -> str:
+        return "zlib"
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class LzmaCompression(ICompression):
+    """Smaller than zlib but slower. Raw LZMA2 (no container headers per record)
+    with a small dictionary, as the encoder allocates it for every record"""
+
+    id = 2
+
+    _FILTERS = [{"id": lzma.FILTER_LZMA2, "preset": 6, "dict_size": 1 << 20}]
+
+    @classmethod
+    def name(cls) -> str:
+        return "lzma"
+
+    def compress(self, data: bytes) -> bytes:
+        return lzma.compress(data, format=lzma.FORMAT_RAW, filters=self._FILTERS)
+
+    def decompress(self, data: bytes) -> bytes:
+        return lzma.decompress(data, format=lzma.FORMAT_RAW, filters=self._FILTERS)
+
+
+# available serializers and compressions for the message history
+SERIALIZERS: dict[str, typing.Type[ISerializer]] = {
+    cls.name(): cls for cls in (JsonSerializer, OrjsonSerializer, MsgpackSerializer)
+}
+COMPRESSIONS: dict[str, typing.Type[ICompression]] = {
+    cls.name(): cls for cls in (NoCompression, ZlibCompression, LzmaCompression)
+}
+
+_SERIALIZERS_BY_ID = {cls.id: cls for cls in SERIALIZERS.values()}
+_COMPRESSIONS_BY_ID = {cls.id: cls for cls in COMPRESSIONS.values()}
+# instances for decoding (created when a record needs them)
+_DECODERS: dict[tuple[int, int], tuple[ISerializer, ICompression]] = {}
+
+
+class RecordCodec:
+    """Encodes messages as records of the history segment:
+        - plain JSON (json serializer without compression): a JSON line (readable as text)
+        - otherwise: a binary frame (header + compressed payload)
+    Records of all formats can be mixed, every record is decoded by what it is.
+    """
+
+    def __init__(self, serializer: ISerializer, compression: ICompression):
+        self._serializer = serializer
+        self._compression = compression
+        self._plain = isinstance(serializer, JsonSerializer) and isinstance(
+            compression, NoCompression
+        )
+
+    @property
+    def name(self) -> str:
+        return f"{self._serializer.name()}+{self._compression.name()}"
+
+    def encode(self, obj: dict) -> bytes:
+        """Encodes a message (as dict) as record"""
+        if self._plain:
+            return self._serializer.dumps(obj) + b"\n"
+
+        payload = self._compression.compress(self._serializer.dumps(obj))
+        return (
+            _FRAME_HEADER.pack(
+                _FRAME_MAGIC, self._serializer.id, self._compression.id, len(payload)
+            )
+            + payload
+        )
+
+
+def decode_record(record: bytes) -> dict:
+    """Decodes a record of any format back to the dict of the message
+    Raises:
+        ValueError: if the record is broken or of an unknown format
+    """
+    if not record or record[0] != _FRAME_MAGIC:
+        return json.loads(record)
+
+    _, serializer_id, compression_id, length = _FRAME_HEADER.unpack_from(record)
+    key = (serializer_id, compression_id)
+    if key not in _DECODERS:
+        if serializer_id not in _SERIALIZERS_BY_ID or compression_id not in _COMPRESSIONS_BY_ID:
+            raise ValueError(f"Unknown record format {key}")
+        _DECODERS[key] = (
+            _SERIALIZERS_BY_ID[serializer_id](),
+            _COMPRESSIONS_BY_ID[compression_id](),
+        )
+
+    serializer, compression = _DECODERS[key]
+    payload = record[_FRAME_HEADER.size : _FRAME_HEADER.size + length]
+    return serializer.loads(compression.decompress(payload))
+
+
+def split_records(data: bytes) -> tuple[list[int], int]:
+    """Finds the complete records in a chunk of the history segment
+    Args:
+        data: the bytes starting at a record boundary
+    Returns:
+        the end offsets (relative to `data`) of the complete records and the end of the last one
+    """
+    ends = []
+    pos = 0
+    while pos < len(data):
+        if data[pos] == _FRAME_MAGIC:
+            if pos + _FRAME_HEADER.size > len(data):
+                break
+            end = pos + _FRAME_HEADER.size + _FRAME_HEADER.unpack_from(data, pos)[3]
+            if end > len(data):
+                break
+        else:
+            newline = data.find(b"\n", pos)
+            if newline < 0:
+                break
+            end = newline + 1
+        ends.append(end)
+        pos = end
+
+    return ends, pos
+
+
+def get_record_codec(settings: AppSettings) -> RecordCodec:
+    """Returns the codec for new records as configured in the settings
+    Raises:
+        SettingsException: if the serializer or compression is unknown or not installed
+    """
+    serializer = settings.conversation_serializer
+    compression = settings.conversation_compression
+    if serializer not in SERIALIZERS:
+        raise SettingsException(
+            f"Unknown conversation serializer `{serializer}` (available: {', '.join(SERIALIZERS)})"
+        )
+    if compression not in COMPRESSIONS:
+        raise SettingsException(
+            f"Unknown conversation compression `{compression}` (available: {', '.join(COMPRESSIONS)})"
+        )
+    return RecordCodec(SERIALIZERS[serializer](), COMPRESSIONS[compression]())
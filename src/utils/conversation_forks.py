@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import logging
+import time
+from pathlib import Path
+
+from datatypes.conversation_info import ConversationInfo
+from datatypes.fork_link import ForkLink
+from exceptions.conversation_exception import ConversationCannotBeSavedException
+from utils.app_settings import AppSettings
+from utils.conversation_catalog import folder_size, get_conversation_catalog
+from utils.conversation_codec import get_record_codec
+from utils.conversation_journal import ConversationJournal
+from utils.fork_links import add_fork_id, read_fork_ids, read_fork_link, write_fork_link
+from utils.history_store import open_history_segment
+
+
+def fork_conversation(
+    conversation_id: str, app_settings: AppSettings, logger: logging.Logger
+) -> str:
+    """Forks a saved conversation: the fork continues from the same state under a new id.
+    Nothing is copied, the fork reads the history, the key storage and the files of the
+    conversation and only keeps what changes from then on (on either side, see `OverlayStorage`).
+    Args:
+        conversation_id: the id of the conversation to fork
+        app_settings: the application settings
+        logger: the logger to log to
+    Returns:
+        the id of the fork
+    Raises:
+        ConversationNotReadableException: if the conversation cannot be read
+        ConversationCannotBeSavedException: if the fork cannot be written
+    """
+    conversation_path = app_settings.conversation_path / conversation_id
+    conv_dict, journal = ConversationJournal.load(
+        conversation_path,
+        codec=get_record_codec(app_settings),
+        fsync_every=app_settings.journal_fsync_every,
+        compact_every=app_settings.journal_compact_every,
+        logger=logger,
+    )
+    n_messages = journal.n_messages
+    journal.close()
+
+    number = 1
+    while (app_settings.conversation_path / f"{conversation_id}-fork-{number}").exists():
+        number += 1
+    fork_id = f"{conversation_id}-fork-{number}"
+    fork_path = app_settings.conversation_path / fork_id
+
+    try:
+        ConversationJournal.create(
+            fork_path,
+            conv_dict_meta={**conv_dict, "conversation_id": fork_id},
+            messages=[],
+            fsync_every=app_settings.journal_fsync_every,
+            compact_every=app_settings.journal_compact_every,
+            logger=logger,
+        ).close()
+        write_fork_link(fork_path, ForkLink(parent_id=conversation_id, n_messages=n_messages))
+        add_fork_id(conversation_path, fork_id)
+    except Exception as e:
+        raise ConversationCannotBeSavedException(
+            f"Couldn't fork conversation {conversation_id} due to `{e}`"
+        )
+
+    catalog = get_conversation_catalog(app_settings, logger=logger)
+    parent_info = catalog.get(conversation_id)
+    catalog.update(
+        ConversationInfo(
+            conversation_id=fork_id,
+            n_messages=n_messages,
+            modified_ts=time.time(),
+            total_tokens=parent_info.total_tokens
+            if parent_info and parent_info.n_messages == n_messages
+            else 0,
+            size_bytes=folder_size(fork_path),
+        )
+    )
+    logger.info(f"Forked conversation {conversation_id} as {fork_id} ({n_messages} messages)")
+    return fork_id
+
+
+def detach_forks(conversation_path: Path, logger: logging.Logger):
+    """Copies the history prefix the forks of a conversation read from it into the forks
+    (needed before its history is rewritten)
+    Args:
+        conversation_path: the folder of the conversation
+        logger: the logger to log to
+    """
+    for fork_id in read_fork_ids(conversation_path):
+        fork_path = conversation_path.parent / fork_id
+        link = read_fork_link(fork_path)
+        if link is None or link.n_messages == 0:
+            continue
+
+        segment = open_history_segment(fork_path, logger=logger)
+        try:
+            # rewriting a fork's history detaches it
+            segment.rewrite(segment.read_range(0, len(segment)))
+        finally:
+            segment.close()
+        logger.info(f"Copied the history of {conversation_path.name} into its fork {fork_id}")
@@ -0,0 +1,284 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Sequence
+
+from exceptions.conversation_exception import ConversationNotReadableException
+from utils.conversation_codec import RecordCodec
+from utils.files import write_atomic
+from utils.history_store import HistorySegment, open_history_segment
+
+SNAPSHOT_FILE_NAME = "conversation.json"
+JOURNAL_FILE_NAME = "journal.jsonl"
+
+# key in the snapshot that tells which journal belongs to it (not a field of the ChatContext)
+GENERATION_KEY = "journal_generation"
+
+
+class ConversationJournal:
+    """Persists a conversation as
+        - a snapshot (`conversation.json`) of its fields besides the message history
+        - the message history as an append-only segment with an offset index (see `HistorySegment`)
+        - an append-only journal (`journal.jsonl`) of the changes to the fields since the snapshot,
+          one record per line:
+            - {"op": "begin", "generation": g}: the first line, the snapshot the journal continues
+            - {"op": "meta", "fields": {...}}: changed fields of the conversation
+    Saving a turn therefore only appends the new messages instead of rewriting the whole conversation.
+    Every `compact_every` records the journal is folded into a new snapshot.
+
+    Replay is crash safe:
+        - the snapshot is only ever replaced atomically
+        - a journal of an older generation than the snapshot (crash while compacting) is ignored
+        - a partially written last line (crash while appending) is dropped
+
+    Conversations saved with the whole history in the snapshot are migrated when loading.
+    """
+
+    def __init__(
+        self,
+        conversation_path: Path,
+        segment: HistorySegment,
+        generation: int,
+        meta: str,
+        n_records: int,
+        fsync_every: int,
+        compact_every: int,
+        logger: logging.Logger,
+    ):
+        self._path = conversation_path
+        self._segment = segment
+        self._generation = generation
+        self._meta = meta
+        self._n_records = n_records
+        self._fsync_every = fsync_every
+        self._compact_every = compact_every
+        self._logger = logger
+        self._n_unsynced = 0
+        self._file = open(self._path / JOURNAL_FILE_NAME, "ab")
+
+    @property
+    def segment(self) -> HistorySegment:
+        """The persisted message history"""
+        return self._segment
+
+    @property
+    def n_messages(self) -> int:
+        """The number of messages of the history that are persisted"""
+        return len(self._segment)
+
+    @property
+    def should_compact(self) -> bool:
+        """Whether the journal grew long enough to be folded into the snapshot"""
+        return self._compact_every > 0 and self._n_records >= self._compact_every
+
+    @staticmethod
+    def _meta_of(conv_dict_meta: dict) -> str:
+        return json.dumps(conv_dict_meta, sort_keys=True)
+
+    @staticmethod
+    def _begin_record(generation: int) -> bytes:
+        return (json.dumps({"op": "begin", "generation": generation}) + "\n").encode("utf-8")
+
+    @classmethod
+    def create(
+        cls,
+        conversation_path: Path,
+        conv_dict_meta: dict,
+        messages: Sequence[bytes],
+        fsync_every: int,
+        compact_every: int,
+        logger: logging.Logger,
+    ) -> ConversationJournal:
+        """Starts the journal of a new conversation (writes its first snapshot)
+        Args:
+            conversation_path: the folder of the conversation
+            conv_dict_meta: the fields of the conversation besides the message history
+            messages: the messages of the conversation (as records, see `RecordCodec`)
+            fsync_every: sync the journal to disk every that many records (0: leave it to the os)
+            compact_every: fold the journal into the snapshot every that many records (0: never)
+            logger: the logger to log warnings to
+        """
+        conversation_path.mkdir(exist_ok=True)
+        segment = HistorySegment(conversation_path, logger=logger)
+        segment.rewrite(messages)
+        journal = cls(
+            conversation_path,
+            segment=segment,
+            generation=-1,
+            meta="",
+            n_records=0,
+            fsync_every=fsync_every,
+            compact_every=compact_every,
+            logger=logger,
+        )
+        journal.compact(conv_dict_meta)
+        return journal
+
+    @classmethod
+    def load(
+        cls,
+        conversation_path: Path,
+        codec: RecordCodec,
+        fsync_every: int,
+        compact_every: int,
+        logger: logging.Logger,
+    ) -> tuple[dict, ConversationJournal]:
+        """Replays the snapshot and the journal of a conversation (not the message history,
+        which is read from the journal's `segment` when needed).
+        Conversations that were saved in the former formats are migrated.
+        Args:
+            conversation_path: the folder of the conversation
+            codec: the codec to write migrated messages with
+            fsync_every: sync the journal to disk every that many records (0: leave it to the os)
+            compact_every: fold the journal into the snapshot every that many records (0: never)
+            logger: the logger to log warnings to
+        Returns:
+            the fields of the conversation besides the message history and the journal to continue it with
+        Raises:
+            ConversationNotReadableException: if the snapshot is missing or the journal is corrupted
+        """
+        snapshot_file = conversation_path / SNAPSHOT_FILE_NAME
+        if not snapshot_file.is_file():
+            raise ConversationNotReadableException(f"`{snapshot_file!s}` does not exist")
+
+        with open(snapshot_file, "r") as f:
+            conv_dict = json.loads(f.read())
+        generation = conv_dict.pop(GENERATION_KEY, 0)
+        # only snapshots of the former formats contain the history
+        legacy_history = conv_dict.pop("message_history", None)
+
+        journal_file = conversation_path / JOURNAL_FILE_NAME
+        n_records = 0
+        valid_end = 0
+        stale = False
+        if journal_file.is_file():
+            with open(journal_file, "rb") as f:
+                lines = f.readlines()
+
+            for line_number, line in enumerate(lines):
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete line")
+                    record = json.loads(line)
+                except ValueError as e:
+                    if line_number == len(lines) - 1:
+                        logger.warning(
+                            f"Dropping the partially written last record of `{journal_file!s}` ({e})"
+                        )
+                        break
+                    raise ConversationNotReadableException(
+                        f"Record {line_number + 1} of `{journal_file!s}` is corrupted due to `{e}`"
+                    )
+
+                valid_end += len(line)
+                op = record.get("op")
+                if op == "begin":
+                    # written before the snapshot was replaced (crash while compacting)
+                    stale = record["generation"] < generation
+                    if stale:
+                        break
+                elif op == "meta":
+                    n_records += 1
+                    conv_dict.update(record["fields"])
+                else:
+                    raise ConversationNotReadableException(
+                        f"Unknown record `{op}` in `{journal_file!s}`"
+                    )
+
+        if legacy_history is not None:
+            logger.info(f"Migrating conversation `{conversation_path.name}` to the journal format")
+            return conv_dict, cls.create(
+                conversation_path,
+                conv_dict_meta=conv_dict,
+                messages=[codec.encode(message) for message in legacy_history],
+                fsync_every=fsync_every,
+                compact_every=compact_every,
+                logger=logger,
+            )
+
+        if stale or valid_end == 0:
+            # continue with a fresh journal
+            with open(journal_file, "wb") as f:
+                f.write(cls._begin_record(generation))
+            n_records = 0
+        else:
+            # cut off what is behind the last complete record
+            os.truncate(journal_file, valid_end)
+
+        journal = cls(
+            conversation_path,
+            segment=open_history_segment(conversation_path, logger=logger),
+            generation=generation,
+            meta=cls._meta_of(conv_dict),
+            n_records=n_records,
+            fsync_every=fsync_every,
+            compact_every=compact_every,
+            logger=logger,
+        )
+        return conv_dict, journal
+
+    def append(self, messages: Sequence[bytes], conv_dict_meta: dict):
+        """Appends new messages to the history and the conversation fields (if they changed) to the journal
+        Args:
+            messages: the new messages (as records) following the persisted ones
+            conv_dict_meta: the fields of the conversation besides the message history
+        """
+        self._segment.append(messages)
+        n_records = len(messages)
+
+        meta = self._meta_of(conv_dict_meta)
+        if meta != self._meta:
+            self._file.write(
+                (json.dumps({"op": "meta", "fields": conv_dict_meta}) + "\n").encode("utf-8")
+            )
+            self._file.flush()
+            self._meta = meta
+            self._n_records += 1
+            n_records += 1
+
+        self._n_unsynced += n_records
+        if self._fsync_every > 0 and self._n_unsynced >= self._fsync_every:
+            self.sync()
+
+    def rewrite_history(self, messages: Sequence[bytes]):
+        """Replaces the whole persisted message history (e.g., when messages were removed)
+        Args:
+            messages: all messages (as records)
+        """
+        self._segment.rewrite(messages)
+
+    def sync(self):
+        """Forces the appended messages and records to disk"""
+        if self._n_unsynced:
+            self._segment.sync()
+            os.fsync(self._file.fileno())
+            self._n_unsynced = 0
+
+    def compact(self, conv_dict_meta: dict):
+        """Folds the journal into a new snapshot of the conversation fields
+        Args:
+            conv_dict_meta: the fields of the conversation besides the message history
+        """
+        self.sync()
+        generation = self._generation + 1
+        write_atomic(
+            self._path / SNAPSHOT_FILE_NAME,
+            json.dumps({**conv_dict_meta, GENERATION_KEY: generation}).encode("utf-8"),
+        )
+        # the snapshot is in place, the old journal is stale from here on
+        self._file.close()
+        write_atomic(self._path / JOURNAL_FILE_NAME, self._begin_record(generation))
+        self._file = open(self._path / JOURNAL_FILE_NAME, "ab")
+
+        self._generation = generation
+        self._meta = self._meta_of(conv_dict_meta)
+        self._n_records = 0
+
+    def close(self):
+        """Syncs and closes the journal"""
+        self.sync()
+        self._segment.close()
+        self._file.close()
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import atexit
+import logging
+import queue
+import signal
+import sys
+import threading
+
+from datatypes.chat_context import ChatContext
+from datatypes.conversation_changes import ConversationChanges
+from utils.conversations import capture_changes, save_conversation, write_changes
+
+_STOP = object()
+
+
+class ConversationWriter:
+    """Saves a conversation in the background, so the interactive loop never waits for the disk.
+    `save` captures the changes since the last save (in the calling thread) and queues them.
+    A writer thread coalesces everything that queued up into one write. Failed writes are
+    retried with the next save. Pending changes are written on exit (also on SIGTERM / SIGHUP).
+
+    With `background=False` every save is written right away (in the calling thread).
+    """
+
+    def __init__(self, ctx: ChatContext, logger: logging.Logger, background: bool = True):
+        self._ctx = ctx
+        self._logger = logger
+        self._background = background
+        self._n_captured = ctx.journal.n_messages if ctx.journal is not None else 0
+        self._queue: queue.Queue = queue.Queue()
+        self._pending: ConversationChanges | None = None
+        self._thread: threading.Thread | None = None
+        if background:
+            self._thread = threading.Thread(
+                target=self._run, name="conversation-writer", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.close)
+            _flush_on_signals()
+
+    def save(self):
+        """Saves the conversation (returns right away in the background mode)
+        Raises:
+            ConversationCannotBeSavedException: if the conversation cannot be saved
+             (only without background)
+        """
+        if not self._background:
+            save_conversation(self._ctx)
+            return
+
+        changes = capture_changes(self._ctx, n_saved=self._n_captured)
+        self._n_captured = changes.n_messages
+        self._queue.put(changes)
+
+    def flush(self):
+        """Waits until everything saved so far is written (or failed)"""
+        if self._background:
+            self._queue.join()
+
+    def close(self):
+        """Writes what is pending and stops the writer thread"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+
+        self._queue.put(_STOP)
+        self._thread.join()
+        if self._pending is not None:
+            # last attempt
+            try:
+                write_changes(self._ctx, self._pending)
+                self._pending = None
+            except Exception as e:
+                self._logger.error(
+                    f"Conversation {self._ctx.conversation_id} could not be saved completely due to `{e}`"
+                )
+        if self._ctx.journal is not None:
+            self._ctx.journal.sync()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            n_items = 1
+            # coalesce everything that queued up meanwhile
+            while item is not _STOP:
+                try:
+                    following = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                n_items += 1
+                if following is _STOP:
+                    self._write(item)
+                    item = _STOP
+                else:
+                    item = item.merge(following)
+
+            if item is not _STOP:
+                self._write(item)
+
+            for _ in range(n_items):
+                self._queue.task_done()
+            if item is _STOP:
+                return
+
+    def _write(self, changes: ConversationChanges):
+        if self._pending is not None:
+            changes = self._pending.merge(changes)
+
+        try:
+            write_changes(self._ctx, changes)
+            self._pending = None
+        except Exception as e:
+            self._logger.error(f"{e} (retrying with the next save)")
+            self._pending = changes
+
+
+_SIGNALS_HANDLED = False
+
+
+def _flush_on_signals():
+    """Turns SIGTERM and SIGHUP into a regular exit, so the pending saves are written (atexit)"""
+    global _SIGNALS_HANDLED
+    if _SIGNALS_HANDLED or threading.current_thread() is not threading.main_thread():
+        return
+
+    def exit_gracefully(signum, frame):
+        sys.exit(128 + signum)
+
+    for name in ("SIGTERM", "SIGHUP"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), exit_gracefully)
+    _SIGNALS_HANDLED = True
@@ -1,60 +1,240 @@
 import json
 import logging
+import time
+from typing import Callable
 
 from datatypes.chat_context import ChatContext
+from datatypes.conversation_changes import ConversationChanges
+from datatypes.conversation_info import ConversationInfo
+from datatypes.gpt_response import GptResponse
+from datatypes.user_message import UserMessage
 from exceptions.conversation_exception import (
     ConversationCannotBeSavedException,
     ConversationNotReadableException,
 )
 from utils.app_settings import AppSettings
+from utils.blob_store import BlobStore, open_blob_store
+from utils.conversation_catalog import (
+    CatalogSortKey,
+    folder_size,
+    get_conversation_catalog,
+)
+from utils.conversation_codec import decode_record, get_record_codec
+from utils.conversation_forks import detach_forks
+from utils.conversation_journal import ConversationJournal
+from utils.files import write_atomic
+from utils.history_store import LazyMessageHistory, parse_message
 from utils.storage import load_key_storage_backend, load_file_storage_backend
+from utils.token_cache import TOKEN_CACHE_FILE_NAME, TokenCountCache
+from utils.tokenizer import count_tokens_many
+
+# fields of the ChatContext that only live at runtime and are not written to the conversation file
+_RUNTIME_FIELDS = {
+    "file_storage_backend",
+    "key_storage_backend",
+    "settings",
+    "default_logger",
+    "token_cache",
+    "last_query",
+    "history_index",
+    "command_index",
+    "key_index",
+    "value_index",
+    "journal",
+    "blob_store",
+}
 
 
-def available_conversations(app_settings: AppSettings) -> list[str]:
-    """Returns a list of all available conversations
+def available_conversations(
+    app_settings: AppSettings,
+    logger: logging.Logger,
+    sort_by: CatalogSortKey = "modified",
+    descending: bool = True,
+    offset: int = 0,
+    limit: int | None = None,
+) -> list[ConversationInfo]:
+    """Returns the available conversations (from the conversation catalog)
     Args:
         app_settings: the application settings (will be used to determine the conversation path)
+        logger: the logger to log warnings to
+        sort_by: what to sort by
+        descending: sort descending (the newest, largest, ... first)
+        offset: skip that many conversations (paging)
+        limit: return at most that many conversations (paging)
     """
-    conversations = []
-    for f in app_settings.conversation_path.iterdir():
-        if f.is_dir() and f / "conversation.json" in f.iterdir():
-            conversations.append(f.name)
+    return get_conversation_catalog(app_settings, logger=logger).list(
+        sort_by=sort_by, descending=descending, offset=offset, limit=limit
+    )
 
-    return conversations
 
+def _conversation_dict(ctx: ChatContext, exclude: set[str] | None = None) -> dict:
+    """The persisted fields of a conversation as (JSON compatible) dict"""
+    return json.loads(ctx.json(exclude=_RUNTIME_FIELDS | (exclude or set())))
 
-def save_conversation(ctx: ChatContext):
-    """Saves a conversation to the file system
+
+def _message_parser(
+    blob_store: BlobStore | None,
+) -> Callable[[bytes], GptResponse | UserMessage]:
+    """Parses persisted messages that read their large payloads from the blob store"""
+
+    def parse(record: bytes) -> GptResponse | UserMessage:
+        message = parse_message(record)
+        if blob_store is not None and isinstance(message, UserMessage):
+            message.bind_blob_store(blob_store)
+        return message
+
+    return parse
+
+
+def capture_changes(ctx: ChatContext, n_saved: int) -> ConversationChanges:
+    """Captures what changed in a conversation, so it can be written by another thread
     Args:
-        ctx: the chat context to save will save in conversation_path / conversation_id
+        ctx: the chat context
+        n_saved: the number of messages saved (or captured) before
+    """
+    # forget token counts of messages that are gone
+    ctx.token_cache.evict(max_slot=len(ctx.message_history))
+    rewrite = len(ctx.message_history) < n_saved
+    first_index = 0 if rewrite else n_saved
+
+    # keep only a preview of large responses in the message (and in memory)
+    threshold = ctx.settings.blob_threshold_chars
+    if threshold > 0:
+        if ctx.blob_store is None:
+            ctx.blob_store = open_blob_store(ctx.settings.conversation_path / ctx.conversation_id)
+        for index, message in enumerate(ctx.message_history[first_index:], start=first_index):
+            if isinstance(message, UserMessage) and len(message.user_response) > threshold:
+                message.move_to_blob_store(ctx.blob_store)
+                # the history may keep copies of its messages (see MessageStore)
+                ctx.message_history[index] = message
+
+    history = ctx.message_history
+    if ctx.journal is not None and not isinstance(history, LazyMessageHistory):
+        # page the history of new conversations as well, once it is persisted
+        history = ctx.message_history = LazyMessageHistory(
+            ctx.journal.segment,
+            parse=_message_parser(ctx.blob_store),
+            messages=history,
+            memory_limit=ctx.settings.history_memory_limit_kb * 1024,
+        )
+
+    return ConversationChanges(
+        first_index=first_index,
+        messages=[message.dict() for message in ctx.message_history[first_index:]],
+        meta=_conversation_dict(ctx, exclude={"message_history"}),
+        n_messages=len(ctx.message_history),
+        rewrite=rewrite,
+        token_counts=ctx.token_cache.export(),
+        history_version=history.version if isinstance(history, LazyMessageHistory) else None,
+    )
+
+
+def write_changes(ctx: ChatContext, changes: ConversationChanges):
+    """Writes captured changes of a conversation to the file system.
+    The new messages are appended to the history of the conversation and changed fields
+    to its journal, which is folded into the snapshot from time to time.
+    Args:
+        ctx: the chat context the changes belong to
+        changes: the changes
     raises:
-        ConversationCannotBeSavedException: if the conversation cannot be saved
+        ConversationCannotBeSavedException: if the changes cannot be written
     """
     conversation_path = ctx.settings.conversation_path / ctx.conversation_id
-    conversation_path.mkdir(exist_ok=True)
-    json = ctx.json(
-        exclude={
-            "file_storage_backend",
-            "key_storage_backend",
-            "settings",
-            "default_logger",
-        },
-        # indent=4,
-        # sort_keys=True,
-    )
     try:
-        with open(conversation_path / "conversation.json", "w") as f:
-            f.write(json)
+        catalog = get_conversation_catalog(ctx.settings, logger=ctx.default_logger)
+        previous = catalog.get(ctx.conversation_id)
+        codec = get_record_codec(ctx.settings)
+        if ctx.blob_store is not None:
+            # before the messages referencing them
+            ctx.blob_store.flush()
+        records = [codec.encode(message) for message in changes.messages]
+        n_skipped = 0
+        if ctx.journal is None:
+            ctx.journal = ConversationJournal.create(
+                conversation_path,
+                conv_dict_meta=changes.meta,
+                messages=records,
+                fsync_every=ctx.settings.journal_fsync_every,
+                compact_every=ctx.settings.journal_compact_every,
+                logger=ctx.default_logger,
+            )
+            previous = None
+        elif changes.rewrite:
+            # the forks read the history that is about to be replaced
+            detach_forks(conversation_path, logger=ctx.default_logger)
+            ctx.journal.rewrite_history(records)
+            ctx.journal.append([], conv_dict_meta=changes.meta)
+            previous = None
+        else:
+            if changes.first_index > ctx.journal.n_messages:
+                raise ValueError(
+                    f"Changes start at message {changes.first_index} "
+                    f"but only {ctx.journal.n_messages} messages are saved"
+                )
+            # messages that were saved by a former (partially failed) attempt
+            n_skipped = ctx.journal.n_messages - changes.first_index
+            records = records[n_skipped:]
+            if previous is not None and previous.n_messages != ctx.journal.n_messages:
+                previous = None  # the catalog is outdated
+            ctx.journal.append(records, conv_dict_meta=changes.meta)
+
+        if changes.history_version is not None and isinstance(
+            ctx.message_history, LazyMessageHistory
+        ):
+            ctx.message_history.mark_durable(changes.n_messages, changes.history_version)
+
+        if ctx.journal.should_compact:
+            ctx.journal.compact(changes.meta)
+
+        if changes.token_counts is not None:
+            write_atomic(conversation_path / TOKEN_CACHE_FILE_NAME, changes.token_counts)
+
+        new_messages = changes.messages[n_skipped:]
+        if previous is None:
+            # count the whole history once, afterwards only the new messages
+            segment = ctx.journal.segment
+            new_messages = [
+                decode_record(record) for record in segment.read_range(0, len(segment))
+            ]
+        catalog.update(
+            ConversationInfo(
+                conversation_id=ctx.conversation_id,
+                n_messages=changes.n_messages,
+                modified_ts=time.time(),
+                total_tokens=(previous.total_tokens if previous else 0)
+                + sum(
+                    count_tokens_many(
+                        [json.dumps(message) for message in new_messages],
+                        model=ctx.settings.model,
+                        logger=ctx.default_logger,
+                    )
+                ),
+                size_bytes=folder_size(conversation_path),
+            )
+        )
     except Exception as e:
         raise ConversationCannotBeSavedException(
             f"Couldn't save conversation due to `{str(e)}`"
         )
 
 
+def save_conversation(ctx: ChatContext):
+    """Saves a conversation to the file system (in the calling thread, see `ConversationWriter`
+    for saving in the background)
+    Args:
+        ctx: the chat context to save will save in conversation_path / conversation_id
+    raises:
+        ConversationCannotBeSavedException: if the conversation cannot be saved
+    """
+    n_saved = ctx.journal.n_messages if ctx.journal is not None else 0
+    write_changes(ctx, capture_changes(ctx, n_saved=n_saved))
+
+
 def load_conversation(
     conversation_id: str, app_settings: AppSettings, logger: logging.Logger
 ) -> ChatContext:
-    """Loads a conversation from the file system
+    """Loads a conversation from the file system (replays its snapshot and journal).
+    The messages of the history are only read and parsed when they are accessed.
     Args:
         conversation_id: the id of the conversation to load
         app_settings: the application settings (will be used to determine the conversation path)
@@ -63,11 +243,16 @@ def load_conversation(
     conversation_path = app_settings.conversation_path / conversation_id
 
     try:
-        with open(conversation_path / "conversation.json", "r") as f:
-            conv_dict = json.loads(f.read())
-            id = conv_dict["conversation_id"]
+        conv_dict, journal = ConversationJournal.load(
+            conversation_path,
+            codec=get_record_codec(app_settings),
+            fsync_every=app_settings.journal_fsync_every,
+            compact_every=app_settings.journal_compact_every,
+            logger=logger,
+        )
+        id = conv_dict["conversation_id"]
 
-        return ChatContext(
+        ctx = ChatContext(
             **conv_dict,
             key_storage_backend=load_key_storage_backend(
                 app_settings=app_settings, conversation_id=id
@@ -77,7 +262,19 @@ def load_conversation(
             ),
             default_logger=logger,
             settings=app_settings,
+            token_cache=TokenCountCache.load(
+                conversation_path / TOKEN_CACHE_FILE_NAME, logger=logger
+            ),
+            journal=journal,
+        )
+        ctx.blob_store = open_blob_store(conversation_path)
+        # assigned without validation, which would parse every message
+        ctx.message_history = LazyMessageHistory(
+            journal.segment,
+            parse=_message_parser(ctx.blob_store),
+            memory_limit=app_settings.history_memory_limit_kb * 1024,
         )
+        return ctx
 
     except Exception as e:
         raise ConversationNotReadableException(
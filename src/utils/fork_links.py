@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import dataclasses
+import json
+from pathlib import Path
+
+from datatypes.fork_link import ForkLink
+from utils.files import write_atomic
+
+# in the folder of a forked conversation: its link to the parent
+FORK_FILE_NAME = "fork.json"
+# in the folder of a conversation that was forked: the ids of its forks
+FORKS_FILE_NAME = "forks.json"
+
+
+def read_fork_link(conversation_path: Path) -> ForkLink | None:
+    """The link of a forked conversation to its parent (None if it is no fork)"""
+    try:
+        with open(conversation_path / FORK_FILE_NAME, "r") as f:
+            return ForkLink(**json.load(f))
+    except FileNotFoundError:
+        return None
+
+
+def write_fork_link(conversation_path: Path, link: ForkLink):
+    write_atomic(
+        conversation_path / FORK_FILE_NAME, json.dumps(dataclasses.asdict(link)).encode("utf-8")
+    )
+
+
+def read_fork_ids(conversation_path: Path) -> list[str]:
+    """The ids of the conversations forked from a conversation"""
+    try:
+        with open(conversation_path / FORKS_FILE_NAME, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def add_fork_id(conversation_path: Path, fork_id: str):
+    fork_ids = read_fork_ids(conversation_path)
+    if fork_id not in fork_ids:
+        write_atomic(
+            conversation_path / FORKS_FILE_NAME, json.dumps([*fork_ids, fork_id]).encode("utf-8")
+        )
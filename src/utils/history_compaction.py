@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import datetime
+import logging
+import threading
+
+from datatypes.chat_context import ChatContext
+from datatypes.history_summary import HistorySummary
+from utils.chatgpt import send_message
+from utils.history_encoder import get_history_encoder
+from utils.query import history_entry
+
+summary_query_template = """\
+Update the summary of a conversation between human(s) and an AI assistant with the messages given below. 
+Keep all facts, decisions, results (e.g., of searches or websites) and open tasks that might be needed later. 
+Mention the message index (#) for details that are too long to keep. 
+Answer *only* with the updated summary. It must not be longer than {max_words} words.
+
+----BEGIN Current Summary----
+{summary}
+----END Current Summary----
+
+----BEGIN New Messages----
+{messages}
+----END New Messages----
+"""
+
+# messages are cut to this many characters before they are summarized
+_MAX_MESSAGE_CHARS = 2000
+
+
+class HistoryCompactor:
+    """Folds the messages that dropped out of the prompt history into the rolling summary
+    of the conversation (`ChatContext.history_summary`).
+    The messages are summarized in batches by a background thread, so it happens while
+    the human takes their turn. The summary is stored with the conversation and only
+    extended (never recomputed) afterwards.
+    """
+
+    def __init__(self, ctx: ChatContext, logger: logging.Logger):
+        self._ctx = ctx
+        self._logger = logger
+        self._target = 0
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def schedule(self, evicted_until: int):
+        """Summarizes the messages below `evicted_until` (the ones not in the prompt anymore)
+        as soon as there are enough of them for a batch. Returns immediately.
+        """
+        settings = self._ctx.settings
+        if not settings.history_summary:
+            return
+
+        with self._lock:
+            self._target = max(self._target, evicted_until)
+            pending = self._target - self._ctx.history_summary.n_summarized
+            if pending < settings.history_summary_batch_size:
+                return
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="history-compaction", daemon=True
+                )
+                self._thread.start()
+
+    def wait(self, timeout: float | None = None):
+        """Waits for a running compaction to finish"""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self):
+        settings = self._ctx.settings
+        while True:
+            with self._lock:
+                summary = self._ctx.history_summary
+                start = summary.n_summarized
+                end = min(self._target, start + settings.history_summary_batch_size)
+                if self._target - start < settings.history_summary_batch_size:
+                    return
+
+            try:
+                self._ctx.history_summary = self._summarize(summary, start, end)
+                self._logger.debug(f"Summarized the messages #{start} to #{end - 1}")
+            except Exception as e:
+                self._logger.error(
+                    f"Couldn't summarize the messages #{start} to #{end - 1} due to `{e}`"
+                )
+                return
+
+    def _summarize(self, summary: HistorySummary, start: int, end: int) -> HistorySummary:
+        settings = self._ctx.settings
+        encoder = get_history_encoder(settings)
+        entries = []
+        for index in range(start, end):
+            index, user, msg = history_entry(self._ctx, index, encoder)
+            if len(msg) > _MAX_MESSAGE_CHARS:
+                msg = msg[:_MAX_MESSAGE_CHARS] + " [...]"
+            entries.append((index, user, msg))
+
+        text = send_message(
+            user_message=summary_query_template.format(
+                # about 0.75 words per token
+                max_words=int(settings.history_summary_max_tokens * 0.75),
+                summary=summary.text or "None",
+                messages=encoder.history_to_str(entries),
+            ),
+            model=settings.history_summary_model,
+            logger=self._logger,
+            system_role="Precise assistant that summarizes conversations.",
+        )
+
+        return HistorySummary(
+            text=text.strip(),
+            n_summarized=end,
+            updated_ts=datetime.datetime.now().timestamp(),
+        )
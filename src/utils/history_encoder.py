@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import abc
+import json
+import typing
+from typing import Sequence
+
+from datatypes.gpt_response import GptResponse
+from datatypes.user_message import UserMessage
+from utils.app_settings import AppSettings
+
+
+class IHistoryEncoder(abc.ABC):
+    """Renders the messages of the conversation history for the prompt.
+    Every message becomes a history entry (index, user, text) and every entry a string.
+    Entries are joined by a newline. An entry must neither start nor end with whitespace,
+    so that tokenizers never merge tokens across the separating newline.
+    """
+
+    @classmethod
+    @abc.abstractmethod
+    def name(cls) -> str:
+        """The name of the encoder (as used in the settings)."""
+
+    @abc.abstractmethod
+    def encode_message(
+        self,
+        index: int,
+        message: GptResponse | UserMessage,
+        history: Sequence[GptResponse | UserMessage],
+    ) -> tuple[int, str, str]:
+        """Converts a message of the history to a history entry
+        Args:
+            index: the index of the message in the history
+            message: the message
+            history: the whole history (e.g. to look at previous messages)
+        Returns:
+            (index, user, text of the message)
+        """
+
+    @abc.abstractmethod
+    def entry_to_str(self, index: int, user: str, msg: str) -> str:
+        """Renders a single history entry"""
+
+    def short_form(self, index: int) -> tuple[int, str] | None:
+        """A shorter text of an (encoded) entry that refers to earlier entries
+        Returns:
+            (index of the first entry referred to, the shorter text) or None if there is none.
+            The shorter text may only be rendered if all entries from that index on are
+            rendered right before the entry.
+        """
+        return None
+
+    def render_entries(self, history: list[tuple[int, str, str]]) -> list[tuple[int, str, str]]:
+        """The entries as rendered in this order (shortened where what they refer to is
+        rendered right before them)"""
+        rendered = []
+        for position, (index, user, msg) in enumerate(history):
+            short = self.short_form(index)
+            if short is not None:
+                first_index, short_msg = short
+                n_before = index - first_index
+                if position >= n_before and all(
+                    history[position - offset][0] == index - offset
+                    for offset in range(1, n_before + 1)
+                ):
+                    msg = short_msg
+            rendered.append((index, user, msg))
+        return rendered
+
+    def history_to_str(self, history: list[tuple[int, str, str]]) -> str:
+        """Renders the history entries (in the given order)"""
+        return "\n".join(
+            [self.entry_to_str(i, user, msg) for i, user, msg in self.render_entries(history)]
+        )
+
+
+class VerboseHistoryEncoder(IHistoryEncoder):
+    """The complete messages (as JSON for the assistant) wrapped in begin and end markers"""
+
+    @classmethod
+    def name(cls) -> str:
+        return "verbose"
+
+    def encode_message(
+        self,
+        index: int,
+        message: GptResponse | UserMessage,
+        history: Sequence[GptResponse | UserMessage],
+    ) -> tuple[int, str, str]:
+        return (
+            index,
+            message.user if isinstance(message, UserMessage) else "assistant",
+            message.full_response()
+            if isinstance(message, UserMessage)
+            else json.dumps(message.dict()),
+        )
+
+    def entry_to_str(self, index: int, user: str, msg: str) -> str:
+        return f"----BEGIN History Entry #{index}----\n{user}: {msg}\n----END History Entry #{index}----"
+
+
+class CompactHistoryEncoder(IHistoryEncoder):
+    """Only what the model needs: no timestamps, steps or empty fields, compact JSON,
+    repeated plans shortened (where the previous plan is rendered right before) and a short
+    entry marker"""
+
+    # look back that many messages for the previous plan of the assistant
+    _PLAN_LOOKBACK = 2
+
+    def __init__(self):
+        # entry index -> (index of the entry with the same plan, text with the plan shortened)
+        self._short_forms: dict[int, tuple[int, str]] = {}
+
+    def short_form(self, index: int) -> tuple[int, str] | None:
+        return self._short_forms.get(index)
+
+    @classmethod
+    def name(cls) -> str:
+        return "compact"
+
+    def encode_message(
+        self,
+        index: int,
+        message: GptResponse | UserMessage,
+        history: Sequence[GptResponse | UserMessage],
+    ) -> tuple[int, str, str]:
+        self._short_forms.pop(index, None)
+        if isinstance(message, UserMessage):
+            return index, message.user, message.full_response().strip()
+
+        response = {"command": message.command}
+        if message.arguments:
+            arguments = {
+                name: value
+                for name, value in message.arguments.items()
+                if value is not None
+            }
+            if arguments:
+                response["arguments"] = arguments
+
+        if message.plan:
+            response["plan"] = message.plan
+            for previous in range(index - 1, max(index - self._PLAN_LOOKBACK, 0) - 1, -1):
+                if isinstance(history[previous], GptResponse):
+                    if history[previous].plan == message.plan:
+                        self._short_forms[index] = (
+                            previous,
+                            self._to_json({**response, "plan": "(unchanged)"}),
+                        )
+                    break
+
+        return index, "assistant", self._to_json(response)
+
+    @staticmethod
+    def _to_json(response: dict) -> str:
+        return json.dumps(response, separators=(",", ":"), ensure_ascii=False)
+
+    def entry_to_str(self, index: int, user: str, msg: str) -> str:
+        return f"[#{index}] {user}: {msg}"
+
+
+# available encoders for the history in the prompt
+HISTORY_ENCODERS: dict[str, typing.Type[IHistoryEncoder]] = {
+    VerboseHistoryEncoder.name(): VerboseHistoryEncoder,
+    CompactHistoryEncoder.name(): CompactHistoryEncoder,
+}
+
+
+def get_history_encoder(settings: AppSettings) -> IHistoryEncoder:
+    """Returns the history encoder configured in the settings"""
+    return HISTORY_ENCODERS[settings.history_encoding]()
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import math
+import re
+from collections import Counter
+from typing import Sequence
+
+from datatypes.gpt_response import GptResponse
+from datatypes.user_message import UserMessage
+
+_TERM_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# very common (english) words that carry no relevance
+_STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have", "i",
+    "in", "is", "it", "of", "on", "or", "that", "the", "this", "to", "was", "we", "with",
+    "you", "none",
+}
+
+
+def terms_of(text: str) -> list[str]:
+    """Splits a text into the (lower case) terms used for the relevance ranking"""
+    return [
+        term
+        for term in _TERM_PATTERN.findall(text.lower())
+        if len(term) > 1 and term not in _STOP_WORDS
+    ]
+
+
+def message_to_text(message: GptResponse | UserMessage) -> str:
+    """The searchable text of a message"""
+    if isinstance(message, UserMessage):
+        return f"{message.full_response()} {message.additional_info or ''}"
+
+    arguments = " ".join(str(value) for value in (message.arguments or {}).values())
+    return f"{message.command} {arguments} {message.plan or ''}"
+
+
+class HistoryIndex:
+    """BM25 index over the messages of a conversation.
+    The index is updated incrementally: only messages appended since the last
+    `sync` are indexed.
+    """
+
+    k1: float = 1.5
+    b: float = 0.75
+
+    _postings: dict[str, dict[int, int]]  # term -> {message index: term frequency}
+    _lengths: list[int]  # number of terms per message index
+
+    def __init__(self):
+        self._postings = {}
+        self._lengths = []
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, text: str) -> int:
+        """Indexes the next message
+        Returns:
+            the index of the message
+        """
+        index = len(self._lengths)
+        terms = Counter(terms_of(text))
+        for term, frequency in terms.items():
+            self._postings.setdefault(term, {})[index] = frequency
+
+        length = sum(terms.values())
+        self._lengths.append(length)
+        self._total_length += length
+
+        return index
+
+    def sync(self, history: Sequence[GptResponse | UserMessage]):
+        """Indexes all messages of the history that are not indexed yet.
+        If the history got shorter (i.e., was replaced), the index is rebuilt.
+        """
+        if len(history) < len(self._lengths):
+            self.__init__()
+
+        for index in range(len(self._lengths), len(history)):
+            self.add(message_to_text(history[index]))
+
+    def top(
+        self, query: str, before: int | None = None, k: int | None = None
+    ) -> list[tuple[int, float]]:
+        """Ranks the indexed messages by their relevance for the query
+        Args:
+            query: the text to look for
+            before: only consider messages with an index below that
+            k: return at most that many messages
+        Returns:
+            (message index, score) of all matching messages, the most relevant first
+        """
+        n_messages = len(self._lengths)
+        if n_messages == 0:
+            return []
+
+        average_length = self._total_length / n_messages or 1.0
+        scores: dict[int, float] = {}
+        for term in set(terms_of(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+
+            idf = math.log(1 + (n_messages - len(postings) + 0.5) / (len(postings) + 0.5))
+            for index, frequency in postings.items():
+                if before is not None and index >= before:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[index] / average_length)
+                scores[index] = scores.get(index, 0.0) + idf * frequency * (self.k1 + 1) / (
+                    frequency + norm
+                )
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return ranked[:k] if k is not None else ranked
@@ -0,0 +1,529 @@
+from __future__ import annotations
+
+import dataclasses
+import logging
+import os
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableSequence
+from pathlib import Path
+from typing import Callable, Iterable, Sequence
+
+from pydantic import parse_obj_as
+
+from datatypes.gpt_response import GptResponse
+from datatypes.user_message import UserMessage
+from utils.conversation_codec import decode_record, split_records
+from utils.files import write_atomic
+from utils.fork_links import read_fork_link, write_fork_link
+from utils.message_store import MessageStore
+
+HISTORY_FILE_NAME = "history.jsonl"
+HISTORY_INDEX_FILE_NAME = "history.idx"
+
+# approximated memory of a parsed message besides its content
+_MESSAGE_OVERHEAD = 500
+
+
+def _size_of(message: GptResponse | UserMessage) -> int:
+    """The approximated memory of a message that is not written yet"""
+    return len(message.json()) + _MESSAGE_OVERHEAD
+
+
+# every index entry is (start offset, end offset) of the message as unsigned 64 bit little endian
+_INDEX_ENTRY_SIZE = 16
+
+
+def parse_message(record: bytes) -> GptResponse | UserMessage:
+    """Parses a record of the history the same way the ChatContext validates messages"""
+    return parse_obj_as(GptResponse | UserMessage, decode_record(record))
+
+
+def _to_index_bytes(offsets: array) -> bytes:
+    if sys.byteorder == "big":
+        offsets = array("Q", offsets)
+        offsets.byteswap()
+    return offsets.tobytes()
+
+
+class HistorySegment:
+    """The messages of a conversation as records (`history.jsonl`, see `RecordCodec` for their format)
+    plus an index of their byte offsets (`history.idx`), so single messages can be read without
+    parsing the rest.
+
+    Records are appended to the data file before their index entries. When opening, complete
+    records behind the last indexed one (crash before the index was written) are indexed again,
+    a partially written last record is cut off and a missing index is rebuilt by scanning the data.
+    """
+
+    def __init__(self, path: Path, logger: logging.Logger):
+        """
+        Args:
+            path: the folder of the conversation
+            logger: the logger to log warnings to
+        """
+        self._data_path = path / HISTORY_FILE_NAME
+        self._index_path = path / HISTORY_INDEX_FILE_NAME
+        self._logger = logger
+        self._offsets = array("Q")  # start and end offset of every message
+
+        # the history is read by the interactive loop while it is written in the background
+        self._lock = threading.Lock()
+        self._data_path.touch(exist_ok=True)
+        self._recover()
+        self._data = open(self._data_path, "r+b")
+        self._data.seek(0, os.SEEK_END)
+        self._index = open(self._index_path, "ab")
+
+    def _recover(self):
+        index_bytes = b""
+        if self._index_path.is_file():
+            with open(self._index_path, "rb") as f:
+                index_bytes = f.read()
+        n_entries = len(index_bytes) // _INDEX_ENTRY_SIZE
+        self._offsets.frombytes(index_bytes[: n_entries * _INDEX_ENTRY_SIZE])
+        if sys.byteorder == "big":
+            self._offsets.byteswap()
+
+        data_size = self._data_path.stat().st_size
+        # forget entries pointing behind the data (the data was cut off)
+        while len(self._offsets) and self._offsets[-1] > data_size:
+            del self._offsets[-2:]
+        valid_end = self._offsets[-1] if len(self._offsets) else 0
+
+        # index complete records that made it into the data but not into the index
+        recovered = array("Q")
+        if valid_end < data_size:
+            with open(self._data_path, "rb") as f:
+                f.seek(valid_end)
+                tail = f.read()
+            ends, tail_end = split_records(tail)
+            for start, end in zip([0, *ends], ends):
+                recovered.extend((valid_end + start, valid_end + end))
+            if len(recovered):
+                self._logger.info(
+                    f"Indexed {len(recovered) // 2} messages of `{self._data_path!s}` again"
+                )
+            if tail_end < len(tail):
+                self._logger.warning(
+                    f"Dropping the partially written last message of `{self._data_path!s}`"
+                )
+                os.truncate(self._data_path, valid_end + tail_end)
+
+        if len(index_bytes) != len(self._offsets) * 8 or len(recovered):
+            self._offsets.extend(recovered)
+            with open(self._index_path, "wb") as f:
+                f.write(_to_index_bytes(self._offsets))
+
+    def __len__(self) -> int:
+        return len(self._offsets) // 2
+
+    def size_of(self, index: int) -> int:
+        """The size of the record of the message at `index`"""
+        return self._offsets[2 * index + 1] - self._offsets[2 * index]
+
+    def read(self, index: int) -> bytes:
+        """Reads the record of the message at `index`"""
+        with self._lock:
+            start, end = self._offsets[2 * index], self._offsets[2 * index + 1]
+            self._data.seek(start)
+            return self._data.read(end - start)
+
+    def read_range(self, start: int, stop: int) -> list[bytes]:
+        """Reads the records of the messages from `start` to `stop` (exclusive) with a single read"""
+        if start >= stop:
+            return []
+        with self._lock:
+            first, last = self._offsets[2 * start], self._offsets[2 * stop - 1]
+            self._data.seek(first)
+            data = self._data.read(last - first)
+            return [
+                data[self._offsets[2 * i] - first : self._offsets[2 * i + 1] - first]
+                for i in range(start, stop)
+            ]
+
+    @staticmethod
+    def _layout(records: Iterable[bytes], offset: int) -> array:
+        offsets = array("Q")
+        for record in records:
+            offsets.extend((offset, offset + len(record)))
+            offset += len(record)
+        return offsets
+
+    def append(self, records: Sequence[bytes]):
+        """Appends the records of new messages"""
+        if not records:
+            return
+
+        with self._lock:
+            self._data.seek(0, os.SEEK_END)
+            new_offsets = self._layout(records, self._data.tell())
+            # the data first, so every index entry points to a complete record
+            self._data.write(b"".join(records))
+            self._data.flush()
+            self._index.write(_to_index_bytes(new_offsets))
+            self._index.flush()
+            self._offsets.extend(new_offsets)
+
+    def rewrite(self, records: Sequence[bytes]):
+        """Replaces the records of all messages (atomically)"""
+        with self._lock:
+            self._data.close()
+            self._index.close()
+            offsets = self._layout(records, 0)
+
+            # without an index the data is scanned when opening, so a crash in between
+            # never leaves an index that belongs to the other data
+            self._index_path.unlink(missing_ok=True)
+            write_atomic(self._data_path, b"".join(records))
+            write_atomic(self._index_path, _to_index_bytes(offsets))
+            self._offsets = offsets
+            self._data = open(self._data_path, "r+b")
+            self._data.seek(0, os.SEEK_END)
+            self._index = open(self._index_path, "ab")
+
+    def sync(self):
+        """Forces the appended messages to disk"""
+        with self._lock:
+            os.fsync(self._data.fileno())
+            os.fsync(self._index.fileno())
+
+    def close(self):
+        with self._lock:
+            self._data.close()
+            self._index.close()
+
+
+class ForkedHistorySegment(HistorySegment):
+    """The history of a forked conversation: the first `n_prefix` messages are read from the
+    history of the parent conversation (which only ever appends behind them), the following
+    ones from the own files. Rewriting it copies the prefix, which detaches it from the parent.
+    """
+
+    def __init__(
+        self, path: Path, logger: logging.Logger, parent: HistorySegment, n_prefix: int
+    ):
+        """
+        Args:
+            path: the folder of the forked conversation
+            logger: the logger to log warnings to
+            parent: the history of the parent conversation
+            n_prefix: how many messages are read from the parent
+        """
+        super().__init__(path, logger)
+        self._path = path
+        self._parent = parent
+        self._n_prefix = min(n_prefix, len(parent))
+
+    def __len__(self) -> int:
+        return self._n_prefix + super().__len__()
+
+    def size_of(self, index: int) -> int:
+        if index < self._n_prefix:
+            return self._parent.size_of(index)
+        return super().size_of(index - self._n_prefix)
+
+    def read(self, index: int) -> bytes:
+        if index < self._n_prefix:
+            return self._parent.read(index)
+        return super().read(index - self._n_prefix)
+
+    def read_range(self, start: int, stop: int) -> list[bytes]:
+        return self._parent.read_range(
+            min(start, self._n_prefix), min(stop, self._n_prefix)
+        ) + super().read_range(
+            max(start - self._n_prefix, 0), max(stop - self._n_prefix, 0)
+        )
+
+    def rewrite(self, records: Sequence[bytes]):
+        super().rewrite(records)
+        if self._n_prefix:
+            self._n_prefix = 0
+            link = read_fork_link(self._path)
+            write_fork_link(self._path, dataclasses.replace(link, n_messages=0))
+            self._parent.close()
+
+    def close(self):
+        super().close()
+        self._parent.close()
+
+
+def open_history_segment(path: Path, logger: logging.Logger) -> HistorySegment:
+    """Opens the history of a conversation (of forks including the prefix of the parent)
+    Args:
+        path: the folder of the conversation
+        logger: the logger to log warnings to
+    """
+    link = read_fork_link(path)
+    if link is None or link.n_messages == 0:
+        return HistorySegment(path, logger=logger)
+
+    return ForkedHistorySegment(
+        path,
+        logger=logger,
+        parent=open_history_segment(path.parent / link.parent_id, logger=logger),
+        n_prefix=link.n_messages,
+    )
+
+
+class LazyMessageHistory(MutableSequence):
+    """The message history of a conversation that parses persisted messages only when accessed.
+    New messages are kept in memory (in a `MessageStore`) until they are written (see
+    `mark_durable`), from then on they are paged like the other persisted messages.
+    With a memory limit, the least recently used persisted messages are evicted and read
+    again when accessed. The new messages count against the limit as well, but they stay in
+    memory until they are written. Changing persisted messages loads the whole history.
+    Thread safe: paging, eviction and the translation of indices happen under one lock
+    (the history is read by background threads, e.g. the `HistoryCompactor`).
+    """
+
+    def __init__(
+        self,
+        segment: HistorySegment,
+        parse: Callable[[bytes], GptResponse | UserMessage] = parse_message,
+        messages: Iterable[GptResponse | UserMessage] | None = None,
+        memory_limit: int = 0,
+    ):
+        """
+        Args:
+            segment: the persisted messages
+            parse: parses a record into a message
+            messages: all messages, if they are not (completely) persisted yet
+             (otherwise they are read from the segment)
+            memory_limit: approximated bytes of messages to keep in memory (0: no limit)
+        """
+        self._segment = segment
+        self._parse = parse
+        self._memory_limit = memory_limit
+        self._n_lazy = len(segment) if messages is None else 0
+        # message index -> (message, approximated size), least recently used first
+        self._loaded: OrderedDict[int, tuple[GptResponse | UserMessage, int]] = OrderedDict()
+        self._loaded_bytes = 0
+        self._tail = MessageStore(messages or ())
+        # approximated size of each new message (kept along, so reports don't serialize them)
+        self._tail_sizes = [_size_of(message) for message in self._tail]
+        self._tail_bytes = sum(self._tail_sizes)
+        # incremented whenever messages are changed instead of appended
+        self._version = 0
+        self._durable: tuple[int, int] = (self._n_lazy, self._version)
+        self._lock = threading.RLock()
+
+    @property
+    def n_loaded(self) -> int:
+        """The number of persisted messages that are in memory"""
+        with self._lock:
+            return len(self._loaded)
+
+    @property
+    def version(self) -> int:
+        """Changes whenever messages are changed or removed (not when they are appended)"""
+        return self._version
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._n_lazy + len(self._tail)
+
+    def mark_durable(self, n_messages: int, version: int):
+        """Tells that the first messages were written, so they can be paged out.
+        Thread safe, the messages are paged out with the next access.
+        Args:
+            n_messages: how many messages were written
+            version: the `version` of the history the messages were captured in
+        """
+        self._durable = (n_messages, version)
+
+    def _page_out(self):
+        """Moves the new messages that are written by now to the persisted ones"""
+        n_messages, version = self._durable
+        n_moved = min(n_messages, len(self)) - self._n_lazy
+        if version != self._version or n_moved <= 0:
+            return
+
+        for offset, message in enumerate(self._tail[:n_moved]):
+            index = self._n_lazy + offset
+            self._remember(index, message, self._segment.size_of(index))
+        del self._tail[:n_moved]
+        self._tail_bytes -= sum(self._tail_sizes[:n_moved])
+        del self._tail_sizes[:n_moved]
+        self._n_lazy += n_moved
+        self._evict()
+
+    def _remember(self, index: int, message: GptResponse | UserMessage, size: int):
+        size += _MESSAGE_OVERHEAD
+        self._loaded[index] = (message, size)
+        self._loaded_bytes += size
+
+    def _evict(self):
+        """Evicts the least recently used persisted messages above the memory limit"""
+        if self._memory_limit <= 0:
+            return
+        while (
+            self._loaded_bytes + self._tail_bytes > self._memory_limit and len(self._loaded) > 1
+        ):
+            _, (_, size) = self._loaded.popitem(last=False)
+            self._loaded_bytes -= size
+
+    def _load_range(self, start: int, stop: int) -> list[GptResponse | UserMessage]:
+        """Returns the persisted messages in [start, stop), the ones not in memory with a single read"""
+        stop = min(stop, self._n_lazy)
+        if start >= stop:
+            return []
+
+        first, last = start, stop
+        while first < last and first in self._loaded:
+            first += 1
+        while last > first and last - 1 in self._loaded:
+            last -= 1
+        records = self._segment.read_range(first, last)
+
+        messages = []
+        for index in range(start, stop):
+            entry = self._loaded.get(index)
+            if entry is None:
+                record = records[index - first]
+                message = self._parse(record)
+                self._remember(index, message, len(record))
+            else:
+                message = entry[0]
+                self._loaded.move_to_end(index)
+            messages.append(message)
+        # not before, the messages at the edges might have been evicted in between
+        self._evict()
+        return messages
+
+    def _get(self, index: int) -> GptResponse | UserMessage:
+        if index >= self._n_lazy:
+            return self._tail[index - self._n_lazy]
+        entry = self._loaded.get(index)
+        if entry is not None:
+            self._loaded.move_to_end(index)
+            return entry[0]
+
+        record = self._segment.read(index)
+        message = self._parse(record)
+        self._remember(index, message, len(record))
+        self._evict()
+        return message
+
+    def __getitem__(self, index):
+        with self._lock:
+            self._page_out()
+            if isinstance(index, slice):
+                indices = range(*index.indices(len(self)))
+                if indices.step == 1:
+                    return self._load_range(indices.start, indices.stop) + self._tail[
+                        max(indices.start - self._n_lazy, 0) : max(indices.stop - self._n_lazy, 0)
+                    ]
+                return [self._get(i) for i in indices]
+
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("message index out of range")
+            return self._get(index)
+
+    def commands_of(
+        self, start: int, stop: int
+    ) -> list[tuple[str, dict | None, float] | None]:
+        """The (command, arguments, created_ts) of the messages in [start, stop) (None for user
+        messages). Persisted messages that are not in memory are only decoded, they are neither
+        parsed nor kept, so this does not load the history.
+        """
+        with self._lock:
+            self._page_out()
+            stop = min(stop, len(self))
+            lazy_stop = min(stop, self._n_lazy)
+            records = self._segment.read_range(start, lazy_stop) if start < lazy_stop else []
+            commands = []
+            for index in range(start, stop):
+                if index >= self._n_lazy:
+                    message = self._tail[index - self._n_lazy]
+                elif index in self._loaded:
+                    message = self._loaded[index][0]
+                else:
+                    data = decode_record(records[index - start])
+                    commands.append(
+                        (data["command"], data.get("arguments"), data.get("created_ts"))
+                        if "command" in data
+                        else None
+                    )
+                    continue
+                commands.append(
+                    (message.command, message.arguments, message.created_ts)
+                    if isinstance(message, GptResponse)
+                    else None
+                )
+            return commands
+
+    def materialize(self) -> MessageStore:
+        """Loads all persisted messages and keeps the whole history in memory from here on"""
+        with self._lock:
+            if self._n_lazy:
+                tail = self._tail
+                self._tail = MessageStore(self._load_range(0, self._n_lazy))
+                self._tail.extend(tail)
+                sizes = [
+                    self._segment.size_of(index) + _MESSAGE_OVERHEAD
+                    for index in range(self._n_lazy)
+                ]
+                self._tail_sizes = sizes + self._tail_sizes
+                self._tail_bytes = sum(self._tail_sizes)
+                self._n_lazy = 0
+                self._loaded = OrderedDict()
+                self._loaded_bytes = 0
+            return self._tail
+
+    def __setitem__(self, index, value):
+        with self._lock:
+            self._version += 1
+            if not isinstance(index, slice) and self._n_lazy <= index < len(self):
+                self._tail[index - self._n_lazy] = value
+                self._resize(index - self._n_lazy, _size_of(value))
+            else:
+                self.materialize()[index] = value
+                if isinstance(index, slice):
+                    self._tail_sizes[index] = [_size_of(message) for message in value]
+                    self._tail_bytes = sum(self._tail_sizes)
+                else:
+                    self._resize(index, _size_of(value))
+
+    def __delitem__(self, index):
+        with self._lock:
+            self._version += 1
+            del self.materialize()[index]
+            del self._tail_sizes[index]
+            self._tail_bytes = sum(self._tail_sizes)
+
+    def insert(self, index: int, value: GptResponse | UserMessage):
+        with self._lock:
+            self._page_out()
+            size = _size_of(value)
+            if index >= len(self):
+                self._tail.append(value)
+                self._tail_sizes.append(size)
+            else:
+                self._version += 1
+                self.materialize().insert(index, value)
+                self._tail_sizes.insert(index, size)
+            self._tail_bytes += size
+            self._evict()
+
+    def _resize(self, tail_index: int, size: int):
+        """Takes the new size of a changed new message"""
+        self._tail_bytes += size - self._tail_sizes[tail_index]
+        self._tail_sizes[tail_index] = size
+
+    def memory_report(self) -> dict[str, int]:
+        """How much of the history is in memory (sizes are approximated)"""
+        with self._lock:
+            return {
+                "resident_messages": len(self._loaded) + len(self._tail),
+                "resident_bytes": self._loaded_bytes + self._tail_bytes,
+                "paged_out_messages": self._n_lazy - len(self._loaded),
+                "memory_limit_bytes": self._memory_limit,
+            }
+
+    def __repr__(self) -> str:
+        return f"LazyMessageHistory(n_messages={len(self)}, n_loaded={self.n_loaded})"
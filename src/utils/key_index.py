@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import bisect
+import heapq
+import itertools
+import re
+from collections import Counter
+
+from repository.i_key_storage_backend import IKeyStorageBackend
+
+# keys and texts are matched by their words (`user_name` -> `user`, `name`)
+WORD_PATTERN = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def words_of(text: str) -> set[str]:
+    """The (lower case) words of a key or text"""
+    return set(WORD_PATTERN.findall(text.lower()))
+
+
+def trigrams_of(text: str) -> set[str]:
+    """The character trigrams of a key (padded, so short keys have some as well)"""
+    text = f"  {text.lower()} "
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class StorageKeyIndex:
+    """Index over the keys of the key storage of a conversation for
+        - prefix search (sorted keys)
+        - fuzzy search (character trigrams, typos and partial keys still match)
+        - recency (when the keys were written or read)
+        - relevance for a text (shared words)
+    The storage commands keep the recency current (`add`, `touch`, `remove`), `sync` brings
+    the keys up to date with the storage (keys written by others or inherited from a forked
+    conversation).
+    """
+
+    def __init__(self):
+        self._order: list[str] = []  # the keys in the order of the storage
+        self._sorted: list[str] = []
+        self._recency: dict[str, int] = {}  # key -> tick of the last use
+        self._trigrams: dict[str, set[str]] = {}  # trigram -> keys
+        self._n_trigrams: dict[str, int] = {}  # key -> number of its trigrams
+        self._words: dict[str, set[str]] = {}  # word -> keys
+        self._ticks = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._sorted)
+
+    def sync(self, backend: IKeyStorageBackend):
+        """Brings the index up to date with the keys of the storage"""
+        keys = list(backend.list())
+        current = set(keys)
+        for key in [key for key in self._recency if key not in current]:
+            self.remove(key)
+        new_keys = [key for key in keys if key not in self._recency]
+        # in the order of the storage (for the file backends the order they were written in)
+        for key in new_keys:
+            self._index(key)
+            self._recency[key] = next(self._ticks)
+        if new_keys:
+            self._sorted = sorted(self._recency)
+        self._order = keys
+
+    def keys(self) -> list[str]:
+        """The keys in the order of the storage (as of the last `sync`)"""
+        return self._order
+
+    def _index(self, key: str):
+        trigrams = trigrams_of(key)
+        self._n_trigrams[key] = len(trigrams)
+        for trigram in trigrams:
+            self._trigrams.setdefault(trigram, set()).add(key)
+        for word in words_of(key):
+            self._words.setdefault(word, set()).add(key)
+
+    def add(self, key: str):
+        """Adds a (written) key or marks it as used recently"""
+        if key not in self._recency:
+            bisect.insort(self._sorted, key)
+            self._index(key)
+        self._recency[key] = next(self._ticks)
+
+    def touch(self, key: str):
+        """Marks a key as used recently (if it exists)"""
+        if key in self._recency:
+            self._recency[key] = next(self._ticks)
+
+    def remove(self, key: str):
+        if key not in self._recency:
+            return
+        del self._recency[key]
+        del self._n_trigrams[key]
+        del self._sorted[bisect.bisect_left(self._sorted, key)]
+        for trigram in trigrams_of(key):
+            self._trigrams[trigram].discard(key)
+        for word in words_of(key):
+            self._words[word].discard(key)
+
+    def prefix(self, prefix: str, limit: int | None = None) -> list[str]:
+        """The keys starting with `prefix`, sorted"""
+        start = bisect.bisect_left(self._sorted, prefix)
+        keys = []
+        for key in itertools.islice(self._sorted, start, None):
+            if not key.startswith(prefix) or (limit is not None and len(keys) >= limit):
+                break
+            keys.append(key)
+        return keys
+
+    def recent(self, limit: int | None = None) -> list[str]:
+        """The keys, most recently used first"""
+        if limit is not None:
+            return heapq.nlargest(limit, self._recency, key=self._recency.get)
+        return sorted(self._recency, key=self._recency.get, reverse=True)
+
+    def fuzzy(self, query: str, limit: int = 10) -> list[tuple[str, float]]:
+        """The keys most similar to `query` (by shared trigrams, keys containing it first)
+        Returns:
+            (key, score between 0 and 2), the best match first
+        """
+        query_trigrams = trigrams_of(query)
+        shared = Counter(
+            key for trigram in query_trigrams for key in self._trigrams.get(trigram, ())
+        )
+        query = query.lower()
+        scores = {}
+        for key, n_shared in shared.items():
+            score = n_shared / (len(query_trigrams) + self._n_trigrams[key] - n_shared)
+            if query in key.lower():
+                score += 1.0
+            scores[key] = score
+        return heapq.nlargest(
+            limit, scores.items(), key=lambda item: (item[1], self._recency[item[0]])
+        )
+
+    def top(self, text: str, k: int) -> list[str]:
+        """The `k` keys most relevant for a text (sharing the most words), filled up with
+        the most recently used ones"""
+        text_words = words_of(text)
+        shared = Counter(
+            key for word in text_words for key in self._words.get(word, ())
+        )
+        relevant = heapq.nlargest(k, shared, key=lambda key: (shared[key], self._recency[key]))
+        if len(relevant) < k:
+            chosen = set(relevant)
+            relevant += [key for key in self.recent(k) if key not in chosen][: k - len(relevant)]
+        return relevant
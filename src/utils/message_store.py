@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import math
+from array import array
+from collections.abc import MutableSequence
+from typing import Iterable, Iterator
+
+from datatypes.gpt_response import GptResponse
+from datatypes.user_message import UserMessage
+
+ROLE_GPT = 0
+ROLE_USER = 1
+
+# command id of user messages
+_NO_COMMAND = 0xFFFFFFFF
+
+
+class _GptRecord:
+    __slots__ = ("plan", "steps", "arguments")
+
+    def __init__(self, plan: str | None, steps: list[str] | str, arguments: dict | None):
+        self.plan = plan
+        self.steps = steps
+        self.arguments = arguments
+
+
+class _UserRecord:
+    __slots__ = ("user_response", "additional_info", "user", "blob_ref", "blob_store")
+
+    def __init__(self, message: UserMessage):
+        self.user_response = message.user_response
+        self.additional_info = message.additional_info
+        self.user = message.user
+        self.blob_ref = message.blob_ref
+        self.blob_store = message._blob_store
+
+
+class MessageStore(MutableSequence):
+    """The message history in a compact form: every message is a `__slots__` record of its
+    text fields, while role, command and timestamp are kept in parallel arrays (commands as ids
+    into a table of their names). Filtering by role or command therefore never touches the records.
+
+    Messages go in and come out as pydantic models. These are built when accessed, so changing a
+    returned message does not change the store (assign it again instead).
+    """
+
+    def __init__(self, messages: Iterable[GptResponse | UserMessage] = ()):
+        self._records: list[_GptRecord | _UserRecord] = []
+        self._roles = array("B")
+        self._commands = array("I")
+        self._timestamps = array("d")
+        self._command_names: list[str] = []
+        self._command_ids: dict[str, int] = {}
+        self.extend(messages)
+
+    def _command_id(self, command: str) -> int:
+        command_id = self._command_ids.get(command)
+        if command_id is None:
+            command_id = self._command_ids[command] = len(self._command_names)
+            self._command_names.append(command)
+        return command_id
+
+    def _pack(self, message: GptResponse | UserMessage) -> tuple:
+        if isinstance(message, GptResponse):
+            return (
+                _GptRecord(message.plan, message.steps, message.arguments),
+                ROLE_GPT,
+                self._command_id(message.command),
+                message.created_ts,
+            )
+        if isinstance(message, UserMessage):
+            return _UserRecord(message), ROLE_USER, _NO_COMMAND, math.nan
+        raise TypeError(f"Cannot store `{type(message).__name__}` as message")
+
+    def _timestamp(self, index: int) -> int | float:
+        # the field is an int, only the default is a float
+        timestamp = self._timestamps[index]
+        return int(timestamp) if timestamp.is_integer() else timestamp
+
+    def _unpack(self, index: int) -> GptResponse | UserMessage:
+        record = self._records[index]
+        if self._roles[index] == ROLE_GPT:
+            return GptResponse.construct(
+                plan=record.plan,
+                steps=record.steps,
+                command=self._command_names[self._commands[index]],
+                arguments=record.arguments,
+                created_ts=self._timestamp(index),
+            )
+
+        message = UserMessage.construct(
+            user_response=record.user_response,
+            additional_info=record.additional_info,
+            user=record.user,
+            blob_ref=record.blob_ref,
+        )
+        if record.blob_store is not None:
+            message.bind_blob_store(record.blob_store)
+        return message
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._unpack(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("message index out of range")
+        return self._unpack(index)
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            messages = list(self)
+            messages[index] = value
+            self.clear()
+            self.extend(messages)
+            return
+
+        record, role, command, timestamp = self._pack(value)
+        self._records[index] = record
+        self._roles[index] = role
+        self._commands[index] = command
+        self._timestamps[index] = timestamp
+
+    def __delitem__(self, index):
+        del self._records[index]
+        del self._roles[index]
+        del self._commands[index]
+        del self._timestamps[index]
+
+    def insert(self, index: int, value: GptResponse | UserMessage):
+        record, role, command, timestamp = self._pack(value)
+        self._records.insert(index, record)
+        self._roles.insert(index, role)
+        self._commands.insert(index, command)
+        self._timestamps.insert(index, timestamp)
+
+    def append(self, value: GptResponse | UserMessage):
+        record, role, command, timestamp = self._pack(value)
+        self._records.append(record)
+        self._roles.append(role)
+        self._commands.append(command)
+        self._timestamps.append(timestamp)
+
+    def extend(self, values: Iterable[GptResponse | UserMessage]):
+        for value in values:
+            self.append(value)
+
+    def clear(self):
+        self._records = []
+        self._roles = array("B")
+        self._commands = array("I")
+        self._timestamps = array("d")
+
+    def role_of(self, index: int) -> int:
+        """The role (`ROLE_GPT` or `ROLE_USER`) of the message at `index`"""
+        return self._roles[index]
+
+    def command_of(self, index: int) -> str | None:
+        """The command of the message at `index` (None for user messages)"""
+        command_id = self._commands[index]
+        return None if command_id == _NO_COMMAND else self._command_names[command_id]
+
+    def timestamp_of(self, index: int) -> int | float | None:
+        """The creation time of the message at `index` (None for user messages)"""
+        return None if self._roles[index] == ROLE_USER else self._timestamp(index)
+
+    def command_indices(self, command_name: str | None = None) -> Iterator[int]:
+        """The indices of the GptResponses (with that command), newest first"""
+        if command_name is None:
+            wanted = None
+        else:
+            wanted = self._command_ids.get(command_name)
+            if wanted is None:
+                return
+
+        for index in range(len(self._records) - 1, -1, -1):
+            command_id = self._commands[index]
+            if command_id != _NO_COMMAND and (wanted is None or command_id == wanted):
+                yield index
+
+    def __repr__(self) -> str:
+        return f"MessageStore(n_messages={len(self)}, n_commands={len(self._command_names)})"
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import logging
+
+from datatypes.model_info import ModelInfo
+from utils.app_settings import AppSettings
+
+# known models by name, versioned names (e.g. `gpt-4-0613`) match by their longest known prefix
+MODEL_REGISTRY: dict[str, ModelInfo] = {
+    "gpt-3.5-turbo": ModelInfo(context_window=4_096, reply_reserve=1_000),
+    "gpt-3.5-turbo-16k": ModelInfo(context_window=16_385, reply_reserve=2_000),
+    "gpt-3.5-turbo-1106": ModelInfo(context_window=16_385, reply_reserve=2_000),
+    "gpt-3.5-turbo-0125": ModelInfo(context_window=16_385, reply_reserve=2_000),
+    "gpt-4": ModelInfo(context_window=8_192, reply_reserve=1_500),
+    "gpt-4-32k": ModelInfo(context_window=32_768, reply_reserve=4_000),
+    "gpt-4-turbo": ModelInfo(context_window=128_000, reply_reserve=4_096),
+    "gpt-4-1106-preview": ModelInfo(context_window=128_000, reply_reserve=4_096),
+    "gpt-4-0125-preview": ModelInfo(context_window=128_000, reply_reserve=4_096),
+    "gpt-4o": ModelInfo(context_window=128_000, reply_reserve=4_096),
+}
+
+# used for models that are not known
+DEFAULT_MODEL_INFO = ModelInfo(context_window=4_096, reply_reserve=1_000)
+
+# tokens the chat api adds for the system and the user message
+MESSAGE_OVERHEAD_TOKENS = 12
+
+_WARNED_MODELS: set[str] = set()
+
+
+def get_model_info(settings: AppSettings, logger: logging.Logger) -> ModelInfo:
+    """Returns the context size and reply reserve of the configured model.
+    Both can be overwritten in the settings (`model_context_window` and `model_reply_reserve`).
+    Args:
+        settings: the application settings to take the model from
+        logger: the logger to warn about unknown models
+    """
+    model = settings.model
+    info = MODEL_REGISTRY.get(model)
+    if info is None:
+        prefixes = [name for name in MODEL_REGISTRY if model.startswith(name + "-")]
+        if prefixes:
+            info = MODEL_REGISTRY[max(prefixes, key=len)]
+        else:
+            info = DEFAULT_MODEL_INFO
+            if (
+                model not in _WARNED_MODELS
+                and settings.model_context_window is None
+            ):
+                _WARNED_MODELS.add(model)
+                logger.warning(
+                    f"Context window of model `{model}` is unknown. "
+                    f"Assuming {info.context_window} tokens (see `model_context_window` setting)."
+                )
+
+    return ModelInfo(
+        context_window=settings.model_context_window or info.context_window,
+        reply_reserve=settings.model_reply_reserve or info.reply_reserve,
+    )
+
+
+def history_token_budget(
+    settings: AppSettings, prompt_tokens: int, logger: logging.Logger
+) -> int:
+    """Computes how many tokens the conversation history may take in the current prompt.
+    That is the context window minus the rest of the prompt and the reply reserve.
+    If `max_token_len_history` is set to a number, it caps the budget.
+    Args:
+        settings: the application settings
+        prompt_tokens: tokens of everything that is sent besides the history (system role included)
+        logger: the logger to log warnings to
+    """
+    info = get_model_info(settings=settings, logger=logger)
+    budget = (
+        info.context_window
+        - info.reply_reserve
+        - prompt_tokens
+        - MESSAGE_OVERHEAD_TOKENS
+    )
+    if budget <= 0:
+        logger.warning(
+            f"The prompt ({prompt_tokens} tokens) leaves no room for the history "
+            f"within the context window of {info.context_window} tokens."
+        )
+        budget = 0
+
+    if settings.max_token_len_history is not None:
+        budget = min(budget, settings.max_token_len_history)
+
+    return budget
+
+
+def nominal_history_tokens(settings: AppSettings, logger: logging.Logger) -> int:
+    """A rough size of the history budget without knowing the actual prompt
+    (e.g., to size results of commands in relation to it)
+    """
+    if settings.max_token_len_history is not None:
+        return settings.max_token_len_history
+
+    info = get_model_info(settings=settings, logger=logger)
+    return (info.context_window - info.reply_reserve) // 2
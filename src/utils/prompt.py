@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import logging
+import os
+import string
+
+from utils.tokenizer import count_tokens, estimate_tokens, get_tokenizer_registry
+
+# name of the section holding all the fixed text of a template
+TEMPLATE_SECTION = "template"
+
+
+class CompiledPrompt:
+    """A prompt template whose static sections are rendered (and counted) once.
+    The template is given in `str.format` syntax. Only the remaining (dynamic) fields
+    are filled in each time the prompt is rendered.
+    """
+
+    _parts: list[str | tuple[str, str | None, str]]
+    static_tokens: dict[str, int]
+
+    def __init__(
+        self,
+        template: str,
+        static_sections: dict[str, str],
+        model: str,
+        logger: logging.Logger,
+    ):
+        """
+        Args:
+            template: the template in `str.format` syntax
+            static_sections: the values of the fields that do not change between renderings
+            model: the model to count the tokens of the static sections for
+            logger: the logger to log warnings to
+        """
+        formatter = string.Formatter()
+        parts: list[str | tuple[str, str | None, str]] = []
+        template_text = ""
+        for literal, field, format_spec, conversion in formatter.parse(template):
+            template_text += literal
+            parts.append(literal)
+            if field is None:
+                continue
+
+            if field in static_sections:
+                value = formatter.convert_field(static_sections[field], conversion)
+                parts.append(formatter.format_field(value, format_spec))
+            else:
+                parts.append((field, conversion, format_spec))
+
+        # merge subsequent static texts to make rendering cheaper
+        self._parts = []
+        for part in parts:
+            if self._parts and isinstance(part, str) and isinstance(self._parts[-1], str):
+                self._parts[-1] += part
+            elif part != "":
+                self._parts.append(part)
+
+        self.fields = {part[0] for part in self._parts if isinstance(part, tuple)}
+        self.static_tokens = {
+            TEMPLATE_SECTION: count_tokens(template_text, model=model, logger=logger)
+        }
+        for name, value in static_sections.items():
+            self.static_tokens[name] = count_tokens(value, model=model, logger=logger)
+
+    def render(self, **dynamic_sections) -> str:
+        """Renders the prompt
+        Args:
+            dynamic_sections: the values of all dynamic fields of the template
+        Raises:
+            KeyError: if a dynamic field is missing
+        """
+        formatter = string.Formatter()
+        rendered = []
+        for part in self._parts:
+            if isinstance(part, str):
+                rendered.append(part)
+            else:
+                field, conversion, format_spec = part
+                value = formatter.convert_field(dynamic_sections[field], conversion)
+                rendered.append(formatter.format_field(value, format_spec))
+
+        return "".join(rendered)
+
+
+def shared_prefix_tokens(
+    previous: str, current: str, model: str, logger: logging.Logger
+) -> int:
+    """Counts how many leading tokens of two prompts are identical.
+    That is the part of the prompt a provider side prefix cache is able to reuse.
+    Args:
+        previous: the previous prompt
+        current: the current prompt
+        model: the model to tokenize the prompts for
+        logger: the logger to log warnings to
+    Returns:
+        the number of identical leading tokens (estimated if the model has no tokenizer)
+    """
+    enc = get_tokenizer_registry().encoder_for(model=model, logger=logger)
+    if enc is None:
+        return estimate_tokens(os.path.commonprefix([previous, current])) - 1
+
+    n_shared = 0
+    for previous_token, current_token in zip(
+        enc.encode_ordinary(previous), enc.encode_ordinary(current)
+    ):
+        if previous_token != current_token:
+            break
+        n_shared += 1
+
+    return n_shared
@@ -1,12 +1,21 @@
 import datetime
-import json
+import itertools
 import logging
-
-import tiktoken
+from typing import Iterable, Iterator
 
 from datatypes.chat_context import ChatContext
+from datatypes.gpt_query import GptQuery
 from datatypes.gpt_response import GptResponse
-from datatypes.user_message import UserMessage
+from exceptions.settings_exception import SettingsNotReadableException
+from utils.history_encoder import (
+    IHistoryEncoder,
+    VerboseHistoryEncoder,
+    get_history_encoder,
+)
+from utils.models import history_token_budget
+from utils.prompt import CompiledPrompt, shared_prefix_tokens
+from utils.token_cache import TokenCountCache
+from utils.tokenizer import count_tokens, count_tokens_many, has_tokenizer
 
 
 query_template = """\
@@ -30,7 +39,7 @@ The result of invoking a functionality will be given back to you.
 
 Also, you have access to the following storage keys: {memory_keys} 
 
-We have the following conversation history (with #{n_history} entries total). 
+{summary}We have the following conversation history (with #{n_history} entries total). 
 You should incorporate the following information for your answer if useful:
 ----BEGIN Conversation History----
 {history}
@@ -59,56 +68,342 @@ information on what we are going to do.
 ----END TEMPLATE---
 """
 
+# same content as `query_template`, but everything that stays the same between the turns comes
+# first, so providers are able to cache the prompt prefix (prompt layout `prefix_cache`)
+prefix_cache_query_template = """\
+- You will be supplied with a part of the recent conversation history (as working memory) and the current prompt.
+- As you don't have too much working memory you are encouraged to save important information in your long term memory 
+using the commands given to you. 
+- You can only execute one command at a time, so you will have to plan your next steps  carefully and remember them. 
+- If you can, try to answer questions on your own. 
+- Avoid executing the same command twice in a row.
 
-def conversation_history_to_str(history: list[tuple[int, str, str]]) -> str:
-    return "\n".join(
-        [
-            f"----BEGIN History Entry #{i}----\n{user}: {msg}\n----END History Entry #{i}----"
-            for i, user, msg in history
-        ]
+Your general task is to help the human(s). Specifically your general goals and tasks include:
+{ai_goals}
+
+You can execute the following commands as desired: Every answer of yours has to be a JSON object invoking exactly one of those functions:
+----BEGIN COMMANDS----
+{commands}
+----END COMMANDS----
+The result of invoking a functionality will be given back to you.
+
+---- Your Instructions ----
+Always consider your next steps carefully step by step and execute them one by one. Add the remaining 
+steps you would have to do to achieve the plan to your response in the template given below. Don't put the next
+steps into an answer directly but put it in the json structure in the key `steps`. Use the plan to store overarching 
+information on what we are going to do.
+
+*ALWAYS* respond with a JSON object in the following exact format (given as template):
+----BEGIN TEMPLATE---
+{base_command}
+----END TEMPLATE---
+
+---- Current State ----
+- You are in a room with the following human(s) {human_names!s}.
+- You have access to the following storage keys: {memory_keys} 
+- The date and time when sending this message is: {curr_date}.
+
+{summary}We have the following conversation history (with #{n_history} entries total). 
+You should incorporate the following information for your answer if useful:
+----BEGIN Conversation History----
+{history}
+----END Conversation History----
+
+The result of the last command of yours was:
+{current_prompt}
+Additional Information provided (if any): 
+{additional_info}
+
+To remind you:
+Your plan was: `{plan}`!
+Your next planned steps were:
+{next_steps}!
+"""
+
+QUERY_TEMPLATES = {
+    "default": query_template,
+    "prefix_cache": prefix_cache_query_template,
+}
+
+# how precise the date and time in the prompt is
+TIMESTAMP_FORMATS = {
+    "second": "%d/%m/%Y at %H:%M:%S",
+    "minute": "%d/%m/%Y at %H:%M",
+    "hour": "%d/%m/%Y at %H:00",
+    "day": "%d/%m/%Y",
+}
+
+
+# the sections of the query the tokens are accounted to
+SECTION_INSTRUCTIONS = "instructions"
+SECTION_COMMANDS = "commands"
+SECTION_STORAGE_KEYS = "storage_keys"
+SECTION_HISTORY = "history"
+SECTION_SUMMARY = "summary"
+SECTION_CURRENT_RESULT = "current_result"
+SECTION_ADDITIONAL_INFO = "additional_info"
+
+# fields of the query templates that make up a section on their own (all others are instructions)
+SECTION_OF_FIELD = {
+    "commands": SECTION_COMMANDS,
+    "memory_keys": SECTION_STORAGE_KEYS,
+    "history": SECTION_HISTORY,
+    "summary": SECTION_SUMMARY,
+    "current_prompt": SECTION_CURRENT_RESULT,
+    "additional_info": SECTION_ADDITIONAL_INFO,
+}
+
+base_command = (
+    '{"command": "the_command", "arguments": {"the":"parameters", ... }, '
+    '"plan": "the effect you want to achieve with your current execution steps", '
+    '"steps": ["details", "of", "steps", "you", "want", "to", "do"]}'
+)
+
+# the encoding of the history entries (if no other is given)
+VERBOSE_ENCODER = VerboseHistoryEncoder()
+
+# how many history entries are tokenized at once (as batch) while looking for the cut-off
+_HISTORY_CHUNK_SIZE = 32
+
+
+def history_entry_to_str(
+    index: int, user: str, msg: str, encoder: IHistoryEncoder = VERBOSE_ENCODER
+) -> str:
+    return encoder.entry_to_str(index, user, msg)
+
+
+def conversation_history_to_str(
+    history: list[tuple[int, str, str]], encoder: IHistoryEncoder = VERBOSE_ENCODER
+) -> str:
+    return encoder.history_to_str(history)
+
+
+def history_entry(
+    ctx: ChatContext, index: int, encoder: IHistoryEncoder
+) -> tuple[int, str, str]:
+    """Converts the message at `index` of the history to a history entry (index, user, message)"""
+    return encoder.encode_message(
+        index, ctx.message_history[index], ctx.message_history
     )
 
 
-def generate_gpt_query(ctx: ChatContext, logger: logging.Logger) -> str:
+def history_entries(
+    ctx: ChatContext, encoder: IHistoryEncoder
+) -> Iterator[tuple[int, str, str]]:
+    """Yields the history entries (newest first) that are candidates for the prompt.
+    The last message is not part of the history as it is the current prompt.
+    Args:
+        ctx: the chat context to take the message history from
+        encoder: the encoder to render the messages with
+    Returns:
+        tuples of (message index, user, message)
     """
-    Generates a query / prompt for GPT-3
-    :param ctx:
-    :param logger:
-    :return:
+    for index in range(len(ctx.message_history) - 2, -1, -1):
+        yield history_entry(ctx, index, encoder)
+
+
+def select_history_window(
+    entries: Iterable[tuple[int, str, str]],
+    max_tokens: int,
+    model: str,
+    logger: logging.Logger,
+    cache: TokenCountCache | None = None,
+    encoder: IHistoryEncoder = VERBOSE_ENCODER,
+) -> tuple[list[tuple[int, str, str]], int]:
+    """Selects the most recent history entries that fit into `max_tokens` when joined
+    via `conversation_history_to_str`.
+    Every entry is tokenized once (together with the newline separating it from the next entry)
+    and the per-entry counts are summed up to find the cut-off. As the tokenizers never merge
+    tokens across the separating newline of the entry delimiters, the sum equals the count of
+    the joined window. Only estimated counts are not additive, so in that case the boundary is
+    confirmed against the joined window. Either way, the window is the same as when the whole
+    joined history would be re-tokenized after adding every single entry.
+    Args:
+        entries: the history entries, newest first (see `history_entries`)
+        max_tokens: the token budget of the joined history
+        model: the model to count the tokens for
+        logger: the logger to log warnings to
+        cache: a token count cache for the single entries (keyed by their entry number)
+        encoder: the encoder to render the entries with
+    Returns:
+        the selected entries in chronological order and their number of tokens when joined
     """
-    from gpt_commands import GPT_COMMANDS
+    entries = iter(entries)
+    candidates: list[tuple[int, str, str]] = []
+    n_selected: int | None = None
+    n_tokens = 0
+    # index of a selected entry -> tokens saved by the selected entries that get shorter
+    # once it is selected as well (see `IHistoryEncoder.short_form`)
+    savings_by_index: dict[int, int] = {}
+    while n_selected is None:
+        chunk = [*itertools.islice(entries, _HISTORY_CHUNK_SIZE)]
+        if not chunk:
+            n_selected = len(candidates)
+            break
 
-    storage = [*ctx.key_storage_backend.list()]
-    pos = len(ctx.message_history)
-    conversations = []
-    if len(ctx.message_history) > 1:
-        for i in reversed(ctx.message_history[:-1]):
-            conversations.append(
-                (
-                    pos,
-                    i.user if isinstance(i, UserMessage) else "assistant",
-                    i.user_response
-                    if isinstance(i, UserMessage)
-                    else json.dumps(i.dict()),
+        # the newest entry is the last one in the joined history (no separator after it)
+        separators = ["\n" if candidates or n > 0 else "" for n in range(len(chunk))]
+        short_forms = [encoder.short_form(entry[0]) for entry in chunk]
+        shortened = [
+            (n, short) for n, short in enumerate(short_forms) if short is not None
+        ]
+        counts = count_tokens_many(
+            [
+                encoder.entry_to_str(*entry) + separator
+                for entry, separator in zip(chunk, separators)
+            ]
+            + [
+                encoder.entry_to_str(chunk[n][0], chunk[n][1], short_msg) + separators[n]
+                for n, (_, short_msg) in shortened
+            ],
+            model=model,
+            logger=logger,
+            cache=cache,
+            slots=[entry[0] for entry in chunk] + [chunk[n][0] for n, _ in shortened],
+        )
+        chunk_tokens = counts[: len(chunk)]
+        short_tokens = dict(zip((n for n, _ in shortened), counts[len(chunk) :]))
+        for n, entry_tokens in enumerate(chunk_tokens):
+            index = chunk[n][0]
+            # the window is contiguous: with this entry, the newer ones referring to it are complete
+            entry_tokens -= savings_by_index.pop(index, 0)
+            if n_tokens + entry_tokens > max_tokens:
+                n_selected = len(candidates) + n
+                break
+            n_tokens += entry_tokens
+            if n in short_tokens:
+                first_index = short_forms[n][0]
+                savings_by_index[first_index] = savings_by_index.get(first_index, 0) + (
+                    chunk_tokens[n] - short_tokens[n]
                 )
-            )
-            conversations_str = conversation_history_to_str(conversations)
-            n_tokens = count_tokens(
-                text=conversations_str, model=ctx.settings.model, logger=logger
-            )
-            if n_tokens > ctx.settings.max_token_len_history:
-                conversations = conversations[:-1]
+        candidates.extend(chunk)
+
+    if has_tokenizer(model=model, logger=logger):
+        return [*reversed(candidates[:n_selected])], n_tokens
+
+    def fits(n: int) -> bool:
+        text = encoder.history_to_str(candidates[n - 1 :: -1])
+        return count_tokens(text=text, model=model, logger=logger) <= max_tokens
+
+    # the summed up estimations are not the estimation of the joined window,
+    # so move the boundary until the joined window fits and the next entry does not
+    while n_selected > 0 and not fits(n_selected):
+        n_selected -= 1
+
+    while True:
+        if n_selected == len(candidates):
+            next_entry = next(entries, None)
+            if next_entry is None:
                 break
-            pos -= 1
+            candidates.append(next_entry)
+        if not fits(n_selected + 1):
+            break
+        n_selected += 1
 
     # reverse again to be in chronological order
-    conversations = [*reversed(conversations)]
+    window = [*reversed(candidates[:n_selected])]
+    return window, count_tokens(
+        encoder.history_to_str(window), model=model, logger=logger
+    )
+
+
+def select_relevant_history(
+    ctx: ChatContext,
+    query: str,
+    before: int,
+    max_tokens: int,
+    logger: logging.Logger,
+    encoder: IHistoryEncoder,
+) -> tuple[list[tuple[int, str, str]], int]:
+    """Selects the history entries most relevant (BM25) for a query that fit into `max_tokens`.
+    Args:
+        ctx: the chat context (its history index is brought up to date)
+        query: the text to rank the entries for (e.g., the current prompt)
+        before: only consider messages with an index below that (i.e., not in the recent window)
+        max_tokens: the token budget of the selected entries
+        logger: the logger to log warnings to
+        encoder: the encoder to render the entries with
+    Returns:
+        the selected entries in chronological order and their number of tokens
+        (including the separating newlines)
+    """
+    if before <= 0 or max_tokens <= 0:
+        return [], 0
+
+    ctx.history_index.sync(ctx.message_history)
+    ranked = ctx.history_index.top(query, before=before)
+
+    selected: list[tuple[int, str, str]] = []
+    n_tokens = 0
+    for start in range(0, len(ranked), _HISTORY_CHUNK_SIZE):
+        chunk = [
+            history_entry(ctx, index, encoder)
+            for index, _ in ranked[start : start + _HISTORY_CHUNK_SIZE]
+        ]
+        chunk_tokens = count_tokens_many(
+            [encoder.entry_to_str(*entry) + "\n" for entry in chunk],
+            model=ctx.settings.model,
+            logger=logger,
+            cache=ctx.token_cache,
+            slots=[entry[0] for entry in chunk],
+        )
+        for entry, entry_tokens in zip(chunk, chunk_tokens):
+            if n_tokens + entry_tokens > max_tokens:
+                # a smaller (less relevant) entry might still fit, but keep it cheap
+                return sorted(selected), n_tokens
+            selected.append(entry)
+            n_tokens += entry_tokens
+
+    return sorted(selected), n_tokens
+
+
+def history_summary_to_str(ctx: ChatContext) -> str:
+    """Renders the rolling summary of the earlier conversation for the prompt
+    (empty if there is none). It is cut to `history_summary_max_tokens` (estimated).
+    """
+    summary = ctx.history_summary
+    if not ctx.settings.history_summary or summary.is_empty():
+        return ""
 
-    conversations_str = conversation_history_to_str(conversations)
+    text = summary.text
+    max_chars = ctx.settings.history_summary_max_tokens * 4
+    if len(text) > max_chars:
+        text = text[:max_chars] + " [...]"
+
+    return (
+        f"Summary of the earlier conversation (messages #0 to #{summary.n_summarized - 1}):\n"
+        f"{text}\n\n"
+    )
+
+
+def storage_keys_to_str(ctx: ChatContext, relevant_for: str) -> str:
+    """Lists the storage keys for the prompt. With more than `max_storage_keys` keys only
+    the ones most relevant for `relevant_for` (and the most recently used) are listed,
+    the others can be found with the `storage_search` command.
+    """
+    # every turn, others may have changed the storage (or a forked conversation inherits keys)
+    ctx.key_index.sync(ctx.key_storage_backend)
+    n_keys = len(ctx.key_index)
+    if n_keys == 0:
+        return "None"
+
+    max_keys = ctx.settings.max_storage_keys
+    if max_keys <= 0 or n_keys <= max_keys:
+        return str(ctx.key_index.keys())
+
+    return (
+        f"{ctx.key_index.top(relevant_for, max_keys)} ({n_keys} keys in total, showing the "
+        f"{max_keys} most relevant and recently used. Use `storage_search` to find the others)"
+    )
+
+
+def command_catalog_to_str(allowed_commands: list[str]) -> str:
+    """Describes all allowed commands and their arguments for the prompt"""
+    from gpt_commands import GPT_COMMANDS
 
     command_str = ""
     for command_name, command in GPT_COMMANDS.items():
-        if command_name in ctx.settings.allowed_commands:
+        if command_name in allowed_commands:
             command_str += f"- `{command_name}` - ({command.description()})\n"
             if command.arguments():
                 command_str += "Args:\n"
@@ -120,6 +415,60 @@ def generate_gpt_query(ctx: ChatContext, logger: logging.Logger) -> str:
             else:
                 command_str += "No args.\n"
 
+    return command_str
+
+
+_COMPILED_QUERY: tuple[tuple, CompiledPrompt] | None = None
+
+
+def compiled_query(ctx: ChatContext, logger: logging.Logger) -> CompiledPrompt:
+    """Returns the query template (of the configured layout) with its static sections (goals, commands and the response
+    template) already rendered. It is only compiled again if the allowed commands or the
+    settings file changed.
+    Args:
+        ctx: the chat context to take the settings from
+        logger: the logger to log warnings to
+    """
+    global _COMPILED_QUERY
+    settings = ctx.settings
+    fingerprint = (
+        str(settings.config_file),
+        settings.modified_ts,
+        tuple(settings.allowed_commands),
+    )
+    if _COMPILED_QUERY is None or _COMPILED_QUERY[0] != fingerprint:
+        logger.debug("Compiling the query template")
+        compiled = CompiledPrompt(
+            template=QUERY_TEMPLATES[settings.prompt_layout],
+            static_sections={
+                "commands": command_catalog_to_str(settings.allowed_commands),
+                "ai_goals": '-'+'-\n- '.join(settings.default_ai_tasks),
+                "base_command": base_command,
+            },
+            model=settings.model,
+            logger=logger,
+        )
+        _COMPILED_QUERY = (fingerprint, compiled)
+
+    return _COMPILED_QUERY[1]
+
+
+def generate_gpt_query(ctx: ChatContext, logger: logging.Logger) -> GptQuery:
+    """
+    Generates a query / prompt for GPT-3
+    :param ctx:
+    :param logger:
+    :return: the query and the number of tokens of each of its sections
+    """
+    try:
+        ctx.settings.reload_if_changed()
+    except SettingsNotReadableException as e:
+        logger.warning(
+            f"Settings changed but couldn't be reloaded due to `{e}`. Keeping the current settings."
+        )
+
+    model = ctx.settings.model
+
     # current context if available (when it is not the first message)
     if len(ctx.message_history) > 0 and ctx.message_history[-1]:
         additional_info = (
@@ -128,7 +477,7 @@ def generate_gpt_query(ctx: ChatContext, logger: logging.Logger) -> str:
             else "None"
         )
         current_prompt = (
-            f"User ({ctx.active_user}): " + ctx.message_history[-1].user_response
+            f"User ({ctx.active_user}): " + ctx.message_history[-1].full_response()
         )
 
     else:
@@ -143,17 +492,16 @@ def generate_gpt_query(ctx: ChatContext, logger: logging.Logger) -> str:
         plan = "Come up with a plan on fulfilling the goals."
         next_steps = ["Initiate the conversation with the human(s)."]
 
-    template = query_template.format(
-        ai_name=ctx.bot_name,
+    storage = storage_keys_to_str(ctx, relevant_for=f"{current_prompt} {plan}")
+
+    compiled = compiled_query(ctx=ctx, logger=logger)
+    dynamic_sections = dict(
         human_names=ctx.users,
-        memory_keys=storage if storage else "None",
+        memory_keys=storage,
         n_history=len(ctx.message_history),
-        history=conversations_str,
-        commands=command_str,
-        curr_date=datetime.datetime.now().strftime("%d/%m/%Y at %H:%M:%S"),
-        base_command='{"command": "the_command", "arguments": {"the":"parameters", ... }, '
-        '"plan": "the effect you want to achieve with your current execution steps", '
-        '"steps": ["details", "of", "steps", "you", "want", "to", "do"]}',
+        curr_date=datetime.datetime.now().strftime(
+            TIMESTAMP_FORMATS[ctx.settings.prompt_timestamp_granularity]
+        ),
         # example_command=json.dumps({'command': 'ask_human',
         #                            'arguments': {'information': 'Hello human! How can I help you?'},
         #                            'plan': 'I want to know what to the human needs.',
@@ -162,29 +510,103 @@ def generate_gpt_query(ctx: ChatContext, logger: logging.Logger) -> str:
         additional_info=additional_info,
         plan=plan,
         next_steps='-'+'\n- '.join(next_steps),
-        ai_goals='-'+'-\n- '.join(ctx.settings.default_ai_tasks),
+        summary=history_summary_to_str(ctx),
     )
 
-    return template
+    # account every part of the prompt to one of the sections
+    (
+        storage_tokens,
+        current_tokens,
+        additional_tokens,
+        summary_tokens,
+        *other_tokens,
+    ) = count_tokens_many(
+        [
+            str(dynamic_sections["memory_keys"]),
+            current_prompt,
+            additional_info,
+            dynamic_sections["summary"],
+            *[
+                str(value)
+                for name, value in dynamic_sections.items()
+                if name not in SECTION_OF_FIELD
+            ],
+        ],
+        model=model,
+        logger=logger,
+    )
+    section_tokens = {
+        SECTION_INSTRUCTIONS: sum(other_tokens),
+        SECTION_COMMANDS: 0,
+        SECTION_STORAGE_KEYS: storage_tokens,
+        SECTION_HISTORY: 0,
+        SECTION_SUMMARY: summary_tokens,
+        SECTION_CURRENT_RESULT: current_tokens,
+        SECTION_ADDITIONAL_INFO: additional_tokens,
+    }
+    for name, n_tokens in compiled.static_tokens.items():
+        section_tokens[SECTION_OF_FIELD.get(name, SECTION_INSTRUCTIONS)] += n_tokens
 
+    # the history gets what is left of the context window
+    role_tokens = count_tokens(
+        ctx.ai_role, model=model, logger=logger, cache=ctx.token_cache
+    )
+    history_budget = history_token_budget(
+        settings=ctx.settings,
+        prompt_tokens=sum(section_tokens.values()) + role_tokens,
+        logger=logger,
+    )
+    encoder = get_history_encoder(ctx.settings)
+    relevant_budget = int(history_budget * ctx.settings.relevant_history_share)
+    conversations, section_tokens[SECTION_HISTORY] = select_history_window(
+        history_entries(ctx, encoder),
+        max_tokens=history_budget - relevant_budget,
+        model=model,
+        logger=logger,
+        cache=ctx.token_cache,
+        encoder=encoder,
+    )
+    # messages below this index are not part of the recent window
+    history_start_index = (
+        conversations[0][0] if conversations else max(len(ctx.message_history) - 1, 0)
+    )
 
-def count_tokens(text: str, model: str, logger: logging.Logger) -> int:
-    """Count the (approximated) number of tokens of a text for a specific model.
-    if the models tokenizer is not available, it will estimate the number of tokens
-     by dividing the length of the text by 4 (estimation)
-     Parameters:
-        text: the text to count the tokens for
-        model: the model to count the tokens for
-        logger: the logger to log warnings to
-    Returns:
-        the (maybe estimated) number of tokens
-    """
-    # To get the tokenizer corresponding to a specific model in the OpenAI API:
-    try:
-        enc = tiktoken.encoding_for_model(model)
-        return len(enc.encode(text))
-    except Exception as e:
-        logger.warning(
-            f"Could not get tokenizer for model `{model}`: `{e}`. Will estimate tokens."
+    # older entries (not in the recent window) that are relevant for the current prompt
+    if relevant_budget > 0:
+        relevant, relevant_tokens = select_relevant_history(
+            ctx=ctx,
+            query=f"{current_prompt} {additional_info}",
+            before=history_start_index,
+            max_tokens=relevant_budget,
+            logger=logger,
+            encoder=encoder,
         )
-        return len(text) // 4 + 1
+        conversations = relevant + conversations
+        section_tokens[SECTION_HISTORY] += relevant_tokens
+    template = compiled.render(
+        ai_name=ctx.bot_name,
+        history=encoder.history_to_str(conversations),
+        **dynamic_sections,
+    )
+
+    query = GptQuery(
+        prompt=template,
+        # the final prompt (tokens may merge across the boundaries of the sections)
+        n_tokens=count_tokens(template, model=model, logger=logger),
+        section_tokens=section_tokens,
+        n_history_entries=len(conversations),
+        history_budget=history_budget,
+        history_start_index=history_start_index,
+    )
+
+    if ctx.settings.report_prefix_stability:
+        if ctx.last_query is not None:
+            query.shared_prefix_tokens = shared_prefix_tokens(
+                ctx.last_query, template, model=model, logger=logger
+            )
+            logger.info(
+                f"The query shares its first {query.shared_prefix_tokens} tokens with the previous query."
+            )
+        ctx.last_query = template
+
+    return query
@@ -1,24 +1,67 @@
+from pathlib import Path
+
 from exceptions.repository_exceptions import RepositoryException
 from repository.file_filestorage_backend import FileFileStorageBackend
 from repository.i_file_storage_backend import IFileStorageBackend
 from repository.i_key_storage_backend import IKeyStorageBackend
+from repository.overlay_file_storage_backend import OverlayFileStorageBackend
+from repository.overlay_key_storage_backend import OverlayKeyStorageBackend
 from utils.app_settings import AppSettings
+from utils.fork_links import read_fork_ids, read_fork_link
+
+_CACHED_KEY_STORAGE_BACKENDS: dict[Path, IKeyStorageBackend] = {}
 
 
 def load_key_storage_backend(
     app_settings: AppSettings, conversation_id: str
 ) -> IKeyStorageBackend:
     """Loads the key storage backend for files from the application settings
+    (shared copy-on-write with the conversations it was forked from or forked to)
     Args:
         app_settings: the application settings
         conversation_id: the id of the conversation
     """
+    backend = _load_own_key_storage_backend(app_settings, conversation_id)
+    link = read_fork_link(app_settings.conversation_path / conversation_id)
+    fork_ids = read_fork_ids(app_settings.conversation_path / conversation_id)
+    if link is None and not fork_ids:
+        return backend
+
+    return OverlayKeyStorageBackend(
+        backend,
+        parent=load_key_storage_backend(app_settings, link.parent_id) if link else None,
+        forks=[_load_own_key_storage_backend(app_settings, fork_id) for fork_id in fork_ids],
+    )
+
+
+def _load_own_key_storage_backend(
+    app_settings: AppSettings, conversation_id: str
+) -> IKeyStorageBackend:
     if app_settings.key_storage_backend == "file":
         from repository.file_key_storage_backend import FileKeyKeyStorageKeyBackend
 
         return FileKeyKeyStorageKeyBackend(
             app_settings.conversation_file_index_storage / conversation_id
         )
+    elif app_settings.key_storage_backend == "cached_file":
+        from repository.cached_file_key_storage_backend import (
+            CachedFileKeyStorageBackend,
+        )
+
+        # one instance per file, so pending changes are seen everywhere in the process
+        path = app_settings.conversation_file_index_storage / conversation_id
+        key = path.resolve()
+        if key not in _CACHED_KEY_STORAGE_BACKENDS:
+            _CACHED_KEY_STORAGE_BACKENDS[key] = CachedFileKeyStorageBackend(
+                path, flush_delay=app_settings.key_storage_flush_delay
+            )
+        return _CACHED_KEY_STORAGE_BACKENDS[key]
+    elif app_settings.key_storage_backend == "sqlite":
+        from repository.sqlite_key_storage_backend import SqliteKeyStorageBackend
+
+        return SqliteKeyStorageBackend(
+            app_settings.conversation_file_index_storage, conversation_id=conversation_id
+        )
     else:
         raise RepositoryException(
             f"Unknown key storage backend `{app_settings.key_storage_backend}`"
@@ -29,14 +72,37 @@ def load_file_storage_backend(
     app_settings: AppSettings, conversation_id: str
 ) -> IFileStorageBackend:
     """Loads the storage backend from the application settings
+    (shared copy-on-write with the conversations it was forked from or forked to)
     Args:
         app_settings: the application settings
         conversation_id: the id of the conversation
     """
+    backend = _load_own_file_storage_backend(app_settings, conversation_id)
+    link = read_fork_link(app_settings.conversation_path / conversation_id)
+    fork_ids = read_fork_ids(app_settings.conversation_path / conversation_id)
+    if link is None and not fork_ids:
+        return backend
+
+    return OverlayFileStorageBackend(
+        backend,
+        parent=load_file_storage_backend(app_settings, link.parent_id) if link else None,
+        forks=[_load_own_file_storage_backend(app_settings, fork_id) for fork_id in fork_ids],
+    )
+
+
+def _load_own_file_storage_backend(
+    app_settings: AppSettings, conversation_id: str
+) -> IFileStorageBackend:
     if app_settings.file_storage_backend == "file":
         return FileFileStorageBackend(
             app_settings.conversation_filesystem_path / conversation_id
         )
+    elif app_settings.file_storage_backend == "sqlite":
+        from repository.sqlite_file_storage_backend import SqliteFileStorageBackend
+
+        return SqliteFileStorageBackend(
+            app_settings.conversation_filesystem_path, conversation_id=conversation_id
+        )
     else:
         raise RepositoryException(
             f"Unknown file storage backend `{app_settings.file_storage_backend}`"
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import datetime
+import json
+import logging
+
+from datatypes.chat_context import ChatContext
+from datatypes.gpt_query import GptQuery
+from utils.history_store import LazyMessageHistory
+
+PROMPT_TELEMETRY_FILE_NAME = "prompt_telemetry.jsonl"
+
+
+def log_prompt_telemetry(
+    ctx: ChatContext,
+    query: GptQuery,
+    response_tokens: int | None,
+    logger: logging.Logger,
+):
+    """Appends the token accounting of one turn as JSON line to the telemetry file of the
+    conversation (if enabled in the settings). Errors are only logged, as the telemetry
+    must never interrupt the conversation.
+    Args:
+        ctx: the chat context the query was generated for
+        query: the query sent to the model
+        response_tokens: the number of tokens of the response (None if there was no response)
+        logger: the logger to log errors to
+    """
+    if not ctx.settings.prompt_telemetry:
+        return
+
+    record = {
+        "ts": datetime.datetime.now().timestamp(),
+        "message_index": len(ctx.message_history),
+        "model": ctx.settings.model,
+        "history_budget": query.history_budget,
+        "n_history_entries": query.n_history_entries,
+        "section_tokens": query.section_tokens,
+        "prompt_tokens": query.n_tokens,
+        "response_tokens": response_tokens,
+        "shared_prefix_tokens": query.shared_prefix_tokens,
+    }
+    if isinstance(ctx.message_history, LazyMessageHistory):
+        record["history_memory"] = ctx.message_history.memory_report()
+    conversation_path = ctx.settings.conversation_path / ctx.conversation_id
+    try:
+        conversation_path.mkdir(exist_ok=True)
+        with open(conversation_path / PROMPT_TELEMETRY_FILE_NAME, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    except Exception as e:
+        logger.warning(f"Couldn't write prompt telemetry due to `{e}`")
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+from utils.files import write_atomic
+
+TOKEN_CACHE_FILE_NAME = "token_counts.json"
+
+
+class TokenCountCache:
+    """Remembers token counts of texts by model and content hash.
+    Entries may belong to a slot (the number of the history entry they were counted for),
+    so they can be evicted as soon as the message behind them does not exist anymore.
+    The cache is stored as a sidecar file next to the conversation.
+    """
+
+    _counts: dict[str, list[int | None]]  # key -> [n_tokens, slot]
+    _slots: dict[tuple[str, int], str]  # (model, slot) -> key
+
+    def __init__(self):
+        self._counts = {}
+        self._slots = {}
+        self._dirty = False
+
+    @staticmethod
+    def _key(model: str, text: str) -> str:
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+        return f"{model}:{digest}"
+
+    @property
+    def dirty(self) -> bool:
+        """Whether the cache changed since it was loaded or saved the last time"""
+        return self._dirty
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def get(self, model: str, text: str) -> int | None:
+        """Returns the cached token count of a text or None if it is not cached"""
+        entry = self._counts.get(self._key(model, text))
+        return entry[0] if entry else None
+
+    def put(self, model: str, text: str, n_tokens: int, slot: int | None = None):
+        """Caches the token count of a text
+        Args:
+            model: the model the tokens were counted for
+            text: the counted text
+            n_tokens: the number of tokens
+            slot: the history entry the text belongs to. A different text cached for the
+             same slot before is evicted
+        """
+        key = self._key(model, text)
+        if slot is not None:
+            old_key = self._slots.get((model, slot))
+            if old_key is not None and old_key != key:
+                self._counts.pop(old_key, None)
+            self._slots[(model, slot)] = key
+
+        self._counts[key] = [n_tokens, slot]
+        self._dirty = True
+
+    def evict(self, max_slot: int) -> int:
+        """Evicts all entries belonging to a slot greater than `max_slot`
+        (i.e., to messages that do not exist anymore)
+        Returns:
+            the number of evicted entries
+        """
+        stale = [
+            (model, slot) for (model, slot) in self._slots.keys() if slot > max_slot
+        ]
+        for model, slot in stale:
+            self._counts.pop(self._slots.pop((model, slot)), None)
+
+        if stale:
+            self._dirty = True
+
+        return len(stale)
+
+    def export(self) -> bytes | None:
+        """Serializes the cache if anything changed since it was loaded or exported the last time
+        Returns:
+            the content of the cache file or None if nothing changed
+        """
+        if not self._dirty:
+            return None
+
+        self._dirty = False
+        return json.dumps({"version": 1, "counts": self._counts}).encode("utf-8")
+
+    def save(self, path: Path):
+        """Saves the cache to a file (if anything changed)"""
+        data = self.export()
+        if data is not None:
+            write_atomic(path, data)
+
+    @classmethod
+    def load(cls, path: Path, logger: logging.Logger) -> TokenCountCache:
+        """Loads the cache from a file. A missing or unreadable file results in an empty cache"""
+        cache = cls()
+        if not path.is_file():
+            return cache
+
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            for key, (n_tokens, slot) in data["counts"].items():
+                cache._counts[key] = [n_tokens, slot]
+                if slot is not None:
+                    cache._slots[(key.rsplit(":", 1)[0], slot)] = key
+        except Exception as e:
+            logger.warning(
+                f"Couldn't read token count cache `{path!s}` due to `{e}`. Starting with an empty one."
+            )
+            cache = cls()
+
+        return cache
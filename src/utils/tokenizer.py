@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import logging
+import threading
+
+import tiktoken
+
+from utils.token_cache import TokenCountCache
+
+
+class TokenizerRegistry:
+    """Resolves the tokenizer of every model only once.
+    Models without a known tokenizer are remembered as well, so they are estimated
+    right away without trying (and warning) again.
+    """
+
+    _encoders: dict[str, tiktoken.Encoding | None]
+
+    def __init__(self):
+        self._encoders = {}
+        self._lock = threading.Lock()
+
+    def encoder_for(
+        self, model: str, logger: logging.Logger
+    ) -> tiktoken.Encoding | None:
+        """Returns the tokenizer for a model
+        Args:
+            model: the model to get the tokenizer for
+            logger: the logger to log a warning to if the tokenizer is not available
+        Returns:
+            the tokenizer or None if there is no tokenizer available for the model
+        """
+        try:
+            return self._encoders[model]
+        except KeyError:
+            pass
+
+        with self._lock:
+            if model not in self._encoders:
+                try:
+                    self._encoders[model] = tiktoken.encoding_for_model(model)
+                except Exception as e:
+                    logger.warning(
+                        f"Could not get tokenizer for model `{model}`: `{e}`. Will estimate tokens."
+                    )
+                    self._encoders[model] = None
+
+            return self._encoders[model]
+
+    def count_tokens(
+        self,
+        text: str,
+        model: str,
+        logger: logging.Logger,
+        cache: TokenCountCache | None = None,
+    ) -> int:
+        """Count the (approximated) number of tokens of a text for a specific model.
+        Parameters:
+            text: the text to count the tokens for
+            model: the model to count the tokens for
+            logger: the logger to log warnings to
+            cache: a token count cache to consult (and fill) if given
+        Returns:
+            the (maybe estimated) number of tokens
+        """
+        if cache is not None:
+            n_tokens = cache.get(model=model, text=text)
+            if n_tokens is None:
+                n_tokens = self.count_tokens(text=text, model=model, logger=logger)
+                cache.put(model=model, text=text, n_tokens=n_tokens)
+            return n_tokens
+
+        enc = self.encoder_for(model=model, logger=logger)
+        if enc is None:
+            return estimate_tokens(text)
+
+        try:
+            return len(enc.encode(text))
+        except Exception as e:
+            logger.debug(f"Could not tokenize text: `{e}`. Will estimate tokens.")
+            return estimate_tokens(text)
+
+    def count_tokens_many(
+        self,
+        texts: list[str],
+        model: str,
+        logger: logging.Logger,
+        num_threads: int = 8,
+        cache: TokenCountCache | None = None,
+        slots: list[int] | None = None,
+    ) -> list[int]:
+        """Count the (approximated) number of tokens of many texts at once.
+        The texts are tokenized in parallel using the batch encoding of the tokenizer.
+        Parameters:
+            texts: the texts to count the tokens for
+            model: the model to count the tokens for
+            logger: the logger to log warnings to
+            num_threads: the number of threads to tokenize with
+            cache: a token count cache to consult (and fill) if given
+            slots: the history entries the texts belong to (see `TokenCountCache.put`)
+        Returns:
+            the (maybe estimated) number of tokens for every text (in the same order)
+        """
+        if cache is not None:
+            counts = [cache.get(model=model, text=text) for text in texts]
+            missing = [n for n, n_tokens in enumerate(counts) if n_tokens is None]
+            if missing:
+                missing_counts = self.count_tokens_many(
+                    texts=[texts[n] for n in missing],
+                    model=model,
+                    logger=logger,
+                    num_threads=num_threads,
+                )
+                for n, n_tokens in zip(missing, missing_counts):
+                    counts[n] = n_tokens
+                    cache.put(
+                        model=model,
+                        text=texts[n],
+                        n_tokens=n_tokens,
+                        slot=slots[n] if slots else None,
+                    )
+            return counts
+
+        enc = self.encoder_for(model=model, logger=logger)
+        if enc is None:
+            return [estimate_tokens(text) for text in texts]
+
+        try:
+            return [
+                len(tokens) for tokens in enc.encode_batch(texts, num_threads=num_threads)
+            ]
+        except Exception as e:
+            # one of the texts can not be tokenized (e.g., special tokens), go one by one
+            logger.debug(f"Could not tokenize texts as batch: `{e}`.")
+            return [
+                self.count_tokens(text=text, model=model, logger=logger)
+                for text in texts
+            ]
+
+
+_TOKENIZER_REGISTRY: TokenizerRegistry | None = None
+
+
+def get_tokenizer_registry() -> TokenizerRegistry:
+    global _TOKENIZER_REGISTRY
+    if _TOKENIZER_REGISTRY is None:
+        _TOKENIZER_REGISTRY = TokenizerRegistry()
+
+    return _TOKENIZER_REGISTRY
+
+
+def has_tokenizer(model: str, logger: logging.Logger) -> bool:
+    """Whether the tokens of the model can be counted exactly (or are estimated otherwise)"""
+    return get_tokenizer_registry().encoder_for(model=model, logger=logger) is not None
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of tokens by dividing the length of the text by 4"""
+    return len(text) // 4 + 1
+
+
+def count_tokens(
+    text: str,
+    model: str,
+    logger: logging.Logger,
+    cache: TokenCountCache | None = None,
+) -> int:
+    """Count the (approximated) number of tokens of a text for a specific model.
+    if the models tokenizer is not available, it will estimate the number of tokens
+     by dividing the length of the text by 4 (estimation)
+     Parameters:
+        text: the text to count the tokens for
+        model: the model to count the tokens for
+        logger: the logger to log warnings to
+        cache: a token count cache to consult (and fill) if given
+    Returns:
+        the (maybe estimated) number of tokens
+    """
+    return get_tokenizer_registry().count_tokens(
+        text=text, model=model, logger=logger, cache=cache
+    )
+
+
+def count_tokens_many(
+    texts: list[str],
+    model: str,
+    logger: logging.Logger,
+    num_threads: int = 8,
+    cache: TokenCountCache | None = None,
+    slots: list[int] | None = None,
+) -> list[int]:
+    """Count the (approximated) number of tokens of many texts using the batch encoding
+    of the models tokenizer (see `TokenizerRegistry.count_tokens_many`)
+    """
+    return get_tokenizer_registry().count_tokens_many(
+        texts=texts,
+        model=model,
+        logger=logger,
+        num_threads=num_threads,
+        cache=cache,
+        slots=slots,
+    )
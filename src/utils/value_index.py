@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from repository.i_key_storage_backend import IKeyStorageBackend
+from utils.key_index import WORD_PATTERN
+
+# weight of the character trigrams (catch inflections and typos) relative to the words
+_TRIGRAM_WEIGHT = 0.5
+
+
+def _features(text: str) -> Counter:
+    """The words, word pairs and character trigrams of the words of a text (with counts)"""
+    words = WORD_PATTERN.findall(text.lower())
+    features = Counter(words)
+    features.update(f"{first} {second}" for first, second in zip(words, words[1:]))
+    for word in words:
+        padded = f"#{word}#"
+        for i in range(len(padded) - 2):
+            features[f"#3{padded[i:i + 3]}"] += _TRIGRAM_WEIGHT
+    return features
+
+
+def embed(text: str, dimensions: int) -> np.ndarray:
+    """Maps a text to a normalized vector by hashing its features into `dimensions` buckets
+    (the sign of a feature is hashed as well, so collisions cancel out instead of adding up).
+    Feature counts are damped logarithmically.
+    """
+    features = _features(text)
+    hashes = np.fromiter(
+        (zlib.crc32(feature.encode("utf-8")) for feature in features),
+        dtype=np.uint32,
+        count=len(features),
+    )
+    weights = np.log1p(np.fromiter(features.values(), dtype=np.float64, count=len(features)))
+    signs = np.where(hashes & 0x80000000, 1.0, -1.0)
+    vector = np.bincount(
+        hashes % dimensions, weights=signs * weights, minlength=dimensions
+    ).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class StorageValueIndex:
+    """Semantic index over the values of the key storage of a conversation.
+    Every key (with its value) is a row of a matrix of hashed n-gram vectors, so a query is
+    ranked against all of them in a single matrix product (cosine similarity). Everything is
+    computed locally.
+    It is kept current by the storage commands (`put`, `remove`), `sync` catches up with the
+    keys others wrote, changed or deleted (a hash of every value tells which values changed).
+    """
+
+    def __init__(self, dimensions: int = 1024):
+        self._dimensions = dimensions
+        self._matrix = np.zeros((0, dimensions), dtype=np.float32)
+        self._keys: list[str | None] = []  # key of each row (None: free)
+        self._rows: dict[str, int] = {}  # key -> row
+        self._free: list[int] = []
+        self._hashes: dict[str, int] = {}  # key -> hash of the indexed value
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def sync(self, backend: IKeyStorageBackend):
+        """Brings the index up to date with the storage: adds the keys written, embeds the values
+        changed again and drops the keys deleted by others (or inherited from a forked
+        conversation). Unchanged values are not embedded again."""
+        keys = set()
+        for key, value in backend.items():
+            keys.add(key)
+            if self._hashes.get(key) != hash(value):
+                self.put(key, value)
+        for key in [key for key in self._rows if key not in keys]:
+            self.remove(key)
+
+    def put(self, key: str, value: str):
+        """Adds a key or replaces its value"""
+        row = self._rows.get(key)
+        if row is None:
+            row = self._free.pop() if self._free else self._append_row()
+            self._rows[key] = row
+            self._keys[row] = key
+        # the key often says what the value is about
+        self._matrix[row] = embed(f"{key} {value}", self._dimensions)
+        self._hashes[key] = hash(value)
+
+    def _append_row(self) -> int:
+        row = len(self._keys)
+        if row == len(self._matrix):
+            # grow geometrically (amortized constant cost per put)
+            grown = np.zeros((max(16, 2 * row), self._dimensions), dtype=np.float32)
+            grown[:row] = self._matrix
+            self._matrix = grown
+        self._keys.append(None)
+        return row
+
+    def remove(self, key: str):
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+        del self._hashes[key]
+        self._matrix[row] = 0.0
+        self._keys[row] = None
+        self._free.append(row)
+
+    def search(self, query: str, limit: int = 5, min_score: float = 0.05) -> list[tuple[str, float]]:
+        """The keys whose values are most similar to `query`
+        Returns:
+            (key, cosine similarity), the best match first
+        """
+        n_rows = len(self._keys)
+        if not self._rows or limit <= 0:
+            return []
+        scores = self._matrix[:n_rows] @ embed(query, self._dimensions)
+        limit = min(limit, n_rows)
+        # only the best `limit` rows are sorted
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        best = best[np.argsort(-scores[best])]
+        return [
+            (self._keys[row], float(scores[row]))
+            for row in best
+            if self._keys[row] is not None and scores[row] >= min_score
+        ]